@@ -0,0 +1,329 @@
+"""
+Analyses en tâche de fond : POST /analyze avec "background": true répond tout de suite (202)
+avec l'identifiant d'un job ; un pool de workers locaux l'exécute (même chemin que /analyze :
+cache, ré-analyse incrémentale, routage, persist) et le résultat (FormAnalysisResponse) est
+conservé dans le store SQLite, lu par GET /jobs/{id} ou suivi par GET /jobs/{id}/events (SSE).
+Aucune connexion HTTP n'attend l'appel LLM : un proxy qui coupe à 30 s ne fait plus perdre l'analyse.
+
+File bornée à deux priorités : les analyses interactives passent avant les ré-analyses en masse
+(bulk), qui ne peuvent occuper qu'une part de la file. File pleine : 429 + Retry-After.
+Jobs d'un worker arrêté (ou sans signe de vie) : repris par un autre worker ou au redémarrage.
+"""
+import os
+import json
+import math
+import uuid
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from models import AnalyzeRequest
+from store import UseCaseStore
+
+logger = logging.getLogger(__name__)
+
+# Priorités (plus petit = servi d'abord)
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+# Intervalle (s) de relecture du store pour un job exécuté par un autre worker
+POLL_INTERVAL = 0.5
+
+
+class QueueFull(Exception):
+    """File des analyses en tâche de fond pleine : 429 avec Retry-After"""
+    status_code = 429
+
+    def __init__(self, retry_after: int, priority: str, limit: int):
+        super().__init__(f"File d'analyses pleine ({limit} jobs {priority} en attente max), réessayer dans {retry_after}s")
+        self.retry_after = retry_after
+
+
+class IdempotencyConflict(Exception):
+    """Idempotency-Key déjà utilisé pour un job dont la requête diffère : 422"""
+    status_code = 422
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Idempotency-Key déjà utilisé par le job {job_id} avec une autre requête")
+        self.job_id = job_id
+
+
+class JobFailed(Exception):
+    """Échec d'un job, avec le code HTTP qu'aurait renvoyé /analyze"""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def public_job(row: dict) -> dict:
+    """Job tel que renvoyé par l'API : sans la requête, résultat et route décodés"""
+    job = {k: v for k, v in row.items() if k not in ("request", "idempotency_key", "submit_key", "request_hash", "owner")}
+    for field in ("result", "route"):
+        if job.get(field):
+            job[field] = json.loads(job[field])
+    return job
+
+
+def _request_hash(request: str) -> str:
+    """Empreinte de la requête sérialisée (AnalyzeRequest.model_dump_json) d'un job"""
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class AnalysisJobQueue:
+    """
+    File à priorités + pool de workers asyncio du process.
+    run : (AnalyzeRequest, Idempotency-Key) -> {"result": FormAnalysisResponse, "use_case_id", "route"},
+    lève JobFailed (code HTTP + message) en cas d'échec.
+    """
+
+    def __init__(
+        self,
+        store: UseCaseStore,
+        run: Callable[[AnalyzeRequest, Optional[str]], Awaitable[dict]],
+        workers: int = 4,
+        max_queued: int = 200,
+        bulk_share: float = 0.75,
+        stale_after: float = 600,
+        retention_days: float = 7,
+    ):
+        self.store = store
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        # Les jobs bulk ne remplissent pas toute la file : de la place reste pour l'interactif
+        self.limits = {"interactive": max_queued, "bulk": max(1, int(max_queued * bulk_share))}
+        self.stale_after = stale_after
+        self.retention_days = retention_days
+        # Propriétaire des jobs dans le store : ce process (pid + démarrage)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._queued: Dict[str, int] = {name: 0 for name in PRIORITIES}
+        self._seq = 0
+        self._done: Dict[str, asyncio.Event] = {}
+        self._tasks = []
+        # Durée moyenne d'un job (s), pour estimer Retry-After
+        self._avg_seconds = 10.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    # ---------- Cycle de vie ----------
+
+    async def start(self):
+        """Reprise des jobs orphelins, purge des anciens, puis démarrage des workers et de la maintenance"""
+        if not self.enabled:
+            return
+        self._queue = asyncio.PriorityQueue()
+        await self.maintain()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._maintain_forever()))
+        logger.info(f"🧵 Analyses en tâche de fond: {self.workers} workers, file de {self.max_queued} jobs "
+                    f"({self.limits['bulk']} bulk max)")
+
+    async def stop(self):
+        """Arrêt : les jobs en attente ou interrompus sont libérés pour un autre worker (ou le prochain démarrage)"""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+            released = await run_in_threadpool(self.store.release_analysis_jobs, self.owner)
+            if released:
+                logger.info(f"🧵 {released} analyses en tâche de fond libérées (reprises au prochain démarrage)")
+
+    async def maintain(self):
+        """Reprend les jobs orphelins (dans la limite de la file) et purge les jobs terminés trop anciens"""
+        stale_before = (datetime.now() - timedelta(seconds=self.stale_after)).isoformat()
+        room = self.max_queued - sum(self._queued.values())
+        if room > 0:
+            for job in await run_in_threadpool(self.store.adopt_analysis_jobs, self.owner, stale_before, room):
+                self._enqueue(job["id"], job["priority"])
+                logger.info(f"🧵 Analyse en tâche de fond {job['id']} reprise")
+        finished_before = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+        await run_in_threadpool(self.store.purge_analysis_jobs, finished_before)
+
+    async def _maintain_forever(self):
+        interval = max(self.stale_after / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.warning(f"⚠️ Maintenance des analyses en tâche de fond: {e}")
+
+    # ---------- Soumission et lecture ----------
+
+    def retry_after(self) -> int:
+        """Délai estimé avant qu'une place se libère : fin d'un job sur l'un des workers"""
+        return max(1, math.ceil(self._avg_seconds / max(self.workers, 1)))
+
+    def _enqueue(self, job_id: str, priority: str):
+        self._seq += 1
+        self._queued[priority] += 1
+        metrics.ANALYSIS_JOBS_QUEUED.inc(priority=priority)
+        self._done.setdefault(job_id, asyncio.Event())
+        self._queue.put_nowait((PRIORITIES[priority], self._seq, job_id, priority, datetime.now()))
+
+    async def submit(self, req: AnalyzeRequest, idempotency_key: Optional[str] = None) -> dict:
+        """
+        Crée le job et le met en file. Même Idempotency-Key et même requête qu'un job existant :
+        ce job est retourné (une soumission répétée après une coupure réseau ne relance rien) ;
+        même Idempotency-Key avec une autre requête : IdempotencyConflict.
+        """
+        request = req.model_dump_json()
+        request_hash = _request_hash(request)
+        submit_key = hashlib.sha256(f"job:{idempotency_key}".encode("utf-8")).hexdigest() if idempotency_key else None
+        if submit_key:
+            existing = await run_in_threadpool(self.store.find_analysis_job, submit_key)
+            if existing:
+                return await self._same_request(existing, request_hash)
+        priority = req.priority
+        limit = self.limits[priority]
+        if self._queued[priority] >= limit or sum(self._queued.values()) >= self.max_queued:
+            metrics.ANALYSIS_JOBS.inc(priority=priority, outcome="rejected")
+            raise QueueFull(self.retry_after(), priority, limit)
+        now = datetime.now().isoformat()
+        job_id = uuid.uuid4().hex
+        stored_id = await run_in_threadpool(self.store.create_analysis_job, {
+            "id": job_id,
+            "status": "queued",
+            "priority": priority,
+            "request": request,
+            "idempotency_key": idempotency_key,
+            "submit_key": submit_key,
+            "request_hash": request_hash,
+            "owner": self.owner,
+            "created_at": now,
+            "updated_at": now,
+        })
+        if stored_id != job_id:
+            # Même Idempotency-Key soumis en parallèle : job créé par l'autre requête
+            return await self._same_request(stored_id, request_hash)
+        self._enqueue(job_id, priority)
+        metrics.ANALYSIS_JOBS.inc(priority=priority, outcome="queued")
+        return await self.get(job_id)
+
+    async def _same_request(self, job_id: str, request_hash: str) -> dict:
+        """Job existant pour cet Idempotency-Key, s'il a été créé par la même requête"""
+        row = await run_in_threadpool(self.store.get_analysis_job, job_id)
+        if (row.get("request_hash") or _request_hash(row["request"])) != request_hash:
+            raise IdempotencyConflict(job_id)
+        return public_job(row)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        row = await run_in_threadpool(self.store.get_analysis_job, job_id)
+        return public_job(row) if row else None
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Annule un job encore en attente (sans effet sur un job en cours ou terminé)"""
+        cancelled = await run_in_threadpool(self.store.cancel_analysis_job, job_id)
+        job = await self.get(job_id)
+        if cancelled:
+            metrics.ANALYSIS_JOBS.inc(priority=job["priority"], outcome="cancelled")
+            self._set_done(job_id)
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Job après sa fin ou après timeout secondes (relecture du store si un autre worker l'exécute)"""
+        event = self._done.get(job_id)
+        try:
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout)
+            else:
+                await asyncio.sleep(min(POLL_INTERVAL, timeout))
+        except asyncio.TimeoutError:
+            pass
+        return await self.get(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": dict(self._queued),
+            "limits": self.limits,
+            "avg_job_seconds": round(self._avg_seconds, 2),
+        }
+
+    # ---------- Exécution ----------
+
+    def _set_done(self, job_id: str):
+        event = self._done.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self):
+        while True:
+            _, _, job_id, priority, queued_at = await self._queue.get()
+            self._queued[priority] -= 1
+            metrics.ANALYSIS_JOBS_QUEUED.dec(priority=priority)
+            try:
+                await self._execute(job_id, priority, queued_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Analyse en tâche de fond {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, job_id: str, priority: str, queued_at: datetime):
+        if not await run_in_threadpool(self.store.claim_analysis_job, job_id, self.owner):
+            # Annulé, ou repris par un autre worker entre-temps
+            self._set_done(job_id)
+            return
+        metrics.ANALYSIS_JOB_WAIT.observe((datetime.now() - queued_at).total_seconds(), priority=priority)
+        row = await run_in_threadpool(self.store.get_analysis_job, job_id)
+        start = asyncio.get_running_loop().time()
+        fields = {}
+        try:
+            req = AnalyzeRequest.model_validate_json(row["request"])
+            task = asyncio.ensure_future(self.run(req, row["idempotency_key"]))
+            try:
+                # Signe de vie régulier : un job long n'est pas pris pour un orphelin
+                while not (await asyncio.wait({task}, timeout=self.stale_after / 3))[0]:
+                    await run_in_threadpool(self.store.update_analysis_job, job_id)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            outcome = task.result()
+            fields = {
+                "status": "succeeded",
+                "result": outcome["result"].model_dump_json(),
+                "use_case_id": outcome.get("use_case_id"),
+                "route": json.dumps(outcome.get("route"), ensure_ascii=False) if outcome.get("route") else None,
+            }
+        except JobFailed as e:
+            fields = {"status": "failed", "error": e.detail[:500], "error_status": e.status}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            fields = {"status": "failed", "error": f"{type(e).__name__}: {e}"[:500], "error_status": 500}
+        seconds = asyncio.get_running_loop().time() - start
+        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+        await run_in_threadpool(self.store.update_analysis_job, job_id,
+                                finished_at=datetime.now().isoformat(), **fields)
+        metrics.ANALYSIS_JOBS.inc(priority=priority, outcome=fields["status"])
+        self._set_done(job_id)
+        if fields["status"] == "succeeded":
+            logger.info(f"🧵 Analyse en tâche de fond {job_id} ({priority}) terminée en {seconds:.1f}s")
+        else:
+            logger.warning(f"⚠️ Analyse en tâche de fond {job_id} ({priority}) en échec: {fields['error']}")
+
+
+def queue_from_env(store: UseCaseStore, run: Callable[[AnalyzeRequest, Optional[str]], Awaitable[dict]]) -> AnalysisJobQueue:
+    """ANALYSIS_JOBS_WORKERS=0 désactive le mode tâche de fond (/analyze "background": true -> 400)"""
+    return AnalysisJobQueue(
+        store,
+        run,
+        workers=int(os.environ.get("ANALYSIS_JOBS_WORKERS", "4")),
+        max_queued=int(os.environ.get("ANALYSIS_JOBS_MAX_QUEUED", "200")),
+        bulk_share=float(os.environ.get("ANALYSIS_JOBS_BULK_SHARE", "0.75")),
+        stale_after=float(os.environ.get("ANALYSIS_JOBS_STALE_AFTER", "600")),
+        retention_days=float(os.environ.get("ANALYSIS_JOBS_RETENTION_DAYS", "7")),
+    )
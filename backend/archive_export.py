@@ -0,0 +1,458 @@
+"""
+Export colonnaire de l'archive des use cases (Apache Arrow IPC ou Parquet)
+metadata, form_data et ai_analysis sont aplatis en colonnes typées. pain_points, benefits,
+elements_sources.types, pros/cons et phases deviennent des listes. Les chaînes répétées
+(département, priorité, catégories...) sont encodées en dictionnaire et les fichiers compressés (zstd).
+Lecture par memory-map avec projection de colonnes : un tableau de bord scanne l'archive sans
+relire ni parser le JSON.
+
+Synchronisation incrémentale : chaque sync ajoute un segment avec les use cases écrits depuis
+la précédente (rowid SQLite > dernier exporté). Un use case remplacé (ré-analyse, sauvegarde
+répétée) est réexporté dans le segment suivant : seule sa dernière version est lue. Au-delà de
+ARCHIVE_EXPORT_MAX_SEGMENTS segments, l'export est recompacté en un seul fichier.
+
+Usage CLI (depuis backend/):
+    python archive_export.py export [--format parquet]   # export complet (remplace l'existant)
+    python archive_export.py sync                        # ajoute les use cases écrits depuis le dernier export
+    python archive_export.py scan                        # temps de lecture et agrégats du portefeuille
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import logging
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None  # export indisponible : pip install pyarrow
+
+from store import UseCaseStore, _index_columns, _score_value
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"arrow": ".arrow", "parquet": ".parquet"}
+MANIFEST = "manifest.json"
+# Version du schéma aplati : un export d'une autre version est reconstruit au prochain sync
+SCHEMA_VERSION = 1
+
+
+def check_available():
+    if pa is None:
+        raise RuntimeError("Package pyarrow manquant (pip install pyarrow)")
+
+
+# ==================== SCHÉMA ====================
+
+def _schema():
+    """Schéma aplati ; chaînes répétées en dictionary<int32, string>"""
+    text = pa.string()
+    category = pa.dictionary(pa.int32(), pa.string())
+    argument = pa.struct([("argument", text), ("weight", category)])
+    return pa.schema([
+        # metadata (mêmes règles que les colonnes indexées SQLite)
+        ("rowid", pa.int64()),
+        ("id", text),
+        ("saved_at", pa.timestamp("us")),
+        ("project_name", text),
+        ("persona", text),
+        ("role", category),
+        ("department", category),
+        ("priority", category),
+        ("faisabilite", pa.int16()),
+        ("urgence", pa.int16()),
+        ("etp", pa.float64()),
+        ("rules_version", category),
+        ("routing_tier", category),
+        ("routing_model", category),
+        ("routing_source", category),
+        # form_data
+        ("brief_utilisateur", text),
+        ("execution_actuelle", text),
+        ("frequence_besoin", category),
+        ("nb_executions_par_occurrence", category),
+        ("temps_execution_unitaire", category),
+        ("nb_personnes_executantes", category),
+        ("niveau_irritant", category),
+        ("pourquoi_irritant", text),
+        ("pourquoi_urgent", text),
+        ("elements_sources", text),
+        ("action_manuelle", category),
+        ("exemple_action_manuelle", text),
+        ("regles_simples_stables", category),
+        ("points_complexes_detailles", text),
+        ("complexite_organisationnelle", category),
+        ("outils_necessaires", text),
+        # ai_analysis
+        ("user_story_html", text),
+        ("user_story_word_count", pa.int16()),
+        ("ascii_diagram", text),
+        ("source_types", pa.list_(pa.struct([("category", category), ("description", text)]))),
+        ("source_categories", pa.list_(category)),
+        ("sources_count", pa.int16()),
+        ("total_sources", pa.int16()),
+        ("complexity_level", category),
+        ("pain_points", pa.list_(category)),
+        ("benefits", pa.list_(category)),
+        ("feasibility_score", pa.int16()),
+        ("pros", pa.list_(argument)),
+        ("cons", pa.list_(argument)),
+        ("formula", text),
+        ("justification", text),
+        ("gain_temps_mensuel_heures", pa.int32()),
+        ("dev_time", category),
+        ("phases", pa.list_(pa.struct([
+            ("phase", pa.int16()), ("name", text), ("feature_principale", text),
+            ("risque_principal", text), ("duration", category),
+        ]))),
+        ("quick_wins", pa.list_(pa.struct([("action", text), ("impact", text)]))),
+    ])
+
+
+# Colonnes de form_data : (section du payload, champ)
+FORM_COLUMNS = [
+    ("contexte_besoin", "brief_utilisateur"),
+    ("contexte_besoin", "execution_actuelle"),
+    ("volumetrie", "frequence_besoin"),
+    ("volumetrie", "nb_executions_par_occurrence"),
+    ("volumetrie", "temps_execution_unitaire"),
+    ("volumetrie", "nb_personnes_executantes"),
+    ("volumetrie", "niveau_irritant"),
+    ("volumetrie", "pourquoi_irritant"),
+    ("volumetrie", "pourquoi_urgent"),
+    ("nature_tache", "elements_sources"),
+    ("nature_tache", "action_manuelle"),
+    ("nature_tache", "exemple_action_manuelle"),
+    ("nature_tache", "regles_simples_stables"),
+    ("nature_tache", "points_complexes_detailles"),
+    ("nature_tache", "complexite_organisationnelle"),
+    ("nature_tache", "outils_necessaires"),
+]
+
+
+def _text(value) -> Optional[str]:
+    """Réponse du formulaire en texte (anciens payloads : nombres saisis tels quels)"""
+    return None if value is None else str(value)
+
+
+def _saved_at(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def flatten_payload(rowid: int, use_case_id: str, payload: dict) -> dict:
+    """Une ligne de l'export pour un use case (champs absents des anciens payloads -> None)"""
+    columns = _index_columns(payload)
+    routing = payload.get("metadata", {}).get("routing") or {}
+    form = payload.get("form_data", {})
+    ai = payload.get("ai_analysis", {})
+    story = ai.get("user_story", {})
+    sources = ai.get("elements_sources", {})
+    analysis = ai.get("analysis", {})
+    pro_con = ai.get("pro_con", {})
+    scoring = ai.get("scoring", {})
+    delivery = ai.get("delivery", {})
+    types = sources.get("types") or []
+    row = {
+        "rowid": rowid,
+        "id": use_case_id,
+        "saved_at": _saved_at(columns["saved_at"]),
+        "project_name": columns["project_name"],
+        "persona": columns["persona"],
+        "role": columns["role"],
+        "department": columns["department"],
+        "priority": columns["priority"],
+        "faisabilite": columns["faisabilite"],
+        "urgence": columns["urgence"],
+        "etp": columns["etp"],
+        "rules_version": columns["rules_version"],
+        "routing_tier": routing.get("tier"),
+        "routing_model": routing.get("served_by") or routing.get("model"),
+        "routing_source": routing.get("source"),
+        "user_story_html": story.get("html"),
+        "user_story_word_count": story.get("word_count"),
+        "ascii_diagram": ai.get("execution_schema", {}).get("ascii_diagram"),
+        "source_types": types,
+        "source_categories": [t.get("category") for t in types],
+        "sources_count": sources.get("count"),
+        "total_sources": sources.get("total_sources"),
+        "complexity_level": sources.get("complexity_level"),
+        "pain_points": analysis.get("pain_points"),
+        "benefits": analysis.get("benefits"),
+        "feasibility_score": _score_value(analysis.get("feasibility_score")),
+        "pros": pro_con.get("pros"),
+        "cons": pro_con.get("cons"),
+        "formula": scoring.get("formula"),
+        "justification": scoring.get("justification"),
+        "gain_temps_mensuel_heures": scoring.get("gain_temps_mensuel_heures"),
+        "dev_time": delivery.get("dev_time"),
+        "phases": delivery.get("phases"),
+        "quick_wins": delivery.get("quick_wins"),
+    }
+    for section, field in FORM_COLUMNS:
+        row[field] = _text(form.get(section, {}).get(field))
+    return row
+
+
+def build_table(rows: List[dict]):
+    """Table Arrow d'un paquet de lignes aplaties"""
+    schema = _schema()
+    return pa.Table.from_pydict({name: [row[name] for row in rows] for name in schema.names}, schema=schema)
+
+
+def payload_digest(payload: dict) -> str:
+    return f"{zlib.crc32(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')):08x}"
+
+
+def table_from_store(store: UseCaseStore, last_rowid: int = 0, last_digest: Optional[str] = None,
+                     batch_size: int = 5000):
+    """
+    Use cases écrits depuis last_rowid, aplatis (paquets convertis au fil de l'eau) -> (table, empreinte
+    du dernier). La ligne last_rowid est relue : sans AUTOINCREMENT, SQLite redonne son rowid au
+    remplaçant du use case le plus récent ; elle n'est exportée que si son empreinte a changé.
+    """
+    tables, rows = [], []
+    last_payload = None
+    for rowid, use_case_id, payload in store.iter_rows_since(max(0, last_rowid - 1)):
+        last_payload = payload
+        if rowid == last_rowid and payload_digest(payload) == last_digest:
+            continue
+        rows.append(flatten_payload(rowid, use_case_id, payload))
+        if len(rows) >= batch_size:
+            tables.append(build_table(rows))
+            rows = []
+    if rows or not tables:
+        tables.append(build_table(rows))
+    # Un fichier IPC n'admet qu'un dictionnaire par colonne : vocabulaires des paquets fusionnés
+    digest = payload_digest(last_payload) if last_payload is not None else last_digest
+    return pa.concat_tables(tables).unify_dictionaries(), digest
+
+
+# ==================== FICHIERS ====================
+
+def _write(table, path: Path, fmt: str, compression: str):
+    """Écriture atomique d'un segment (fichier temporaire puis renommage)"""
+    tmp = path.with_name(path.name + ".tmp")
+    codec = None if compression == "none" else compression
+    if fmt == "parquet":
+        pq.write_table(table, tmp, compression=codec or "none", use_dictionary=True)
+    else:
+        feather.write_feather(table, tmp, compression=codec or "uncompressed")
+    os.replace(tmp, path)
+
+
+def _read(path: Path, fmt: str, columns: Optional[List[str]] = None):
+    if fmt == "parquet":
+        return pq.read_table(path, columns=columns, memory_map=True)
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+def read_manifest(directory: Path) -> Optional[dict]:
+    try:
+        return json.loads((Path(directory) / MANIFEST).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(directory: Path, manifest: dict):
+    path = Path(directory) / MANIFEST
+    tmp = path.with_name(MANIFEST + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def load_archive(directory: Path, columns: Optional[List[str]] = None):
+    """
+    Table Arrow de l'export (segments lus par memory-map, seules les colonnes demandées sont décodées).
+    Un use case présent dans plusieurs segments n'est gardé que dans sa dernière version (rowid max).
+    """
+    check_available()
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"Aucun export dans {directory} (lancer: python archive_export.py export)")
+    fmt = manifest["format"]
+    wanted = None if columns is None else list(dict.fromkeys(["id", "rowid", *columns]))
+    tables = [_read(directory / segment["file"], fmt, wanted) for segment in manifest["segments"]]
+    table = pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+    if manifest.get("replaced", 0):
+        # Dernière occurrence de chaque id dans l'ordre des segments (un remplaçant peut reprendre le même rowid)
+        positions = pa.table({"id": table["id"], "position": np.arange(table.num_rows)})
+        latest = positions.group_by("id").aggregate([("position", "max")])["position_max"]
+        table = table.take(np.sort(latest.to_numpy()))
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+# ==================== EXPORT ET SYNCHRONISATION ====================
+
+class ArchiveExporter:
+    """Export d'un store vers un dossier (manifest.json + segments), complet ou incrémental"""
+
+    def __init__(self, store: UseCaseStore, directory: Path, fmt: str = "arrow",
+                 compression: str = "zstd", max_segments: int = 16):
+        check_available()
+        if fmt not in FORMATS:
+            raise ValueError(f"Format inconnu: {fmt} (attendu: {', '.join(FORMATS)})")
+        self.store = store
+        self.directory = Path(directory)
+        self.format = fmt
+        self.compression = compression
+        self.max_segments = max_segments
+
+    def export(self) -> dict:
+        """Export complet en un seul segment (remplace l'export existant)"""
+        started = time.perf_counter()
+        table, digest = table_from_store(self.store)
+        manifest = self._replace_segments(table, _max_rowid(table), digest)
+        logger.info(f"📦 Export colonnaire : {table.num_rows} use cases -> {self.directory} "
+                    f"({_size_mb(self.directory, manifest):.1f} Mo, {time.perf_counter() - started:.1f}s)")
+        return manifest
+
+    def sync(self) -> dict:
+        """Ajoute un segment avec les use cases écrits depuis le dernier export (export complet au besoin)"""
+        manifest = read_manifest(self.directory)
+        count, last_rowid = self.store.fingerprint()
+        if (manifest is None or manifest.get("schema_version") != SCHEMA_VERSION
+                or manifest.get("format") != self.format or last_rowid < manifest["last_rowid"]):
+            # Pas d'export, schéma ou format changé, ou base recréée : export complet
+            return self.export()
+        started = time.perf_counter()
+        table, digest = table_from_store(self.store, manifest["last_rowid"], manifest.get("last_digest"))
+        if not table.num_rows:
+            return manifest
+        number = max((segment["number"] for segment in manifest["segments"]), default=0) + 1
+        name = f"part-{number:06d}{FORMATS[self.format]}"
+        _write(table, self.directory / name, self.format, self.compression)
+        manifest["segments"].append({"number": number, "file": name, "rows": table.num_rows})
+        manifest["last_rowid"] = max(manifest["last_rowid"], _max_rowid(table))
+        manifest["last_digest"] = digest
+        # Lignes en plus du nombre de use cases : versions remplacées, filtrées à la lecture
+        manifest["replaced"] = sum(segment["rows"] for segment in manifest["segments"]) - count
+        manifest["synced_at"] = datetime.now().isoformat()
+        _write_manifest(self.directory, manifest)
+        logger.info(f"📦 Sync colonnaire : +{table.num_rows} use cases (segment {name}, "
+                    f"{time.perf_counter() - started:.2f}s)")
+        if len(manifest["segments"]) > self.max_segments:
+            manifest = self.compact()
+        return manifest
+
+    def compact(self) -> dict:
+        """Fusionne les segments en un seul fichier (dernière version de chaque use case)"""
+        manifest = read_manifest(self.directory)
+        table = load_archive(self.directory).unify_dictionaries()
+        manifest = self._replace_segments(table, manifest["last_rowid"], manifest.get("last_digest"))
+        logger.info(f"📦 Export colonnaire recompacté : {table.num_rows} use cases")
+        return manifest
+
+    def _replace_segments(self, table, last_rowid: int, last_digest: Optional[str]) -> dict:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        previous = read_manifest(self.directory)
+        number = max((s["number"] for s in (previous or {}).get("segments", [])), default=0) + 1
+        name = f"part-{number:06d}{FORMATS[self.format]}"
+        _write(table, self.directory / name, self.format, self.compression)
+        manifest = {
+            "schema_version": SCHEMA_VERSION,
+            "format": self.format,
+            "compression": self.compression,
+            "last_rowid": last_rowid,
+            "last_digest": last_digest,
+            "segments": [{"number": number, "file": name, "rows": table.num_rows}],
+            "replaced": 0,
+            "synced_at": datetime.now().isoformat(),
+        }
+        _write_manifest(self.directory, manifest)
+        # Anciens segments supprimés une fois le nouveau manifeste en place
+        for segment in (previous or {}).get("segments", []):
+            (self.directory / segment["file"]).unlink(missing_ok=True)
+        return manifest
+
+
+def _max_rowid(table) -> int:
+    return int(pc.max(table["rowid"]).as_py() or 0) if table.num_rows else 0
+
+
+def _size_mb(directory: Path, manifest: dict) -> float:
+    return sum((directory / s["file"]).stat().st_size for s in manifest["segments"]) / 1e6
+
+
+def exporter_from_env(store: UseCaseStore) -> ArchiveExporter:
+    return ArchiveExporter(
+        store,
+        Path(os.environ.get("ARCHIVE_EXPORT_DIR", "exports/use_cases")),
+        fmt=os.environ.get("ARCHIVE_EXPORT_FORMAT", "arrow").strip().lower(),
+        compression=os.environ.get("ARCHIVE_EXPORT_COMPRESSION", "zstd").strip().lower(),
+        max_segments=int(os.environ.get("ARCHIVE_EXPORT_MAX_SEGMENTS", "16")),
+    )
+
+
+# ==================== CLI ====================
+
+def portfolio_summary(directory: Path) -> Dict[str, object]:
+    """Agrégats d'exemple lus sur l'export (colonnes projetées, aucune lecture du JSON)"""
+    table = load_archive(directory, ["department", "priority", "etp", "pain_points"])
+    by_group = table.group_by(["department", "priority"]).aggregate([("etp", "sum"), ("etp", "count")])
+    pain_points = pc.value_counts(pc.list_flatten(table["pain_points"]).cast(pa.string()))
+    return {
+        "use_cases": table.num_rows,
+        "groups": by_group.num_rows,
+        "etp_total": round(pc.sum(table["etp"]).as_py() or 0, 1),
+        "pain_points": {p["values"]: p["counts"] for p in sorted(pain_points.to_pylist(), key=lambda p: -p["counts"])},
+    }
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    from store import store_from_env
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export colonnaire (Arrow / Parquet) de l'archive des use cases")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export complet (remplace l'existant)")
+    export.add_argument("--format", choices=sorted(FORMATS), default=None)
+    sub.add_parser("sync", help="Ajoute les use cases écrits depuis le dernier export")
+    sub.add_parser("compact", help="Fusionne les segments en un seul fichier")
+    scan = sub.add_parser("scan", help="Temps de lecture de l'export et agrégats du portefeuille")
+    scan.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    try:
+        exporter = exporter_from_env(store_from_env())
+    except (RuntimeError, ValueError) as e:
+        logger.error(f"❌ {e}")
+        return 1
+    if args.command == "export":
+        if args.format:
+            exporter.format = args.format
+        exporter.export()
+    elif args.command == "sync":
+        exporter.sync()
+    elif args.command == "compact":
+        exporter.compact()
+    else:
+        timings = []
+        for _ in range(max(1, args.repeat)):
+            started = time.perf_counter()
+            summary = portfolio_summary(exporter.directory)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(json.dumps({**summary, "scan_ms": {"min": round(min(timings), 2), "max": round(max(timings), 2)}},
+                         indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
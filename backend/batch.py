@@ -0,0 +1,266 @@
+"""
+Analyse en lot de formulaires (endpoint POST /analyze/batch et ligne de commande)
+Concurrence bornée, limiteur requêtes/tokens par minute, retries avec backoff sur 429/5xx
+Les résultats sont émis en NDJSON au fil de l'eau, dans l'ordre de terminaison
+
+Usage CLI (depuis backend/):
+    python batch.py formulaires.jsonl --concurrency 8 > resultats.ndjson
+    python batch.py dossier_formulaires/ --rpm 300 --tpm 150000 -o resultats.ndjson
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from models import FormData
+
+logger = logging.getLogger(__name__)
+
+# Codes HTTP pour lesquels un nouvel essai a du sens
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+# ==================== LIMITEUR DE DÉBIT ====================
+
+class RateLimiter:
+    """
+    Double seau à jetons : requêtes par minute (RPM) et tokens par minute (TPM).
+    acquire() attend que les deux budgets soient disponibles avant de consommer.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int):
+        # Une requête plus grosse que le budget TPM ne passerait jamais : on la plafonne
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait_requests = (1 - self._requests) * 60 / self.rpm if self._requests < 1 else 0
+                wait_tokens = (tokens - self._tokens) * 60 / self.tpm if self._tokens < tokens else 0
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+
+class SharedRateLimiter:
+    """
+    Même budget RPM/TPM, tenu dans l'état partagé (shared_state) : un seul budget pour tous
+    les workers et toutes les machines, au lieu d'un budget complet par process.
+    """
+
+    def __init__(self, state, rpm: int, tpm: int, name: str = "openai"):
+        self.state = state
+        self.rpm = rpm
+        self.tpm = tpm
+        self.name = name
+
+    async def acquire(self, tokens: int):
+        tokens = min(tokens, self.tpm)
+        while True:
+            wait = await run_in_threadpool(
+                self.state.take, self.name, [1, tokens], [self.rpm / 60, self.tpm / 60], [self.rpm, self.tpm]
+            )
+            if wait <= 0:
+                return
+            # Léger jitter : les workers en attente ne réessaient pas tous au même instant
+            await asyncio.sleep(max(wait, 0.01) * (1 + random.random() / 10))
+
+
+def limiter_from_env(state=None):
+    """Limiteur du process, ou partagé entre workers si l'état partagé est distribué"""
+    rpm = int(os.environ.get("OPENAI_RPM", "500"))
+    tpm = int(os.environ.get("OPENAI_TPM", "200000"))
+    if state is not None and state.distributed:
+        return SharedRateLimiter(state, rpm, tpm)
+    return RateLimiter(rpm=rpm, tpm=tpm)
+
+
+# ==================== RETRIES ====================
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """Code HTTP associé à une erreur OpenAI / HTTPException, None si inconnu"""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Erreurs réseau / timeouts OpenAI (APIConnectionError, APITimeoutError)
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def call_with_retries(
+    fn: Callable[[], Awaitable],
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+):
+    """Exécute fn() avec backoff exponentiel + jitter sur 429/5xx (respecte Retry-After)"""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                raise
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                delay = retry_after
+            else:
+                delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+            attempt += 1
+            logger.warning(f"🔁 Retry {attempt}/{max_retries} dans {delay:.1f}s ({type(e).__name__}: {e})")
+            await asyncio.sleep(delay)
+
+
+# ==================== EXÉCUTION DU LOT ====================
+
+async def run_batch(
+    items: Iterable[Tuple[Any, FormData]],
+    analyze: Callable[[FormData], Awaitable],
+    concurrency: int = 4,
+) -> AsyncIterator[dict]:
+    """
+    Lance analyze() sur chaque formulaire avec au plus `concurrency` appels simultanés.
+    Produit un dict par formulaire dès qu'il est terminé (succès ou erreur).
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def worker(ref, form_data: FormData):
+        async with semaphore:
+            start = time.time()
+            try:
+                result = await analyze(form_data)
+                line = {"ref": ref, "ok": True, "analysis": result.model_dump(mode="json")}
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e)
+                line = {"ref": ref, "ok": False, "status": error_status(e) or 502, "error": detail}
+            line["elapsed"] = round(time.time() - start, 3)
+            await queue.put(line)
+
+    tasks = [asyncio.create_task(worker(ref, form_data)) for ref, form_data in items]
+    try:
+        for _ in range(len(tasks)):
+            yield await queue.get()
+    finally:
+        # Client déconnecté : on annule ce qui reste
+        for task in tasks:
+            task.cancel()
+
+
+async def ndjson_lines(results: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for line in results:
+        yield json.dumps(line, ensure_ascii=False) + "\n"
+
+
+# ==================== LECTURE DES ENTRÉES (CLI) ====================
+
+def _to_form_data(obj: dict) -> FormData:
+    """Accepte un FormData brut ou une AnalyzeRequest ({"form_data": {...}})"""
+    if isinstance(obj.get("form_data"), dict):
+        obj = obj["form_data"]
+    return FormData(**obj)
+
+
+def load_inputs(path: Path) -> List[Tuple[str, FormData]]:
+    """Lit un fichier JSONL (une ligne = un formulaire) ou un dossier de fichiers .json"""
+    items = []
+    if path.is_dir():
+        for file in sorted(path.glob("*.json")):
+            with open(file, "r", encoding="utf-8") as f:
+                items.append((file.name, _to_form_data(json.load(f))))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for lineno, raw in enumerate(f, start=1):
+                if raw.strip():
+                    items.append((f"{path.name}:{lineno}", _to_form_data(json.loads(raw))))
+    return items
+
+
+async def _run_cli(args):
+    # Import tardif : main importe ce module pour l'endpoint /analyze/batch
+    import main
+    import llm
+
+    items = load_inputs(Path(args.input))
+    limiter = RateLimiter(
+        rpm=args.rpm or main.batch_limiter.rpm,
+        tpm=args.tpm or main.batch_limiter.tpm,
+    )
+
+    async def analyze(form_data: FormData):
+        return await main.analyze_batch_item(form_data, limiter=limiter, max_retries=args.max_retries)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    ok = failed = 0
+    try:
+        async for line in run_batch(items, analyze, concurrency=args.concurrency):
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+            out.flush()
+            if line["ok"]:
+                ok += 1
+            else:
+                failed += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await llm.close_client()
+    logger.info(f"📦 Lot terminé: {ok} OK / {failed} en erreur sur {len(items)} formulaires")
+    return failed
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse en lot de formulaires (NDJSON en sortie)")
+    parser.add_argument("input", help="Fichier .jsonl ou dossier de fichiers .json (FormData)")
+    parser.add_argument("-o", "--output", help="Fichier NDJSON de sortie (défaut: stdout)")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("BATCH_CONCURRENCY", "4")))
+    parser.add_argument("--rpm", type=int, default=0, help="Requêtes/minute (défaut: OPENAI_RPM)")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens/minute (défaut: OPENAI_TPM)")
+    parser.add_argument("--max-retries", type=int, default=int(os.environ.get("BATCH_MAX_RETRIES", "5")))
+    args = parser.parse_args(argv)
+    failed = asyncio.run(_run_cli(args))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
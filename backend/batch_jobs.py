@@ -0,0 +1,496 @@
+"""
+Jobs batch fournisseur : analyses asynchrones en masse (ré-analyse de l'archive après un
+changement de prompt ou de modèle, imports d'ateliers)
+Les formulaires sont regroupés dans un fichier JSONL soumis à l'API Batch d'OpenAI (même
+schéma strict form_analysis_response), le job est suivi dans le store SQLite et, une fois
+terminé, les résultats passent par calculate_scoring puis sont écrits dans use_cases.
+Quota séparé, coût réduit et aucun appel interactif consommé ; délai : jusqu'à 24 h.
+LLM_BACKEND=fake : fournisseur local simulé (fichiers sur disque), pour tester hors ligne.
+
+CLI (depuis backend/) :
+    python batch_jobs.py submit formulaires.jsonl
+    python batch_jobs.py rerun --all            # ré-analyse de tous les use cases archivés
+    python batch_jobs.py rerun ID1 ID2
+    python batch_jobs.py status JOB_ID [--wait]
+    python batch_jobs.py list
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+import llm
+from models import FormAnalysisResponse, FormData
+from prompts import PROMPT_VERSION, PromptPlan, build_prompt
+from store import UseCaseStore, build_payload, form_data_from_payload
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+
+# Statuts de l'API Batch : en cours / terminés
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Bail (s) d'ingestion des résultats d'un job, prolongé toutes les INGEST_RENEW_EVERY lignes :
+# avec plusieurs workers, un seul ingère ; repris par un autre si le worker s'arrête en cours
+INGEST_LEASE_SECONDS = 300
+INGEST_RENEW_EVERY = 200
+
+
+# ==================== FOURNISSEURS ====================
+
+class OpenAIBatchProvider:
+    """API Batch d'OpenAI : fichier JSONL (purpose=batch) puis job sur /v1/chat/completions"""
+    name = "openai"
+
+    async def submit(self, jsonl: bytes, metadata: Dict[str, str]) -> dict:
+        client = llm.get_client()
+        uploaded = await client.files.create(file=("batch.jsonl", jsonl), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+            metadata=metadata,
+        )
+        return self._info(batch)
+
+    async def retrieve(self, batch_id: str) -> dict:
+        return self._info(await llm.get_client().batches.retrieve(batch_id))
+
+    async def cancel(self, batch_id: str) -> dict:
+        return self._info(await llm.get_client().batches.cancel(batch_id))
+
+    async def results(self, info: dict) -> List[dict]:
+        """Lignes du fichier de sortie puis du fichier d'erreurs"""
+        client = llm.get_client()
+        lines = []
+        for file_id in (info.get("output_file_id"), info.get("error_file_id")):
+            if file_id:
+                content = await client.files.content(file_id)
+                lines.extend(json.loads(raw) for raw in content.text.splitlines() if raw.strip())
+        return lines
+
+    @staticmethod
+    def _info(batch) -> dict:
+        counts = getattr(batch, "request_counts", None)
+        return {
+            "id": batch.id,
+            "status": batch.status,
+            "output_file_id": getattr(batch, "output_file_id", None),
+            "error_file_id": getattr(batch, "error_file_id", None),
+            "completed": getattr(counts, "completed", 0) if counts else 0,
+            "failed": getattr(counts, "failed", 0) if counts else 0,
+        }
+
+
+class LocalBatchProvider:
+    """
+    Fournisseur simulé : le job est un dossier (entrée, état, sortie) et se termine après
+    LOCAL_BATCH_DELAY secondes ; chaque requête reçoit une analyse de fake_llm, au format
+    de sortie de l'API Batch. FAKE_LLM_ERROR_RATE simule des requêtes en échec.
+    """
+    name = "local"
+
+    def __init__(self, directory: Path, delay: float = 5.0, error_rate: float = 0.0):
+        self.directory = Path(directory)
+        self.delay = delay
+        self.error_rate = error_rate
+
+    def _job_dir(self, batch_id: str) -> Path:
+        return self.directory / batch_id
+
+    def _read_state(self, batch_id: str) -> dict:
+        path = self._job_dir(batch_id) / "state.json"
+        if not path.exists():
+            raise KeyError(f"Batch local inconnu: {batch_id}")
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _write_state(self, batch_id: str, state: dict):
+        (self._job_dir(batch_id) / "state.json").write_text(json.dumps(state), encoding="utf-8")
+
+    async def submit(self, jsonl: bytes, metadata: Dict[str, str]) -> dict:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:16]}"
+        job_dir = self._job_dir(batch_id)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        (job_dir / "input.jsonl").write_bytes(jsonl)
+        state = {"status": "validating", "created_at": time.time(), "metadata": metadata, "completed": 0, "failed": 0}
+        self._write_state(batch_id, state)
+        return self._info(batch_id, state)
+
+    async def retrieve(self, batch_id: str) -> dict:
+        state = self._read_state(batch_id)
+        if state["status"] in ACTIVE_STATUSES and state["status"] != "cancelling":
+            elapsed = time.time() - state["created_at"]
+            if elapsed >= self.delay:
+                await run_in_threadpool(self._complete, batch_id, state)
+            elif elapsed >= self.delay / 2:
+                state["status"] = "in_progress"
+                self._write_state(batch_id, state)
+        return self._info(batch_id, state)
+
+    async def cancel(self, batch_id: str) -> dict:
+        state = self._read_state(batch_id)
+        if state["status"] in ACTIVE_STATUSES:
+            state["status"] = "cancelled"
+            self._write_state(batch_id, state)
+        return self._info(batch_id, state)
+
+    async def results(self, info: dict) -> List[dict]:
+        path = self._job_dir(info["id"]) / "output.jsonl"
+        if not path.exists():
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(raw) for raw in f if raw.strip()]
+
+    def _complete(self, batch_id: str, state: dict):
+        from fake_llm import fake_analysis
+
+        rng = random.Random(batch_id)
+        job_dir = self._job_dir(batch_id)
+        completed = failed = 0
+        with open(job_dir / "input.jsonl", "r", encoding="utf-8") as src, \
+                open(job_dir / "output.jsonl", "w", encoding="utf-8") as out:
+            for raw in src:
+                if not raw.strip():
+                    continue
+                request = json.loads(raw)
+                line = {"id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": request["custom_id"]}
+                if self.error_rate and rng.random() < self.error_rate:
+                    line["response"] = {"status_code": 500, "body": {"error": {"message": "Erreur simulée"}}}
+                    line["error"] = None
+                    failed += 1
+                else:
+                    prompt = "\n".join(m.get("content", "") for m in request["body"]["messages"])
+                    content = json.dumps(fake_analysis(prompt), ensure_ascii=False)
+                    line["response"] = {
+                        "status_code": 200,
+                        "body": {
+                            "model": request["body"].get("model"),
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                                      "total_tokens": (len(prompt) + len(content)) // 4},
+                        },
+                    }
+                    line["error"] = None
+                    completed += 1
+                out.write(json.dumps(line, ensure_ascii=False) + "\n")
+        state.update({"status": "completed", "completed": completed, "failed": failed})
+        self._write_state(batch_id, state)
+
+    def _info(self, batch_id: str, state: dict) -> dict:
+        done = state["status"] == "completed"
+        return {
+            "id": batch_id,
+            "status": state["status"],
+            "output_file_id": "output.jsonl" if done else None,
+            "error_file_id": None,
+            "completed": state["completed"],
+            "failed": state["failed"],
+        }
+
+
+def provider_from_env():
+    """Fournisseur selon LLM_BACKEND : OpenAI, ou simulé en local (fake)"""
+    if llm.backend_name() == "fake":
+        directory = os.environ.get("LOCAL_BATCH_DIR") or str(Path(__file__).parent / ".cache" / "batches")
+        return LocalBatchProvider(
+            Path(directory),
+            delay=float(os.environ.get("LOCAL_BATCH_DELAY", "5")),
+            error_rate=float(os.environ.get("FAKE_LLM_ERROR_RATE", "0")),
+        )
+    return OpenAIBatchProvider()
+
+
+# ==================== SUIVI ET INGESTION ====================
+
+def _result_content(line: dict) -> Tuple[Optional[str], Optional[str]]:
+    """(contenu JSON de l'analyse, None) ou (None, message d'erreur) pour une ligne de sortie"""
+    if line.get("error"):
+        error = line["error"]
+        return None, error.get("message") if isinstance(error, dict) else str(error)
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        message = (body.get("error") or {}).get("message") or "erreur inconnue"
+        return None, f"HTTP {response.get('status_code')}: {message}"
+    try:
+        content = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None, "Réponse sans contenu"
+    return (content, None) if content else (None, "Réponse vide")
+
+
+class BatchJobManager:
+    """
+    Soumission, suivi et ingestion des jobs batch.
+    build_request : PromptPlan -> paramètres Structured Outputs (mêmes que /analyze)
+    finalize : (FormData, JSON brut) -> FormAnalysisResponse (calculate_scoring + validation)
+    key_for : FormData -> clé d'analyse (idempotence des écritures)
+    on_saved : appelé avec l'identifiant de chaque use case écrit (index de similarité)
+    """
+
+    def __init__(
+        self,
+        store: UseCaseStore,
+        provider,
+        build_request: Callable[[PromptPlan], dict],
+        finalize: Callable[[FormData, dict], FormAnalysisResponse],
+        key_for: Callable[[FormData], str],
+        model: str,
+        on_saved: Optional[Callable[[str], None]] = None,
+    ):
+        self.store = store
+        self.provider = provider
+        self.build_request = build_request
+        self.finalize = finalize
+        self.key_for = key_for
+        self.model = model
+        self.on_saved = on_saved
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock(self, job_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(job_id, asyncio.Lock())
+
+    async def submit(self, items: List[Tuple[Optional[str], FormData]]) -> dict:
+        """Crée le job : une requête par formulaire (use_case_id renseigné = ré-analyse)"""
+        job_id = uuid.uuid4().hex
+        rows, lines = [], []
+        for i, (use_case_id, form_data) in enumerate(items):
+            custom_id = f"item-{i:06d}"
+            body = self.build_request(build_prompt(form_data, self.model))
+            lines.append(json.dumps(
+                {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                ensure_ascii=False,
+            ))
+            rows.append((custom_id, use_case_id, form_data))
+        now = datetime.now().isoformat()
+        job = {
+            "id": job_id,
+            "provider": self.provider.name,
+            "provider_batch_id": None,
+            "status": "submitting",
+            "model": self.model,
+            "prompt_version": PROMPT_VERSION,
+            "created_at": now,
+            "updated_at": now,
+            "item_count": len(rows),
+        }
+        await run_in_threadpool(self.store.create_batch_job, job, rows)
+        try:
+            info = await self.provider.submit(
+                ("\n".join(lines) + "\n").encode("utf-8"),
+                {"job_id": job_id, "prompt_version": PROMPT_VERSION},
+            )
+        except Exception as e:
+            await run_in_threadpool(self.store.update_batch_job, job_id, status="failed", error=f"Soumission: {e}"[:500])
+            raise
+        await run_in_threadpool(self.store.update_batch_job, job_id,
+                                provider_batch_id=info["id"], status=info["status"])
+        logger.info(f"📨 Job batch {job_id} soumis ({len(rows)} formulaires, {self.provider.name} {info['id']})")
+        return await run_in_threadpool(self.store.get_batch_job, job_id)
+
+    async def refresh(self, job_id: str) -> Optional[dict]:
+        """Met à jour le statut auprès du fournisseur ; ingère les résultats d'un job terminé"""
+        async with self._lock(job_id):
+            job = await run_in_threadpool(self.store.get_batch_job, job_id)
+            if job is None or job["ingested_at"] or not job["provider_batch_id"]:
+                return job
+            info = await self.provider.retrieve(job["provider_batch_id"])
+            if info["status"] != job["status"]:
+                logger.info(f"📨 Job batch {job_id}: {job['status']} -> {info['status']}")
+                await run_in_threadpool(self.store.update_batch_job, job_id, status=info["status"])
+            if info["status"] in FINAL_STATUSES:
+                # Un seul worker ingère (bail dans le store) ; job expiré ou annulé : les requêtes
+                # déjà traitées sont quand même ingérées
+                stale_before = (datetime.now() - timedelta(seconds=INGEST_LEASE_SECONDS)).isoformat()
+                if await run_in_threadpool(self.store.claim_batch_ingestion, job_id, stale_before):
+                    try:
+                        await self._ingest(job_id, info)
+                    except Exception:
+                        await run_in_threadpool(self.store.update_batch_job, job_id, ingesting_since=None)
+                        raise
+            return await run_in_threadpool(self.store.get_batch_job, job_id)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        job = await run_in_threadpool(self.store.get_batch_job, job_id)
+        if job is None or not job["provider_batch_id"] or job["status"] in FINAL_STATUSES:
+            return job
+        info = await self.provider.cancel(job["provider_batch_id"])
+        await run_in_threadpool(self.store.update_batch_job, job_id, status=info["status"])
+        return await run_in_threadpool(self.store.get_batch_job, job_id)
+
+    async def _ingest(self, job_id: str, info: dict):
+        lines = await self.provider.results(info)
+        items = {item["custom_id"]: item for item in await run_in_threadpool(self.store.batch_job_items, job_id, "pending")}
+        await run_in_threadpool(self._ingest_lines, job_id, lines, items)
+        # Requêtes sans ligne de résultat (job expiré / annulé avant traitement)
+        for custom_id in items.keys() - {line.get("custom_id") for line in lines}:
+            await run_in_threadpool(self.store.update_batch_item, job_id, custom_id, "failed", None, f"Non traité ({info['status']})")
+        # Compteurs lus dans le store : justes aussi après une ingestion reprise en cours de route
+        counts = await run_in_threadpool(self.store.batch_item_counts, job_id)
+        succeeded, failed = counts.get("succeeded", 0), counts.get("failed", 0)
+        await run_in_threadpool(
+            self.store.update_batch_job, job_id,
+            succeeded=succeeded, failed=failed, ingested_at=datetime.now().isoformat(), ingesting_since=None
+        )
+        logger.info(f"📥 Job batch {job_id} ingéré: {succeeded} use cases écrits, {failed} en échec")
+
+    def _ingest_lines(self, job_id: str, lines: List[dict], items: Dict[str, dict]) -> Tuple[int, int]:
+        """Scoring + validation + écriture de chaque résultat (thread dédié : SQLite synchrone)"""
+        succeeded = failed = 0
+        for n, line in enumerate(lines, 1):
+            item = items.get(line.get("custom_id"))
+            if item is None:
+                continue
+            if n % INGEST_RENEW_EVERY == 0:
+                self.store.renew_batch_ingestion(job_id)
+            content, error = _result_content(line)
+            if error is None:
+                try:
+                    form_data = FormData.model_validate_json(item["form_data"])
+                    analysis = self.finalize(form_data, json.loads(content))
+                    saved_at = self._original_saved_at(item["use_case_id"])
+                    payload = build_payload(form_data, analysis, saved_at=saved_at)
+                    payload["metadata"]["batch_job"] = job_id
+                    use_case_id = self.store.insert(
+                        payload,
+                        use_case_id=item["use_case_id"],
+                        analysis_key=self.key_for(form_data),
+                        replace=item["use_case_id"] is not None,
+                    )
+                    self.store.update_batch_item(job_id, item["custom_id"], "succeeded", use_case_id)
+                    if self.on_saved is not None:
+                        self.on_saved(use_case_id)
+                    succeeded += 1
+                    continue
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+            self.store.update_batch_item(job_id, item["custom_id"], "failed", None, error[:500])
+            failed += 1
+        return succeeded, failed
+
+    def _original_saved_at(self, use_case_id: Optional[str]) -> Optional[datetime]:
+        """Date de sauvegarde d'origine d'un use case ré-analysé (chronologie du portefeuille inchangée)"""
+        if use_case_id is None:
+            return None
+        payload = self.store.get(use_case_id)
+        saved_at = (payload or {}).get("metadata", {}).get("saved_at")
+        try:
+            return datetime.fromisoformat(saved_at) if saved_at else None
+        except ValueError:
+            return None
+
+    async def refresh_active(self) -> int:
+        """Rafraîchit tous les jobs non ingérés ; retourne le nombre de jobs encore en cours"""
+        jobs = await run_in_threadpool(self.store.list_batch_jobs, list(ACTIVE_STATUSES) + list(FINAL_STATUSES))
+        active = 0
+        for job in jobs:
+            if job["ingested_at"] or not job["provider_batch_id"]:
+                continue
+            try:
+                job = await self.refresh(job["id"])
+            except Exception as e:
+                logger.warning(f"⚠️ Suivi du job batch {job['id']} impossible: {e}")
+                continue
+            if job and not job["ingested_at"]:
+                active += 1
+        return active
+
+    async def poll_forever(self, interval: float):
+        """Tâche de fond du serveur : suivi et ingestion automatiques"""
+        while True:
+            try:
+                await self.refresh_active()
+            except Exception as e:
+                logger.warning(f"⚠️ Suivi des jobs batch: {e}")
+            await asyncio.sleep(interval)
+
+    def job_summary(self, job: dict) -> dict:
+        """Job + compteurs d'items par statut"""
+        counts: Dict[str, int] = {}
+        for item in self.store.batch_job_items(job["id"]):
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        return {**job, "items": counts}
+
+
+def archived_items(store: UseCaseStore, use_case_ids: Optional[List[str]] = None) -> List[Tuple[str, FormData]]:
+    """(id, FormData) des use cases archivés à ré-analyser (tous si use_case_ids est None)"""
+    if use_case_ids is None:
+        return [(uid, form_data_from_payload(payload)) for uid, payload in store.iter_payloads()]
+    items = []
+    for uid in use_case_ids:
+        payload = store.get(uid)
+        if payload is None:
+            raise KeyError(uid)
+        items.append((uid, form_data_from_payload(payload)))
+    return items
+
+
+# ==================== CLI ====================
+
+async def _run_cli(args) -> int:
+    # Import tardif : main construit le manager (requête Structured Outputs, finalisation, store)
+    import main
+
+    manager = main.batch_job_manager
+    try:
+        if args.command == "submit":
+            from batch import load_inputs
+            items = [(None, form_data) for _, form_data in load_inputs(Path(args.input))]
+            job = await manager.submit(items)
+        elif args.command == "rerun":
+            ids = None if args.all else args.ids
+            if not ids and not args.all:
+                print("Indiquer des identifiants ou --all")
+                return 1
+            job = await manager.submit(await run_in_threadpool(archived_items, main.use_case_store, ids))
+        elif args.command == "status":
+            job = await manager.refresh(args.job_id)
+            while args.wait and job and not job["ingested_at"]:
+                await asyncio.sleep(args.interval)
+                job = await manager.refresh(args.job_id)
+            if job is None:
+                print(f"Job inconnu: {args.job_id}")
+                return 1
+        else:
+            for job in main.use_case_store.list_batch_jobs():
+                print(f"{job['id']}  {job['status']:<12} {job['item_count']:>6} formulaires  "
+                      f"{job['succeeded']} OK / {job['failed']} KO  {job['created_at']}")
+            return 0
+        print(json.dumps(manager.job_summary(job), indent=2, ensure_ascii=False))
+        return 0
+    finally:
+        await llm.close_client()
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Jobs batch fournisseur (analyses asynchrones en masse)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    submit = sub.add_parser("submit", help="Soumettre un fichier .jsonl ou un dossier de .json (FormData)")
+    submit.add_argument("input")
+    rerun = sub.add_parser("rerun", help="Ré-analyser des use cases archivés")
+    rerun.add_argument("ids", nargs="*")
+    rerun.add_argument("--all", action="store_true")
+    status = sub.add_parser("status", help="Statut d'un job (ingère les résultats s'il est terminé)")
+    status.add_argument("job_id")
+    status.add_argument("--wait", action="store_true", help="Attendre la fin et l'ingestion")
+    status.add_argument("--interval", type=float, default=30)
+    sub.add_parser("list", help="Lister les jobs")
+    args = parser.parse_args(argv)
+    return asyncio.run(_run_cli(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,229 @@
+"""
+Cache des réponses d'analyse IA (sans scoring)
+Clé = hash du FormData normalisé + modèle + version du prompt
+Deux niveaux : LRU en mémoire (TTL + taille max) puis disque (survit aux redémarrages),
+ou état partagé entre workers (shared_state, SHARED_STATE_URL) à la place du disque
+Les niveaux 2 font des I/O : depuis la boucle asyncio, get(memory_only=True) puis run_in_threadpool
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from models import FormData
+
+logger = logging.getLogger(__name__)
+
+# Champs du formulaire pris en compte dans la clé (q1 à q20)
+FORM_FIELDS = [f"q{i}" for i in range(1, 21)]
+
+
+def normalize_form_data(form_data: FormData) -> dict:
+    """Trim + espaces multiples réduits à un seul, pour q1-q20 uniquement"""
+    return {
+        field: " ".join((getattr(form_data, field) or "").split())
+        for field in FORM_FIELDS
+    }
+
+
+def make_cache_key(form_data: FormData, model: str, prompt_version: str) -> str:
+    """Hash SHA-256 du formulaire normalisé, du modèle et de la version du prompt"""
+    payload = {
+        "form": normalize_form_data(form_data),
+        "model": model,
+        "prompt_version": prompt_version,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Cache deux niveaux pour les réponses OpenAI.
+    Les valeurs stockées ne doivent pas être modifiées par l'appelant.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path],
+        max_entries: int = 256,
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_disk_entries: int = 5000,
+        shared=None,
+    ):
+        # État partagé distribué : remplace le disque (les workers se partagent les réponses)
+        self.shared = shared
+        self.directory = Path(directory) if directory and shared is None else None
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    # ---------- Niveau mémoire ----------
+
+    def _memory_get(self, key: str, now: float) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        created_at, value = entry
+        if now - created_at > self.ttl_seconds:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: dict, created_at: float):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # ---------- Niveau disque ----------
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning(f"⚠️ Entrée de cache illisible, supprimée: {path.name}")
+            path.unlink(missing_ok=True)
+            return None
+        created_at = entry.get("created_at", 0)
+        if now - created_at > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        return created_at, entry.get("value")
+
+    def _disk_set(self, key: str, value: dict, created_at: float):
+        if not self.directory:
+            return
+        path = self._path(key)
+        # Fichier temporaire propre à l'écriture : deux écritures de la même clé (threads, workers)
+        # ne partagent pas le même .tmp ; la dernière à faire os.replace gagne
+        tmp = path.with_name(f"{path.stem}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created_at": created_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 50:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Supprime les entrées les plus anciennes au-delà de max_disk_entries"""
+        self._writes_since_prune = 0
+        files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        excess = len(files) - self.max_disk_entries
+        for path in files[:max(excess, 0)]:
+            path.unlink(missing_ok=True)
+            self.evictions += 1
+
+    # ---------- Niveau partagé (multi-worker) ----------
+
+    def _shared_get(self, key: str, now: float) -> Optional[tuple]:
+        raw = self.shared.get(f"cache:{key}")
+        if raw is None:
+            return None
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            return None
+        return entry.get("created_at", now), entry.get("value")
+
+    def _shared_set(self, key: str, value: dict, created_at: float):
+        entry = json.dumps({"created_at": created_at, "value": value}, ensure_ascii=False)
+        self.shared.set(f"cache:{key}", entry, self.ttl_seconds)
+
+    # ---------- API publique ----------
+
+    def get(self, key: str, memory_only: bool = False) -> Optional[dict]:
+        """Réponse en cache ; memory_only : sans I/O (ni compté comme miss si absente)"""
+        now = time.time()
+        with self._lock:
+            value = self._memory_get(key, now)
+            if value is not None:
+                self.hits_memory += 1
+                return value
+        if memory_only:
+            return None
+        try:
+            entry = self._shared_get(key, now) if self.shared is not None else self._disk_get(key, now)
+        except Exception as e:
+            logger.warning(f"⚠️ Lecture du cache partagé impossible: {e}")
+            entry = None
+        with self._lock:
+            if entry is not None and entry[1] is not None:
+                created_at, value = entry
+                self._memory_set(key, value, created_at)
+                self.hits_disk += 1
+                return value
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: dict):
+        created_at = time.time()
+        with self._lock:
+            self._memory_set(key, value, created_at)
+        try:
+            if self.shared is not None:
+                self._shared_set(key, value, created_at)
+            else:
+                self._disk_set(key, value, created_at)
+        except Exception as e:
+            logger.warning(f"⚠️ Écriture cache {'partagé' if self.shared is not None else 'disque'} impossible: {e}")
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        return {
+            "level2": "shared" if self.shared is not None else ("disk" if self.directory else None),
+            "hits": hits,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+        }
+
+
+def cache_from_env(state=None) -> Optional[AnalysisCache]:
+    """
+    Construit le cache selon l'environnement (ANALYSIS_CACHE_ENABLED=0 pour désactiver).
+    state : état partagé ; s'il est distribué, il remplace le niveau disque.
+    """
+    if os.environ.get("ANALYSIS_CACHE_ENABLED", "1") in ("0", "false", "False"):
+        return None
+    directory = os.environ.get("ANALYSIS_CACHE_DIR") or str(Path(__file__).parent / ".cache" / "analyze")
+    return AnalysisCache(
+        directory=Path(directory),
+        max_entries=int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "256")),
+        ttl_seconds=float(os.environ.get("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600))),
+        max_disk_entries=int(os.environ.get("ANALYSIS_CACHE_MAX_DISK_ENTRIES", "5000")),
+        shared=state if state is not None and state.distributed else None,
+    )
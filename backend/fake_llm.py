@@ -0,0 +1,244 @@
+"""
+Backend LLM local (LLM_BACKEND=fake) pour les tests de charge et le développement hors ligne
+Imite le sous-ensemble du client AsyncOpenAI utilisé par le backend (chat.completions.create,
+streaming, with_options, close) et renvoie des analyses conformes à
+FormAnalysisResponseWithoutScoring, déterministes pour un même prompt.
+Schéma restreint (ré-analyse incrémentale) : seules les sections demandées, latence réduite d'autant
+(20 % fixe, 80 % proportionnels à la longueur de la réponse).
+Latence et taux d'erreur configurables : aucun appel réseau, aucun coût.
+"""
+import os
+import json
+import random
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from models import (
+    Benefit, ComplexityLevel, DevTime, ElementCategory, FormAnalysisResponseWithoutScoring,
+    PainPoint, Priority
+)
+
+# Découpage du flux simulé (caractères par chunk)
+STREAM_CHUNK_CHARS = 24
+
+
+class FakeLLMError(Exception):
+    """Erreur simulée, avec status_code comme les erreurs du SDK OpenAI (retries / code HTTP)"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = None
+
+
+def _parse_model_latency(raw: str) -> Dict[str, float]:
+    """FAKE_LLM_MODEL_LATENCY_MS : "gpt-4o-mini=300,gpt-4o=1200" """
+    latencies = {}
+    for item in raw.split(","):
+        if "=" in item:
+            model, value = item.split("=", 1)
+            latencies[model.strip()] = float(value)
+    return latencies
+
+
+class FakeSettings:
+    """
+    Latence (ms, moyenne + jitter uniforme), taux d'erreur et code d'erreur simulés
+    model_latency_ms : latence moyenne propre à certains modèles (routage, couverture)
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 800,
+        jitter_ms: float = 200,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        seed: Optional[int] = None,
+        model_latency_ms: Optional[Dict[str, float]] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.model_latency_ms = model_latency_ms or {}
+
+    @classmethod
+    def from_env(cls) -> "FakeSettings":
+        seed = os.environ.get("FAKE_LLM_SEED")
+        return cls(
+            latency_ms=float(os.environ.get("FAKE_LLM_LATENCY_MS", "800")),
+            jitter_ms=float(os.environ.get("FAKE_LLM_JITTER_MS", "200")),
+            error_rate=float(os.environ.get("FAKE_LLM_ERROR_RATE", "0")),
+            error_status=int(os.environ.get("FAKE_LLM_ERROR_STATUS", "429")),
+            seed=int(seed) if seed else None,
+            model_latency_ms=_parse_model_latency(os.environ.get("FAKE_LLM_MODEL_LATENCY_MS", "")),
+        )
+
+    def draw_latency(self, model: Optional[str] = None) -> float:
+        """Latence d'un appel en secondes"""
+        jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.model_latency_ms.get(model, self.latency_ms) + jitter) / 1000
+
+    def draw_error(self) -> bool:
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+# ==================== ANALYSE SIMULÉE ====================
+
+def _pick(rng: random.Random, enum_cls, k: int) -> list:
+    return [e.value for e in rng.sample(list(enum_cls), k)]
+
+
+def fake_analysis(prompt: str) -> dict:
+    """Analyse conforme au schéma strict, tirée d'un générateur seedé par le prompt"""
+    seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    n_types = rng.randint(1, 3)
+    categories = _pick(rng, ElementCategory, n_types)
+    n_phases = rng.randint(2, 3)
+    result = {
+        "user_story": {
+            "project_name": f"Automatisation Processus {seed % 1000:03d}",
+            "html": (
+                "<p><strong>En tant que</strong> utilisateur métier,</p>"
+                "<p><strong>j'ai besoin de</strong> automatiser une tâche répétitive</p>"
+                "<p><strong>afin de</strong> gagner du temps chaque mois.</p>"
+            ),
+            "word_count": 24,
+        },
+        "execution_schema": {
+            "ascii_diagram": "|Collecte|\n    |\n|Traitement|\n    |\n|Contrôle|\n    |\n|Restitution|"
+        },
+        "elements_sources": {
+            "types": [{"category": c, "description": f"Source {c}"} for c in categories],
+            "count": n_types,
+            "total_sources": n_types + rng.randint(0, 4),
+            "complexity_level": rng.choice(list(ComplexityLevel)).value,
+        },
+        "analysis": {
+            "pain_points": _pick(rng, PainPoint, rng.randint(1, 3)),
+            "benefits": _pick(rng, Benefit, rng.randint(1, 3)),
+            "feasibility_score": rng.randint(20, 95),
+            "priority": rng.choice(list(Priority)).value,
+        },
+        "pro_con": {
+            "pros": [{"argument": f"Argument pour {i + 1}", "weight": rng.choice(["Faible", "Moyen", "Fort"])}
+                     for i in range(rng.randint(3, 5))],
+            "cons": [{"argument": f"Argument contre {i + 1}", "weight": rng.choice(["Faible", "Moyen", "Fort"])}
+                     for i in range(rng.randint(2, 4))],
+        },
+        "delivery": {
+            "dev_time": rng.choice(list(DevTime)).value,
+            "phases": [
+                {
+                    "phase": i + 1,
+                    "name": ("POC", "MVP", "Production")[i],
+                    "feature_principale": f"Fonctionnalité {i + 1}",
+                    "risque_principal": f"Risque {i + 1}",
+                    "duration": f"{rng.randint(1, 4)} semaines",
+                }
+                for i in range(n_phases)
+            ],
+            "quick_wins": [{"action": f"En attendant, essaye de {i + 1}", "impact": "Moyen"}
+                           for i in range(rng.randint(3, 5))],
+        },
+    }
+    # Garde-fou : le faux backend ne doit jamais produire ce que le vrai schéma refuserait
+    FormAnalysisResponseWithoutScoring.model_validate(result)
+    return result
+
+
+def _usage(prompt: str, completion: str):
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(completion) // 4)
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _response(content: str, usage):
+    message = SimpleNamespace(content=content, role="assistant")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+
+def _chunk(content: Optional[str], usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+# ==================== CLIENT ====================
+
+class FakeCompletions:
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.calls = 0
+
+    async def create(self, messages, response_format=None, stream=False, stream_options=None, **kwargs):
+        self.calls += 1
+        prompt = "\n".join(m.get("content", "") for m in messages)
+        latency = self.settings.draw_latency(kwargs.get("model"))
+        if self.settings.draw_error():
+            await asyncio.sleep(latency / 4)
+            raise FakeLLMError(self.settings.error_status, f"Erreur simulée ({self.settings.error_status})")
+
+        if response_format is not None:
+            analysis = fake_analysis(prompt)
+            full = json.dumps(analysis, ensure_ascii=False)
+            sections = response_format["json_schema"]["schema"]["properties"]
+            content = json.dumps({name: analysis[name] for name in sections}, ensure_ascii=False)
+            latency *= 0.2 + 0.8 * len(content) / len(full)
+        else:
+            content = f"Réponse simulée ({len(prompt)} caractères reçus)."
+        usage = _usage(prompt, content)
+
+        if not stream:
+            await asyncio.sleep(latency)
+            return _response(content, usage)
+
+        include_usage = bool((stream_options or {}).get("include_usage"))
+        return self._stream(content, usage if include_usage else None, latency)
+
+    async def _stream(self, content: str, usage, latency: float):
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        # Latence répartie : premier token à ~20 %, le reste étalé sur le flux
+        await asyncio.sleep(latency * 0.2)
+        delay = latency * 0.8 / max(1, len(pieces))
+        for piece in pieces:
+            yield _chunk(piece)
+            await asyncio.sleep(delay)
+        if usage is not None:
+            yield _chunk(None, usage)
+
+
+class FakeEmbeddings:
+    """Embeddings simulés : vecteurs locaux par hachage (similarity.HashingEmbedder), mêmes champs que l'API"""
+
+    async def create(self, model: str, input, dimensions: Optional[int] = None, **kwargs):
+        from similarity import HashingEmbedder
+
+        embedder = HashingEmbedder(dimensions or 512)
+        texts = [input] if isinstance(input, str) else list(input)
+        data = [SimpleNamespace(index=i, embedding=embedder.vector(text).tolist()) for i, text in enumerate(texts)]
+        return SimpleNamespace(data=data, model=model, usage=SimpleNamespace(prompt_tokens=0, total_tokens=0))
+
+
+class FakeLLMClient:
+    """Remplaçant de AsyncOpenAI (mêmes attributs que ceux appelés par main.py)"""
+
+    def __init__(self, settings: Optional[FakeSettings] = None):
+        self.settings = settings or FakeSettings.from_env()
+        self.chat = SimpleNamespace(completions=FakeCompletions(self.settings))
+        self.embeddings = FakeEmbeddings()
+
+    def with_options(self, **kwargs) -> "FakeLLMClient":
+        # Retries gérés par l'appelant : même client
+        return self
+
+    async def close(self):
+        pass
@@ -0,0 +1,123 @@
+"""
+Ré-analyse incrémentale d'un formulaire modifié
+Après une première analyse, l'interviewer retouche souvent une seule réponse (q17, sources q14...).
+Chaque section de FormAnalysisResponseWithoutScoring ne lit qu'une partie des questions
+(SECTION_DEPENDENCIES) : seules les sections touchées par les réponses modifiées sont redemandées
+au LLM (schéma strict restreint), les autres sont reprises de l'analyse précédente.
+Le scoring est toujours recalculé côté backend (calculate_scoring).
+"""
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+
+from cache import normalize_form_data
+from models import FormAnalysisResponseWithoutScoring, FormData
+
+# Sections produites par l'IA, dans l'ordre du schéma
+SECTIONS: Tuple[str, ...] = tuple(FormAnalysisResponseWithoutScoring.model_fields)
+
+# Questions lues par chaque section (voir INSTRUCTIONS dans prompts.py)
+SECTION_DEPENDENCIES: Dict[str, Tuple[str, ...]] = {
+    # Persona, besoin et bénéfice ("afin de") ; pas la volumétrie
+    "user_story": ("q1", "q2", "q3", "q4", "q5", "q6", "q12", "q13"),
+    # Déroulé du traitement : besoin, exécution actuelle, sources, action manuelle, outils
+    "execution_schema": ("q5", "q6", "q14", "q15", "q16", "q20"),
+    # Classification des sources (Q14)
+    "elements_sources": ("q14", "q16"),
+    # Pain points et bénéfices (volumétrie, irritant), faisabilité (sources, règles, complexité), priorité
+    "analysis": ("q5", "q6", "q7", "q8", "q9", "q10", "q11", "q12", "q13", "q14", "q17", "q18", "q19", "q20"),
+    # Arguments : impact (volumétrie, irritant, urgence) et faisabilité
+    "pro_con": ("q5", "q7", "q8", "q9", "q10", "q11", "q12", "q13", "q14", "q17", "q18", "q19", "q20"),
+    # Temps de dev et phases (faisabilité), quick wins (exécution actuelle, action manuelle, outils)
+    "delivery": ("q5", "q6", "q14", "q15", "q16", "q17", "q18", "q19", "q20"),
+}
+
+# Identité de l'interviewé : jamais reprise de l'analyse d'un autre use case (voir plan_reuse)
+PERSONA_FIELDS: Tuple[str, ...] = ("q1", "q2", "q3", "q4")
+
+
+def enabled() -> bool:
+    """INCREMENTAL_ANALYSIS=0 : toute modification relance l'analyse complète"""
+    return os.environ.get("INCREMENTAL_ANALYSIS", "1") not in ("0", "false", "False")
+
+
+def changed_questions(previous: FormData, current: FormData) -> List[str]:
+    """Questions dont la réponse normalisée (espaces) a changé"""
+    before, after = normalize_form_data(previous), normalize_form_data(current)
+    return [field for field in after if before.get(field) != after[field]]
+
+
+def affected_sections(changed: Sequence[str]) -> List[str]:
+    """Sections qui lisent au moins une des questions modifiées, dans l'ordre du schéma"""
+    changed = set(changed)
+    return [name for name in SECTIONS if changed.intersection(SECTION_DEPENDENCIES[name])]
+
+
+class IncrementalUpdate:
+    """
+    Sections à redemander au LLM et sections reprises de l'analyse précédente
+    trusted : analyse précédente lue côté serveur (store, cache) ; sinon fournie par le client,
+    et le résultat fusionné n'est ni mis en cache ni partagé avec d'autres requêtes.
+    """
+
+    def __init__(self, sections: List[str], reused: Dict[str, dict], changed: List[str], trusted: bool):
+        self.sections = sections
+        self.reused = reused
+        self.changed = changed
+        self.trusted = trusted
+
+    def merge(self, produced: dict) -> dict:
+        """Analyse complète (sans scoring) : sections produites + sections reprises, dans l'ordre du schéma"""
+        missing = [name for name in self.sections if name not in produced]
+        if missing:
+            raise ValueError(f"Sections absentes de la réponse: {', '.join(missing)}")
+        return {name: produced[name] if name in self.sections else self.reused[name] for name in SECTIONS}
+
+    def describe(self) -> dict:
+        return {"changed": self.changed, "regenerated": self.sections,
+                "reused": [name for name in SECTIONS if name in self.reused and name not in self.sections],
+                "trusted": self.trusted}
+
+
+def plan_update(previous_form: FormData, previous_analysis: Optional[dict], current: FormData,
+                trusted: bool) -> Optional[IncrementalUpdate]:
+    """
+    Sections à régénérer pour le formulaire modifié. Une section précédente absente ou invalide
+    est régénérée. None si toutes les sections sont touchées (analyse complète).
+    """
+    if not isinstance(previous_analysis, dict):
+        return None
+    changed = changed_questions(previous_form, current)
+    return _plan(previous_analysis, affected_sections(changed), changed, trusted)
+
+
+def plan_reuse(previous_form: FormData, previous_analysis: Optional[dict],
+               current: FormData) -> Optional[IncrementalUpdate]:
+    """
+    Reprise de l'analyse d'un use case quasi identique (similarité sur q5/q6/q14) : les sections qui
+    lisent une réponse de persona différente (user_story) sont régénérées, les autres reprises.
+    None si l'analyse n'est pas réutilisable.
+    """
+    if not isinstance(previous_analysis, dict):
+        return None
+    changed = [field for field in changed_questions(previous_form, current) if field in PERSONA_FIELDS]
+    return _plan(previous_analysis, affected_sections(changed), changed, trusted=True)
+
+
+def _plan(previous_analysis: dict, sections: Sequence[str], changed: List[str],
+          trusted: bool) -> Optional[IncrementalUpdate]:
+    """Sections précédentes valides reprises, les autres régénérées ; None si tout est à régénérer"""
+    sections = set(sections)
+    reused = {}
+    for name in SECTIONS:
+        if name in sections:
+            continue
+        try:
+            model = FormAnalysisResponseWithoutScoring.model_fields[name].annotation
+            reused[name] = model.model_validate(previous_analysis.get(name)).model_dump(mode="json")
+        except ValidationError:
+            sections.add(name)
+    if len(sections) == len(SECTIONS):
+        return None
+    return IncrementalUpdate([name for name in SECTIONS if name in sections], reused, changed, trusted)
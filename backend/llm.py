@@ -0,0 +1,114 @@
+"""
+Client LLM partagé pour tous les endpoints
+Un seul client asynchrone par process, avec un pool de connexions HTTP borné et keep-alive.
+Backend choisi par LLM_BACKEND : "openai" (défaut) ou "fake" (fake_llm.py, local, sans clé).
+Le package openai (~0,5 s d'import) n'est chargé qu'à la création du client : au démarrage
+(préchauffage, voir main.lifespan) ou au premier appel.
+"""
+import os
+import logging
+import threading
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+BACKENDS = ("openai", "fake")
+
+
+class BackendUnavailable(RuntimeError):
+    """Backend LLM configuré inutilisable : package ou clé manquant, nom inconnu"""
+
+
+def backend_name() -> str:
+    """Backend configuré (lu à chaque appel : le .env est chargé après l'import)"""
+    return os.environ.get("LLM_BACKEND", "openai").strip().lower() or "openai"
+
+
+def check_backend():
+    """Lève BackendUnavailable si le backend configuré ne peut pas répondre (package, clé, nom inconnu)"""
+    backend = backend_name()
+    if backend not in BACKENDS:
+        raise BackendUnavailable(f"LLM_BACKEND inconnu: {backend} (attendu: {', '.join(BACKENDS)})")
+    if backend == "fake":
+        return
+    if importlib.util.find_spec("openai") is None:
+        raise BackendUnavailable("Package openai manquant")
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise BackendUnavailable("OPENAI_API_KEY manquant")
+
+
+def _build_client():
+    """Construit le client du backend configuré"""
+    if backend_name() == "fake":
+        from fake_llm import FakeLLMClient
+        return FakeLLMClient()
+    return _build_openai_client()
+
+
+def _build_openai_client():
+    """Construit le client asynchrone avec un pool HTTP dimensionné via l'environnement"""
+    import httpx
+    from openai import AsyncOpenAI
+
+    limits = httpx.Limits(
+        max_connections=int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.environ.get("OPENAI_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30")),
+    )
+    timeout = httpx.Timeout(float(os.environ.get("OPENAI_TIMEOUT", "60")), connect=10.0)
+    http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        http_client=http_client,
+        timeout=timeout,
+    )
+
+
+def preload():
+    """Importe le package du backend configuré (appelé hors boucle par le préchauffage)"""
+    if backend_name() == "fake":
+        import fake_llm  # noqa: F401
+    elif importlib.util.find_spec("openai") is not None:
+        import openai  # noqa: F401
+
+
+def init_client():
+    """Crée le client partagé au démarrage (sans effet si la clé ou le package manque) ; appelable depuis un thread"""
+    global _client
+    if _client is not None:
+        return _client
+    try:
+        check_backend()
+    except BackendUnavailable:
+        return None
+    with _client_lock:
+        if _client is not None:
+            return _client
+        _client = _build_client()
+    if backend_name() == "fake":
+        settings = _client.settings
+        logger.info(f"🧪 Backend LLM local (fake) : latence {settings.latency_ms:.0f}±{settings.jitter_ms:.0f} ms, "
+                    f"erreurs {settings.error_rate:.0%} ({settings.error_status})")
+    else:
+        logger.info(f"🔌 Client OpenAI initialisé (pool max {os.environ.get('OPENAI_MAX_CONNECTIONS', '20')} connexions)")
+    return _client
+
+
+def get_client():
+    """
+    Retourne le client partagé, créé à la volée si la clé a été fournie après le démarrage.
+    Lève BackendUnavailable si le backend n'est pas utilisable (package ou clé manquant).
+    """
+    check_backend()
+    return init_client()
+
+
+async def close_client():
+    """Ferme proprement le pool HTTP à l'arrêt du process"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,329 @@
+"""
+Test de charge : /analyze, /save, /score et /health à concurrence croissante
+Par défaut, lance le serveur (uvicorn, N workers) avec le backend LLM local (LLM_BACKEND=fake) :
+aucun appel OpenAI, latence et taux d'erreur simulés réglables.
+Mesure par palier : requêtes/s, percentiles de latence, codes d'erreur, puis par worker
+(via /health) : mémoire résidente et retard de la boucle asyncio.
+Résultats écrits en JSON ; --baseline compare à un run précédent et signale les régressions.
+
+Usage :
+    python loadtest.py --workers 2 --levels 1,8,32 --duration 10
+    python loadtest.py --url http://localhost:8000 --endpoints health
+    python loadtest.py --baseline bench_results/loadtest-20251018-120000.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent
+DEFAULT_OUTPUT_DIR = BACKEND_DIR / "bench_results"
+ENDPOINTS = ("health", "analyze", "save", "score")
+PERCENTILES = (50, 90, 95, 99)
+
+FORM = {
+    "q1": "Durand", "q2": "Marie", "q3": "Contrôleur de gestion", "q4": "Comptabilité / Finance",
+    "q5": "Rapprochement mensuel des écritures GL et OSB", "q6": "Exports manuels, matching Excel",
+    "q7": "20", "q8": "20", "q9": "20min", "q10": "3", "q11": "4",
+    "q14": "Excel GL, Excel OSB, SAP", "q15": "Oui", "q17": "Partiellement", "q19": "Simple",
+}
+
+
+# ==================== SERVEUR ====================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def start_server(args, workdir: Path) -> Tuple[subprocess.Popen, str]:
+    """Lance uvicorn avec le backend LLM local, une base et un cache jetables"""
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_JITTER_MS": str(args.llm_jitter_ms),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "USE_CASES_DB": str(workdir / "loadtest.db"),
+        "ANALYSIS_CACHE_DIR": str(workdir / "cache"),
+        "ANALYSIS_CACHE_ENABLED": "1" if args.cache else "0",
+        "LOG_FORMAT": "json",
+    })
+    cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+    log = open(workdir / "server.log", "w")
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, proc: Optional[subprocess.Popen], timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté (code {proc.returncode})")
+        try:
+            if (await client.get(f"{url}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Serveur non disponible après {timeout:.0f}s")
+
+
+# ==================== SCÉNARIOS ====================
+
+class Scenario:
+    """Construit la requête n° i d'un endpoint (formulaires distincts : ni cache ni coalescence)"""
+
+    def __init__(self, endpoint: str, unique: bool, analysis: Optional[dict] = None):
+        self.endpoint = endpoint
+        self.unique = unique
+        self.analysis = analysis
+
+    def _form(self, i: int) -> dict:
+        if not self.unique:
+            return FORM
+        return dict(FORM, q5=f"{FORM['q5']} #{i}")
+
+    async def send(self, client: httpx.AsyncClient, url: str, i: int) -> httpx.Response:
+        if self.endpoint == "health":
+            return await client.get(f"{url}/health")
+        if self.endpoint == "analyze":
+            return await client.post(f"{url}/analyze", json={"form_data": self._form(i)})
+        if self.endpoint == "score":
+            # Saisie en cours : q14 et volumétrie changent à chaque frappe (classification des sources non cachée)
+            form = dict(FORM, q14=f"{FORM['q14']}, Export {i}", q8=str(i % 50)) if self.unique else FORM
+            return await client.post(f"{url}/score", json={"form_data": form})
+        return await client.post(f"{url}/save", json={"form_data": self._form(i), "ai_analysis": self.analysis})
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_level(client: httpx.AsyncClient, url: str, scenario: Scenario, concurrency: int,
+                    duration: float, counter: List[int]) -> dict:
+    """concurrency clients en boucle fermée pendant duration secondes"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            counter[0] += 1
+            start = time.perf_counter()
+            try:
+                response = await scenario.send(client, url, counter[0])
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ok = sum(n for status, n in statuses.items() if status.startswith("2"))
+    return {
+        "endpoint": scenario.endpoint,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "status": dict(statuses),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            **{f"p{q}": round(percentile(latencies, q), 2) for q in PERCENTILES},
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        },
+    }
+
+
+async def sample_workers(client: httpx.AsyncClient, url: str, window: float, workers: int) -> Dict[str, dict]:
+    """Mémoire et retard de boucle de chaque worker (les /health sont répartis entre workers)"""
+    seen: Dict[str, dict] = {}
+    for _ in range(max(4, workers * 8)):
+        try:
+            # Nouvelle connexion à chaque fois : une connexion keep-alive resterait sur le même worker
+            response = await client.get(f"{url}/health", params={"lag_window": window}, headers={"Connection": "close"})
+            runtime = response.json().get("runtime")
+        except (httpx.HTTPError, ValueError):
+            continue
+        if runtime:
+            seen[str(runtime["pid"])] = {"rss_mb": runtime.get("rss_mb"), "loop_lag_ms": runtime.get("loop_lag_ms")}
+        if len(seen) >= workers:
+            break
+    return seen
+
+
+# ==================== COMPARAISON ====================
+
+def compare(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """Paliers dont le débit baisse ou le p99 augmente de plus de tolerance (fraction)"""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = previous.get((r["endpoint"], r["concurrency"]))
+        if old is None:
+            continue
+        label = f"{r['endpoint']} x{r['concurrency']}"
+        if old["rps"] and r["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{label}: débit {old['rps']} -> {r['rps']} req/s")
+        old_p99, new_p99 = old["latency_ms"]["p99"], r["latency_ms"]["p99"]
+        if old_p99 and new_p99 > old_p99 * (1 + tolerance):
+            regressions.append(f"{label}: p99 {old_p99} -> {new_p99} ms")
+    return regressions
+
+
+# ==================== EXÉCUTION ====================
+
+async def run(args) -> dict:
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Endpoints inconnus: {', '.join(sorted(unknown))} (attendu: {', '.join(ENDPOINTS)})")
+
+    proc = None
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest-"))
+    url = args.url
+    if url is None:
+        proc, url = start_server(args, workdir)
+        print(f"🚀 Serveur lancé ({args.workers} worker(s), LLM simulé {args.llm_latency_ms:.0f} ms) : {url}")
+
+    limits = httpx.Limits(max_connections=max(levels) + 8, max_keepalive_connections=max(levels) + 8)
+    results = []
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+            await wait_ready(client, url, proc)
+            health = (await client.get(f"{url}/health")).json()
+
+            analysis = None
+            if "save" in endpoints:
+                response = await client.post(f"{url}/analyze", json={"form_data": FORM})
+                response.raise_for_status()
+                analysis = response.json()
+
+            counter = [0]
+            for endpoint in endpoints:
+                scenario = Scenario(endpoint, unique=not args.cache, analysis=analysis)
+                for concurrency in levels:
+                    result = await run_level(client, url, scenario, concurrency, args.duration, counter)
+                    result["workers"] = await sample_workers(client, url, args.duration, args.workers)
+                    results.append(result)
+                    lat = result["latency_ms"]
+                    lags = [w["loop_lag_ms"]["p99"] for w in result["workers"].values() if w.get("loop_lag_ms")]
+                    rss = [w["rss_mb"] for w in result["workers"].values() if w.get("rss_mb") is not None]
+                    print(
+                        f"  {endpoint:<8} x{concurrency:<4} {result['rps']:>8.1f} req/s  "
+                        f"p50 {lat['p50']:>7.1f}  p99 {lat['p99']:>7.1f} ms  "
+                        f"erreurs {result['errors']:<5} "
+                        f"lag p99 {max(lags) if lags else 0:>6.1f} ms  "
+                        f"RSS {max(rss) if rss else 0:>6.1f} Mo"
+                    )
+    except Exception:
+        if proc is not None:
+            print(f"❌ Journal du serveur : {workdir / 'server.log'}")
+        raise
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "url": args.url,
+            "workers": args.workers,
+            "levels": levels,
+            "duration_s": args.duration,
+            "cache": args.cache,
+            "llm_backend": health.get("llm_backend"),
+            "model": health.get("model"),
+            "fake_llm": None if args.url else {
+                "latency_ms": args.llm_latency_ms,
+                "jitter_ms": args.llm_jitter_ms,
+                "error_rate": args.llm_error_rate,
+            },
+        },
+        "results": results,
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge /analyze, /save, /score, /health")
+    parser.add_argument("--url", help="Serveur déjà lancé (sinon : uvicorn lancé avec LLM_BACKEND=fake)")
+    parser.add_argument("--workers", type=int, default=1, help="Workers uvicorn du serveur lancé")
+    parser.add_argument("--levels", default="1,4,16,64", help="Paliers de concurrence")
+    parser.add_argument("--duration", type=float, default=10, help="Durée de chaque palier (s)")
+    parser.add_argument("--endpoints", default="health,analyze,save")
+    parser.add_argument("--cache", action="store_true", help="Formulaire identique à chaque requête (cache actif)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", type=Path, help="Fichier JSON (défaut: bench_results/loadtest-<date>.json)")
+    parser.add_argument("--baseline", type=Path, help="Résultats d'une version précédente à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Écart toléré avant régression (0.2 = 20 %%)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    output = args.output or DEFAULT_OUTPUT_DIR / f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Résultats: {output}")
+
+    if args.baseline:
+        regressions = compare(report["results"], json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        if regressions:
+            print(f"⚠️ {len(regressions)} régression(s) par rapport à {args.baseline}:")
+            for line in regressions:
+                print(f"   - {line}")
+            return 1
+        print(f"✅ Aucune régression par rapport à {args.baseline} (tolérance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,17 +1,42 @@
 import os
 import json
+import uuid
+import asyncio
+import hashlib
 import logging
+import threading
 import time
-from datetime import datetime
+from contextlib import asynccontextmanager
 from pathlib import Path
-from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from typing import Awaitable, Callable, Dict, List, MutableMapping, Optional, Tuple
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-try:
-    from openai import OpenAI
-except Exception:  # pragma: no cover
-    OpenAI = None  # will error at runtime if missing
+from pydantic import BaseModel, Field
+
+import llm
+import request_log
+import metrics
+import runtime_stats
+import routing
+from cache import make_cache_key, cache_from_env
+from store import build_payload, form_data_from_payload, store_from_env
+from shared_state import AdmissionRejected, admission_from_env, state_from_env
+from scoring import ScoringWeights, calculate_scoring, get_rules, reload_rules, score_components
+from streaming import SectionStreamParser, sse_event
+from prompts import (
+    PROMPT_VERSION, SYSTEM_PROMPT, SYSTEM_CONTENT, TEMPERATURE,
+    PromptPlan, build_messages, build_prompt, build_update_prompt, configure_budgets, supports_structured_outputs
+)
+import prompts
+import incremental
+import source_classifier
+from incremental import IncrementalUpdate
+from routing import LLMTimeout, RouteTrace, RoutingConfig, close_stream, iterate_until, run_routed
+from batch_jobs import BatchJobManager, archived_items, provider_from_env
+from analysis_jobs import IdempotencyConflict, JobFailed, QueueFull, queue_from_env
+from batch import call_with_retries, error_status, limiter_from_env, ndjson_lines, run_batch
 
 from models import (
     FormAnalysisResponse, FormAnalysisResponseWithoutScoring, AnalyzeRequest, FormData,
@@ -25,170 +50,181 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+
+def load_env_file():
+    """Charge le premier .env trouvé depuis backend/ vers la racine (python-dotenv importé seulement s'il y en a un)"""
+    here = Path(__file__).resolve().parent
+    for directory in (here, *here.parents):
+        if (directory / ".env").is_file():
+            from dotenv import load_dotenv
+            load_dotenv(directory / ".env")
+            return
+
+
+load_env_file()
+# LOG_FORMAT=json : une ligne JSON par requête, sans les traces détaillées (prompt, réponse)
+request_log.configure()
+metrics.configure()
+configure_budgets()
+LOG_VERBOSE = not request_log.json_mode()
 MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o")
+# Backend LLM : "openai" (défaut) ou "fake" (réponses locales simulées, pour les tests de charge)
+LLM_BACKEND = llm.backend_name()
+# Analyse en lot : concurrence par défaut / maximale, nombre max de formulaires et de retries
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+BATCH_MAX_RETRIES = int(os.environ.get("BATCH_MAX_RETRIES", "5"))
+# Vérification Structured Outputs faite une fois (build_llm_request renvoie 400 si non supporté)
+MODEL_SUPPORTED = supports_structured_outputs(MODEL)
+# Routage : formulaires simples vers le modèle rapide, délai par requête, couverture et bascule
+ROUTING = RoutingConfig.from_env(MODEL)
+if ROUTING.enabled and not supports_structured_outputs(ROUTING.fast_model):
+    logger.warning(f"⚠️ Modèle rapide {ROUTING.fast_model} sans Structured Outputs : routage désactivé")
+    ROUTING = RoutingConfig(MODEL, enabled=False, hedge_after=ROUTING.hedge_after,
+                            timeout=ROUTING.timeout, fallback=ROUTING.fallback)
 
 
-# ==================== CALCUL DU SCORING ====================
-def calculate_scoring(form_data: FormData, elements_count: int, total_sources: int, complexity_category: str = "Standard") -> Scoring:
-    """
-    Calcule le scoring de manière déterministe côté backend.
-    Basé sur les réponses du formulaire + analyse IA (nombre et catégorie des sources).
-    """
-    # Helper: Parser Q9 (format "1j 2h 30min" ou juste nombre) en heures
-    def parse_time_to_hours(time_str: str) -> float:
-        if not time_str:
-            return 0
-        hours = 0
-        # Parser format "1j 2h 30min"
-        import re
-        days_match = re.search(r'(\d+)j', time_str)
-        hours_match = re.search(r'(\d+)h', time_str)
-        mins_match = re.search(r'(\d+)min', time_str)
-        
-        if days_match:
-            hours += int(days_match.group(1)) * 7  # 1 jour = 7h
-        if hours_match:
-            hours += int(hours_match.group(1))
-        if mins_match:
-            hours += int(mins_match.group(1)) / 60
-            
-        return hours
-    
-    # Q7 - Fréquence (jours par mois - valeur brute saisie)
-    try:
-        freq_val = float(form_data.q7 or 0)
-    except (ValueError, TypeError):
-        freq_val = 0
-    
-    # Q8 - Nombre d'exécutions (valeur brute)
-    try:
-        exec_val = int(form_data.q8 or 0)
-    except ValueError:
-        exec_val = 0
-    
-    # Q9 - Temps unitaire en heures
-    time_val = parse_time_to_hours(form_data.q9 or "")
-    
-    # Q10 - Nombre de personnes (valeur brute saisie)
-    try:
-        people_val = int(form_data.q10 or 1)
-    except (ValueError, TypeError):
-        people_val = 1
-    
-    # CALCUL DU GAIN DE TEMPS MENSUEL (heures) - Pour information uniquement (ETP)
-    # Temps par personne
-    temps_par_personne = freq_val * exec_val * time_val
-    # Gain total = temps par personne × nombre de personnes
-    temps_mensuel_total = temps_par_personne * people_val
-    
-    # Note : Le gain de temps n'est pas scoré, on utilise les ETP pour comparer l'impact
-    
-    # FAISABILITÉ TECHNIQUE (0-30 points)
-    faisabilite_score = 0
-    
-    # Q17 - Règles claires
-    rules_map = {"Oui": 10, "Partiellement": 6, "Non": 2}
-    faisabilite_score += rules_map.get(form_data.q17, 0)
-    
-    # Nombre de sources + Catégorie de complexité (calculés par l'IA)
-    # Points basés sur le nombre TOTAL de sources (max 5 points)
-    # Plus il y a de sources, plus c'est complexe à intégrer
-    if total_sources <= 2:
-        sources_points = 5
-    elif total_sources <= 5:
-        sources_points = 3
-    elif total_sources <= 10:
-        sources_points = 1
-    else:
-        sources_points = 0  # Très nombreuses sources
-    faisabilite_score += sources_points
-    
-    # Points basés sur la catégorie de complexité (max 5 points)
-    complexity_category_map = {
-        "Standard": 5,           # Facile à intégrer
-        "Intermédiaire": 3,      # Traitement modéré
-        "Complexe": 1,           # Extraction avancée
-        "Non standardisée": 0    # Très difficile
-    }
-    faisabilite_score += complexity_category_map.get(complexity_category, 0)
-    
-    # Q19 - Complexité organisationnelle
-    complexity_map = {"Simple": 7, "Moyenne": 4, "Complexe": 1}
-    faisabilite_score += complexity_map.get(form_data.q19, 0)
-    
-    # Q15 - Action manuelle requise
-    manual_map = {"Non": 3, "Oui": 0}
-    faisabilite_score += manual_map.get(form_data.q15, 0)
-    
-    # URGENCE (0-30 points)
-    urgence_score = 0
-    try:
-        irritant = int(form_data.q11 or 0)
-        urgence_score = irritant * 6  # 1-5 × 6 = 6-30
-    except ValueError:
-        urgence_score = 0
-    
-    # Convertir en base 100 pour l'affichage
-    faisabilite_normalized = round((faisabilite_score / 30) * 100)
-    urgence_normalized = round((urgence_score / 30) * 100)
-    
-    # GAIN TEMPS MENSUEL (heures)
-    # C'est le temps mensuel total calculé précédemment
-    gain_temps = int(temps_mensuel_total)
-    
-    # Formule lisible
-    complexity_points = complexity_category_map.get(complexity_category, 0)
-    formula = (
-        f"Faisabilité[Règles({form_data.q17}={rules_map.get(form_data.q17, 0)}) + "
-        f"NbSources({total_sources}={sources_points}pts) + "
-        f"CatégorieSources({complexity_category}={complexity_points}pts) + "
-        f"ComplexitéOrga({form_data.q19}={complexity_map.get(form_data.q19, 0)}) + "
-        f"ActionManuelle({form_data.q15}={manual_map.get(form_data.q15, 0)}) = {faisabilite_score}/30 = {faisabilite_normalized}/100] | "
-        f"Urgence[Irritant({form_data.q11}×6) = {urgence_score}/30 = {urgence_normalized}/100]"
-    )
-    
-    justification = (
-        f"Faisabilité Technique {faisabilite_normalized}/100 "
-        f"({total_sources} sources ({elements_count} types) catégorie {complexity_category}, règles {form_data.q17 or 'non spécifié'}, "
-        f"complexité orga {form_data.q19 or 'non spécifié'}), "
-        f"Urgence {urgence_normalized}/100 (irritant {form_data.q11}/5). "
-        f"Gain de temps mensuel : {temps_mensuel_total:.1f}h = {freq_val}j/mois × {exec_val} exécutions × "
-        f"{form_data.q9} × {people_val} personnes = {temps_mensuel_total/140:.1f} ETP."
-    )
-    
-    return Scoring(
-        faisabilite_technique_score=f"{faisabilite_normalized}/100",
-        urgence_score=f"{urgence_normalized}/100",
-        formula=formula,
-        justification=justification,
-        gain_temps_mensuel_heures=gain_temps
-    )
+# État partagé entre workers (SHARED_STATE_URL) : cache, clés d'idempotence, budgets OpenAI
+shared_state = state_from_env()
+
+# Cache des réponses IA (mémoire + disque, ou état partagé), None si désactivé
+analysis_cache = cache_from_env(shared_state)
 
-app = FastAPI(title="CM Form PD – AI Proxy", version="1.0.0")
+# Store SQLite des use cases sauvegardés
+use_case_store = store_from_env()
 
-# Log au démarrage
-@app.on_event("startup")
-async def startup_event():
+# Index de similarité des use cases sauvegardés (quasi-doublons) : créé au préchauffage, None si désactivé
+similarity_index = None
+
+# Budget RPM/TPM OpenAI partagé par tous les lots (du process, ou de tous les workers)
+batch_limiter = limiter_from_env(shared_state)
+
+# Appels LLM interactifs simultanés (LLM_MAX_CONCURRENCY) : au-delà, 429 + Retry-After
+llm_admission = admission_from_env(shared_state, lease=ROUTING.timeout + 30)
+
+# Jobs batch fournisseur : intervalle de suivi (s, 0 = pas de suivi automatique) et taille max
+BATCH_JOBS_POLL_INTERVAL = float(os.environ.get("BATCH_JOBS_POLL_INTERVAL", "60"))
+BATCH_JOB_MAX_ITEMS = int(os.environ.get("BATCH_JOB_MAX_ITEMS", "50000"))
+
+# ==================== DÉMARRAGE ====================
+
+# Préchauffage : imports lourds (openai, numpy), client LLM, base, index de similarité, tokenizer.
+# Le schéma OpenAPI (~0,25 s) reste construit à la première visite de /docs.
+# STARTUP_MODE=eager (défaut) : fait avant d'accepter le trafic ;
+# STARTUP_MODE=fast : en tâche de fond, le port est ouvert tout de suite et /ready passe à 200 une fois prêt
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "eager").strip().lower()
+_warmup = {"done": False, "seconds": None, "steps": {}}
+
+
+def log_banner():
     logger.info("=" * 80)
     logger.info("🚀 BACKEND DÉMARRÉ")
     logger.info("=" * 80)
-    logger.info(f"Modèle OpenAI: {MODEL}")
+    logger.info(f"Modèle OpenAI: {MODEL} (backend {LLM_BACKEND})")
+    if ROUTING.enabled:
+        logger.info(f"Routage: formulaires simples -> {ROUTING.fast_model}, délai {ROUTING.timeout:g}s, "
+                    f"couverture après {ROUTING.hedge_after:g}s")
     logger.info(f"API Key présente: {'✅' if os.environ.get('OPENAI_API_KEY') else '❌'}")
+    logger.info(f"Règles de scoring: version {get_rules().version}")
+    logger.info(f"État partagé: {shared_state.name}"
+                + (f", {llm_admission.limit} appels LLM simultanés max" if llm_admission.enabled else ""))
+    if not MODEL_SUPPORTED:
+        logger.warning(f"⚠️ Modèle {MODEL} sans Structured Outputs : /analyze répondra 400")
     logger.info("Endpoints disponibles:")
-    logger.info("  - GET  /health")
+    logger.info("  - GET  /health, /ready")
     logger.info("  - POST /ai")
     logger.info("  - POST /analyze (Structured Outputs)")
+    logger.info("  - GET  /jobs/{id} (analyses en tâche de fond)")
     logger.info("  - POST /save (Sauvegarde use case)")
     logger.info("=" * 80 + "\n")
 
+
+def _load_similarity_index():
+    """Import de similarity (NumPy) et construction de l'index, hors de la boucle ; rien si désactivé"""
+    if os.environ.get("SIMILARITY_ENABLED", "1") in ("0", "false", "False"):
+        return None
+    from similarity import similarity_from_env
+    return similarity_from_env(use_case_store)
+
+
+async def _warm_step(name: str, func, *args):
+    """Exécute une étape du préchauffage dans un thread et note sa durée ; une erreur est journalisée sans bloquer"""
+    start = time.perf_counter()
+    try:
+        result = await run_in_threadpool(func, *args)
+        _warmup["steps"][name] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+    except Exception as e:
+        _warmup["steps"][name] = f"erreur: {e}"
+        logger.warning(f"⚠️ Préchauffage {name} en échec: {e}")
+        return None
+
+
+async def warm_up():
+    """Charge ce que la première requête paierait sinon, étape par étape (durées exposées par /ready)"""
+    global similarity_index
+    start = time.perf_counter()
+    await _warm_step("llm_import", llm.preload)
+    await _warm_step("llm_client", llm.init_client)
+    await _warm_step("store", use_case_store.fingerprint)
+    index = await _warm_step("similarity_index", _load_similarity_index)
+    if index is not None:
+        similarity_index = index
+        similarity_index.start()
+    await _warm_step("tokenizer", prompts.system_tokens)
+    _warmup["seconds"] = round(time.perf_counter() - start, 3)
+    _warmup["done"] = True
+    steps = ", ".join(f"{name} {ms} ms" for name, ms in _warmup["steps"].items())
+    logger.info(f"✅ Prêt ({STARTUP_MODE}) : préchauffage en {_warmup['seconds']:.2f}s ({steps})")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_banner()
+    runtime_stats.start_monitor()
+    request_log.register_routes(route.path for route in app.routes)
+    tasks = []
+    if STARTUP_MODE == "fast":
+        tasks.append(asyncio.get_running_loop().create_task(warm_up()))
+    else:
+        await warm_up()
+    await analysis_job_queue.start()
+    if BATCH_JOBS_POLL_INTERVAL > 0:
+        tasks.append(asyncio.get_running_loop().create_task(
+            batch_job_manager.poll_forever(BATCH_JOBS_POLL_INTERVAL)
+        ))
+    yield
+    for task in tasks:
+        task.cancel()
+    await analysis_job_queue.stop()
+    if similarity_index:
+        await similarity_index.stop()
+    await runtime_stats.stop_monitor()
+    await llm.close_client()
+    request_log.close_capture()
+
+
+app = FastAPI(title="CM Form PD – AI Proxy", version="1.0.0", lifespan=lifespan)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Use-Case-Id", "X-Request-ID", "X-LLM-Route", "X-LLM-Model", "X-Reused-From", "X-Incremental-Sections",
+                    "Retry-After"],
 )
+app.add_middleware(request_log.RequestLogMiddleware)
+
+
+def require_llm_backend():
+    """500 si le backend LLM configuré (LLM_BACKEND) n'est pas utilisable : clé ou package manquant"""
+    try:
+        llm.check_backend()
+    except llm.BackendUnavailable as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 class AiRequest(BaseModel):
@@ -200,21 +236,71 @@ class AiResponse(BaseModel):
 
 
 @app.get("/health")
-def health():
-    return {"ok": True, "model": MODEL}
+def health(lag_window: Optional[float] = Query(None, gt=0, description="Fenêtre (s) du retard de boucle")):
+    return {
+        "ok": True,
+        "model": MODEL,
+        "llm_backend": LLM_BACKEND,
+        "scoring_rules_version": get_rules().version,
+        "cache": analysis_cache.stats() if analysis_cache else None,
+        "shared_state": shared_state.describe(),
+        "admission": llm_admission.stats(),
+        "analysis_jobs": analysis_job_queue.stats() if analysis_job_queue.enabled else None,
+        "routing": ROUTING.describe(),
+        "similarity": similarity_index.stats() if similarity_index else None,
+        "runtime": runtime_stats.snapshot(lag_window)
+    }
+
+
+@app.get("/ready")
+def ready(response: Response):
+    """
+    Sonde de disponibilité (distincte de /health, qui répond dès que le process tourne) :
+    503 tant que le préchauffage n'est pas terminé (STARTUP_MODE=fast), puis 200.
+    """
+    if not _warmup["done"]:
+        response.status_code = 503
+    return {
+        "ready": _warmup["done"],
+        "startup_mode": STARTUP_MODE,
+        "warmup_seconds": _warmup["seconds"],
+        "warmup_ms": _warmup["steps"],
+        "similarity_loaded": similarity_index.ready if similarity_index else None,
+    }
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    Métriques Prometheus du worker : durée des étapes d'analyse (prompt, OpenAI, parsing JSON,
+    scoring, validation, écriture), tokens par modèle, cache, erreurs par code, requêtes en cours.
+    """
+    runtime = runtime_stats.snapshot(60)
+    lag = runtime["loop_lag_ms"]
+    extra = []
+    extra += metrics.gauge_lines("cmform_process_resident_memory_bytes", "Mémoire résidente du worker",
+                                 int(runtime["rss_mb"] * 1048576) if runtime["rss_mb"] is not None else None)
+    extra += metrics.gauge_lines("cmform_event_loop_lag_p99_seconds", "Retard p99 de la boucle asyncio (60 dernières s)",
+                                 lag["p99"] / 1000 if lag else None)
+    extra += metrics.gauge_lines("cmform_analyses_in_flight", "Appels LLM partagés en cours (après déduplication)", len(_inflight))
+    extra += metrics.gauge_lines("cmform_pending_writes", "Sauvegardes de fond en attente", len(_pending_writes))
+    if similarity_index:
+        extra += metrics.gauge_lines("cmform_similarity_index_size", "Use cases dans l'index de similarité", len(similarity_index.index))
+    if llm_admission.enabled:
+        extra += metrics.gauge_lines("cmform_llm_slots_in_use", "Appels LLM en cours (tous workers avec un état partagé)",
+                                     shared_state.slot_count("llm"))
+    if analysis_cache:
+        extra += metrics.gauge_lines("cmform_analysis_cache_memory_entries", "Entrées du cache mémoire", analysis_cache.stats()["memory_entries"])
+    return Response(metrics.render(extra), media_type=metrics.CONTENT_TYPE)
 
 
 @app.post("/ai", response_model=AiResponse)
 async def ai(req: AiRequest):
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="OPENAI_API_KEY manquant dans l'environnement")
-    if OpenAI is None:
-        raise HTTPException(status_code=500, detail="Package openai manquant. Installez-le via requirements.txt")
+    require_llm_backend()
 
     try:
-        client = OpenAI(api_key=api_key)
-        resp = client.chat.completions.create(
+        client = llm.get_client()
+        resp = await client.chat.completions.create(
             model=MODEL,
             messages=[
                 {"role": "system", "content": "Tu es un assistant expert en design de processus et delivery produit."},
@@ -229,184 +315,132 @@ async def ai(req: AiRequest):
         raise HTTPException(status_code=502, detail=str(e))
 
 
-@app.post("/analyze", response_model=FormAnalysisResponse)
-async def analyze_form(req: AnalyzeRequest):
+def build_llm_request(plan: PromptPlan, model: str = MODEL) -> dict:
+    """Paramètres de l'appel Structured Outputs (modèle, messages, schéma strict précalculé ou restreint aux sections du plan, max_tokens)"""
+    if not MODEL_SUPPORTED:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Modèle {MODEL} ne supporte pas Structured Outputs. Utilisez gpt-4o ou gpt-4o-mini"
+        )
+    return {
+        "model": model,
+        "messages": build_messages(plan.context),
+        "response_format": plan.response_format,
+        "temperature": TEMPERATURE,
+        "max_tokens": plan.max_tokens
+    }
+
+
+def route_for(form_data: FormData) -> RouteTrace:
+    """Modèle de l'analyse selon la complexité du formulaire (et modèle de secours)"""
+    return routing.decide(form_data, ROUTING, MODEL)
+
+
+def prepare_prompt(form_data: FormData, model: str = MODEL, update: Optional[IncrementalUpdate] = None) -> PromptPlan:
+    """Prompt budgété (réponses libres compactées si besoin) ; tokens retenus tracés dans le log"""
+    with request_log.stage("prompt_build"):
+        if update is not None:
+            plan = build_update_prompt(form_data, update.sections, update.reused, update.changed, model)
+        else:
+            plan = build_prompt(form_data, model)
+    request_log.record_prompt(plan.report())
+    return plan
+
+
+async def request_llm_analysis(plan: PromptPlan, max_retries: Optional[int] = None,
+                               trace: Optional[RouteTrace] = None, hedge: bool = True, limiter=None) -> dict:
     """
-    Analyse structurée du formulaire avec Structured Outputs.
-    Garantit une structure JSON fixe et des catégories strictes.
+    Appelle OpenAI (Structured Outputs) et retourne le JSON brut de l'analyse, sans scoring.
+    Les erreurs OpenAI sont propagées telles quelles (l'appelant décide des retries / du code HTTP).
+    Réponse coupée par max_tokens : un nouvel essai au plafond MAX_TOKENS.
+    Modèle choisi par trace (routage), dans le délai LLM_REQUEST_TIMEOUT, avec couverture
+    (hedge) et bascule sur le modèle de secours ; les tentatives sont ajoutées à trace.
+    limiter : chaque appel au fournisseur (secours compris) attend son créneau RPM/TPM.
     """
-    logger.info("=" * 80)
-    logger.info("📥 NOUVELLE REQUÊTE D'ANALYSE")
-    logger.info("=" * 80)
-    
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="OPENAI_API_KEY manquant")
-    if OpenAI is None:
-        raise HTTPException(status_code=500, detail="Package openai manquant")
-
-    # Construire le prompt contextuel
-    d = req.form_data
-    logger.info(f"📋 Données formulaire reçues:")
-    logger.info(f"   - Persona: {d.q1} {d.q2} ({d.q3} - {d.q4})")
-    logger.info(f"   - Brief: {(d.q5 or '')[:100]}...")
-    logger.info(f"   - Volumétrie: {d.q7} / {d.q8} exec / {d.q9} unitaire")
-    
-    # Construire le contexte (éviter les {} dans f-string)
-    context = """
-CONTEXTE FORMULAIRE - ANALYSE PROCESS DESIGNER
-
-=== PERSONA ===
-Nom: """ + (d.q1 or '-') + " " + (d.q2 or '-') + """
-Rôle: """ + (d.q3 or '-') + """
-Département: """ + (d.q4 or '-') + """
-
-=== BESOIN ===
-Brief utilisateur:
-""" + (d.q5 or '-') + """
-
-Exécution actuelle:
-""" + (d.q6 or '-') + """
-
-=== VOLUMÉTRIE ===
-Fréquence: """ + (d.q7 or '-') + """
-Nb exécutions/occurrence: """ + (d.q8 or '-') + """
-Temps unitaire: """ + (d.q9 or '-') + """
-Nb personnes: """ + (d.q10 or '-') + """
-Irritant: """ + (d.q11 or '3') + """/5
-Pourquoi irritant: """ + (d.q12 or '-') + """
-Pourquoi urgent: """ + (d.q13 or '-') + """
-
-=== NATURE TÂCHE ===
-Éléments sources: """ + (d.q14 or '-') + """
-Action manuelle: """ + (d.q15 or '-') + """
-Exemple action: """ + (d.q16 or '-') + """
-Règles simples: """ + (d.q17 or '-') + """
-Points complexes: """ + (d.q18 or '-') + """
-Complexité orga: """ + (d.q19 or '-') + """
-Outils: """ + (d.q20 or '-') + """
-
-=== INSTRUCTIONS ===
-1. USER STORY:
-   - project_name: Génère un NOM DE PROJET court et impactant (3-6 mots max)
-     Exemple: "Automatisation Saisie Factures SAP" ou "Robot Rapprochement Comptable"
-   - html: User story HTML (max 100 mots) AVEC CONTEXTE
-     Format: <p><strong>En tant que</strong> [Prénom Nom], [Fonction/Rôle] au sein du [Département],</p>
-             <p><strong>j'ai besoin de</strong> [besoin détaillé]</p>
-             <p><strong>afin de</strong> [bénéfice concret et mesurable].</p>
-     IMPORTANT: Ne PAS mentionner la volumétrie dans le "En tant que", seulement le persona
-
-2. EXECUTION SCHEMA: Diagramme ASCII vertical UNIQUEMENT (pas de liste étapes)
-
-3. ELEMENTS SOURCES (Q14):
-   - types: Catégorise STRICTEMENT chaque source
-   - count: Nombre de TYPES UNIQUES (Excel GL + Excel OSB + SAP = 2 types: Excel, ERP_CRM)
-   - total_sources: Nombre TOTAL de sources (Excel GL + Excel OSB + SAP = 3 sources)
-   - complexity_level: Catégorise la complexité globale selon :
-     * Standard: Sources structurées et faciles (BD, CSV, XLSX, JSON)
-     * Intermédiaire: Semi-structurées, traitement modéré (APIs, XML, logs)
-     * Complexe: Non structurées, extraction avancée (PDF, texte libre, images OCR, audio)
-     * Non standardisée: Humaines/imprévisibles (emails libres, conversations orales)
-
-4. ANALYSIS: Pain points, bénéfices, score faisabilité, priorité
-
-5. PRO/CON:
-   - pros: 3-5 arguments POUR. Chaque: argument + weight (Faible/Moyen/Fort)
-   - cons: 2-4 arguments CONTRE. Chaque: argument + weight (Faible/Moyen/Fort)
-
-6. DELIVERY:
-   - dev_time: Temps total
-   - phases (2-3): Phases simples
-     * name: POC / MVP / Production
-     * feature_principale: LA feature principale exploitable
-     * risque_principal: LE risque principal
-     * duration: Durée
-   - quick_wins (3-5): "En attendant, essaye de..."
-"""
+    client = llm.get_client()
+    trace = trace or RouteTrace("strong", MODEL, None, [])
+    context = plan.context
 
-    try:
-        client = OpenAI(api_key=api_key)
-        
-        # Vérifier que le modèle supporte Structured Outputs
-        if MODEL not in ["gpt-4o", "gpt-4o-mini", "gpt-4o-2024-08-06"]:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Modèle {MODEL} ne supporte pas Structured Outputs. Utilisez gpt-4o ou gpt-4o-mini"
-            )
-        
-        # Générer le schéma JSON (sans scoring, calculé côté backend)
-        schema = FormAnalysisResponseWithoutScoring.model_json_schema()
-        
+    if LOG_VERBOSE:
         logger.info("\n" + "=" * 80)
         logger.info("🤖 APPEL OPENAI")
         logger.info("=" * 80)
-        logger.info(f"Modèle: {MODEL}")
-        system_prompt = "Tu es un expert en analyse de processus métier et automatisation. Tu dois analyser un formulaire et produire une réponse JSON STRICTEMENT conforme au schéma fourni. Utilise UNIQUEMENT les catégories prédéfinies dans les enums."
-        
+        logger.info(f"Modèle: {trace.model} (niveau {trace.tier}, secours {trace.fallback or '-'})")
+
         logger.info(f"\n📤 MESSAGES ENVOYÉS À OPENAI:")
         logger.info("-" * 80)
-        logger.info(f"SYSTEM: {system_prompt}")
+        logger.info(f"SYSTEM: {SYSTEM_PROMPT} (+ instructions statiques, {len(SYSTEM_CONTENT)} caractères)")
         logger.info("")
         logger.info(f"USER:\n{context}")
         logger.info("-" * 80)
+        logger.info(f"🧮 Budget: {plan.input_tokens} tokens en entrée, max_tokens {plan.max_tokens}"
+                    + (f", compactés: {', '.join(plan.compacted)}" if plan.compacted else ""))
         logger.info("\n⏳ Appel OpenAI en cours...")
-        
-        # Chronomètre
-        start_time = time.time()
-        
-        # Appel avec Structured Outputs
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": context
-                }
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "form_analysis_response",
-                    "strict": True,
-                    "schema": schema
-                }
-            },
-            temperature=0.3,
-            max_tokens=2000
-        )
-        
-        # Temps écoulé
-        elapsed = time.time() - start_time
-        logger.info(f"✅ Réponse OpenAI reçue en {elapsed:.2f}s")
-        
+
+    # Chronomètre
+    start_time = time.time()
+
+    # Appel avec Structured Outputs
+    if max_retries is not None:
+        client = client.with_options(max_retries=max_retries)
+
+    async def create(request: dict):
+        if limiter is not None:
+            # Tokens mesurés du prompt + max_tokens demandé (comptés par le fournisseur dans le TPM)
+            await limiter.acquire(plan.input_tokens + request["max_tokens"])
+        return await client.chat.completions.create(**request)
+
+    async def attempt(model: str):
+        request = build_llm_request(plan, model)
+        response = await create(request)
+        cap = prompts.OUTPUT_BUDGET.cap
+        if getattr(response.choices[0], "finish_reason", None) == "length" and request["max_tokens"] < cap:
+            logger.warning(f"⚠️ Réponse coupée à {request['max_tokens']} tokens, nouvel essai à {cap}")
+            request_log.record_usage(getattr(response, 'usage', None), model)
+            request["max_tokens"] = cap
+            response = await create(request)
+        return response
+
+    with request_log.stage("llm"):
+        response = await run_routed(trace, attempt, ROUTING, hedge=hedge)
+    model = trace.served_by
+
+    # Temps écoulé
+    elapsed = time.time() - start_time
+    usage = getattr(response, 'usage', None)
+    request_log.record_usage(usage, model)
+    # max_tokens est dimensionné sur les analyses complètes : les réponses partielles ne comptent pas
+    if getattr(response.choices[0], "finish_reason", None) != "length" and not plan.sections:
+        prompts.OUTPUT_BUDGET.observe(getattr(usage, "completion_tokens", None))
+
+    if LOG_VERBOSE:
+        logger.info(f"✅ Réponse OpenAI ({model}) reçue en {elapsed:.2f}s")
         # Tokens utilisés
-        if hasattr(response, 'usage') and response.usage:
+        if usage:
             logger.info(f"📊 Tokens utilisés:")
-            logger.info(f"   - Prompt: {response.usage.prompt_tokens}")
-            logger.info(f"   - Completion: {response.usage.completion_tokens}")
-            logger.info(f"   - Total: {response.usage.total_tokens}")
-        
-        # Parse et valide avec Pydantic
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("Réponse OpenAI vide")
-        
+            logger.info(f"   - Prompt: {usage.prompt_tokens}")
+            logger.info(f"   - Completion: {usage.completion_tokens}")
+            logger.info(f"   - Total: {usage.total_tokens}")
+
+    content = response.choices[0].message.content
+    if not content:
+        raise ValueError("Réponse OpenAI vide")
+
+    # Parse JSON (une seule fois, réutilisé pour l'affichage)
+    try:
+        with request_log.stage("json_parse"):
+            result_json = json.loads(content)
+    except json.JSONDecodeError:
+        if LOG_VERBOSE:
+            logger.info(f"\n📥 RÉPONSE OPENAI (brute):\n{content}")
+        raise
+    request_log.capture(model, context, content)
+
+    if LOG_VERBOSE:
         logger.info("\n📥 RÉPONSE OPENAI (JSON):")
         logger.info("-" * 80)
-        # Pretty print du JSON
-        try:
-            formatted_json = json.dumps(json.loads(content), indent=2, ensure_ascii=False)
-            logger.info(formatted_json)
-        except:
-            logger.info(content)
+        logger.info(json.dumps(result_json, indent=2, ensure_ascii=False))
         logger.info("-" * 80)
-        
-        # Parse JSON
-        result_json = json.loads(content)
         logger.info("\n✅ JSON parsé avec succès")
         logger.info(f"📊 Aperçu:")
         logger.info(f"   - User story: {result_json.get('user_story', {}).get('word_count', 0)} mots")
@@ -419,140 +453,740 @@ Outils: """ + (d.q20 or '-') + """
         logger.info(f"   - Temps dev: {result_json.get('delivery', {}).get('dev_time', '?')}")
         logger.info(f"   - Phases: {len(result_json.get('delivery', {}).get('phases', []))}")
         logger.info(f"   - Quick wins: {len(result_json.get('delivery', {}).get('quick_wins', []))}")
-        
-        # CALCUL DU SCORING CÔTÉ BACKEND (déterministe)
+    
+    return result_json
+
+
+def score_from_elements(form_data: FormData, elements_sources: dict) -> Scoring:
+    """Scoring à partir de la section elements_sources de l'IA (nombre et catégorie des sources)"""
+    elements_count = elements_sources.get('count', 0)  # Nombre de types
+    total_sources = elements_sources.get('total_sources', 0)  # Nombre total de sources
+    complexity_category = elements_sources.get('complexity_level', 'Standard')
+    return calculate_scoring(form_data, elements_count, total_sources, complexity_category)
+
+
+def check_sources(form_data: FormData, result_json: dict) -> dict:
+    """
+    Section elements_sources produite par l'IA comparée à la pré-classification locale de q14
+    (accord sur /metrics et dans le log). SOURCE_CLASSIFIER=local : section remplacée par la
+    classification locale quand toutes les sources sont reconnues.
+    """
+    mode = source_classifier.mode()
+    elements = result_json.get("elements_sources")
+    if mode == "off" or not isinstance(elements, dict):
+        return result_json
+    with request_log.stage("source_check"):
+        local = source_classifier.classify_sources(form_data.q14)
+        agreement = source_classifier.compare(local, elements)
+    replaced = mode == "local" and local.confident
+    request_log.record_sources({"mode": mode, "confident": local.confident, "agreement": agreement, "replaced": replaced})
+    if replaced:
+        return dict(result_json, elements_sources=local.elements_sources())
+    return result_json
+
+
+def finalize_analysis(form_data: FormData, result_json: dict) -> FormAnalysisResponse:
+    """
+    Ajoute le scoring calculé côté backend à la réponse IA (sans scoring) et valide le tout.
+    Appelé à chaque analyse, y compris depuis le cache : les règles de scoring s'appliquent toujours.
+    """
+    # CALCUL DU SCORING CÔTÉ BACKEND (déterministe)
+    if LOG_VERBOSE:
         logger.info("\n🧮 Calcul du scoring côté backend...")
-        elements_count = result_json.get('elements_sources', {}).get('count', 0)  # Nombre de types
-        total_sources = result_json.get('elements_sources', {}).get('total_sources', 0)  # Nombre total de sources
-        complexity_category = result_json.get('elements_sources', {}).get('complexity_level', 'Standard')
-        calculated_scoring = calculate_scoring(req.form_data, elements_count, total_sources, complexity_category)
-        
-        # Remplacer le scoring par notre calcul
-        result_json['scoring'] = {
-            'faisabilite_technique_score': calculated_scoring.faisabilite_technique_score,
-            'urgence_score': calculated_scoring.urgence_score,
-            'formula': calculated_scoring.formula,
-            'justification': calculated_scoring.justification,
-            'gain_temps_mensuel_heures': calculated_scoring.gain_temps_mensuel_heures
-        }
+    with request_log.stage("scoring"):
+        calculated_scoring = score_from_elements(form_data, result_json.get('elements_sources', {}))
+    request_log.record_scoring(calculated_scoring)
+    
+    # Remplacer le scoring par notre calcul (sans modifier le dict d'origine, partagé avec le cache)
+    result_with_scoring = dict(result_json)
+    result_with_scoring['scoring'] = calculated_scoring.model_dump()
+    if LOG_VERBOSE:
         logger.info(f"   ✅ Scoring calculé:")
         logger.info(f"      - Faisabilité: {calculated_scoring.faisabilite_technique_score}")
         logger.info(f"      - Urgence: {calculated_scoring.urgence_score}")
         logger.info(f"      - Gain temps: {calculated_scoring.gain_temps_mensuel_heures}h/mois")
-        
-        # Validation Pydantic
-        validated_result = FormAnalysisResponse(**result_json)
+    
+    # Validation Pydantic
+    with request_log.stage("validation"):
+        validated_result = FormAnalysisResponse(**result_with_scoring)
+    if LOG_VERBOSE:
         logger.info("\n✅ Validation Pydantic OK")
         logger.info("=" * 80 + "\n")
+    
+    return validated_result
+
+
+async def get_cached_analysis(form_data: FormData, cache_key: str) -> Optional[FormAnalysisResponse]:
+    """Réponse depuis le cache (scoring recalculé), None si absente ou invalide"""
+    if not analysis_cache:
+        request_log.record_cache("disabled")
+        return None
+    with request_log.stage("cache_lookup"):
+        # Mémoire sans changer de thread ; disque ou état partagé dans le pool de threads
+        cached = analysis_cache.get(cache_key, memory_only=True)
+        if cached is None:
+            cached = await run_in_threadpool(analysis_cache.get, cache_key)
+    if cached is None:
+        request_log.record_cache("miss")
+        return None
+    request_log.record_cache("hit")
+    if LOG_VERBOSE:
+        logger.info(f"♻️ Réponse IA servie depuis le cache ({cache_key[:12]})")
+    try:
+        return finalize_analysis(form_data, cached)
+    except Exception as e:
+        logger.warning(f"⚠️ Entrée de cache invalide, nouvel appel OpenAI: {e}")
+        return None
+
+
+async def get_similar_analysis(form_data: FormData, trace: RouteTrace) -> Optional[Tuple[IncrementalUpdate, dict]]:
+    """
+    Analyse d'un use case existant quasi identique (similarité >= SIMILARITY_REUSE_THRESHOLD) :
+    (sections reprises et sections à régénérer, décision tracée) ou None.
+    La similarité ne porte pas sur la persona : user_story est régénérée si q1-q4 diffèrent
+    (update.sections), les autres sections sont reprises et le scoring recalculé sur ce formulaire.
+    """
+    if not similarity_index or similarity_index.reuse_threshold <= 0:
+        return None
+    with request_log.stage("similarity_lookup"):
+        match = await similarity_index.reusable(form_data)
+    if match is None:
+        return None
+    use_case_id, score, payload = match
+    update = incremental.plan_reuse(form_data_from_payload(payload), payload.get("ai_analysis"), form_data)
+    if update is None:
+        logger.warning(f"⚠️ Analyse du use case {use_case_id} non réutilisable")
+        return None
+    route = {"source": "similar", "use_case_id": use_case_id, "score": round(score, 3)}
+    if update.sections:
+        # Sections régénérées par le LLM : la reprise est tracée avec la route de l'appel
+        trace.reused_from = route
+        trace.sections = update.sections
+    else:
+        request_log.record_cache("similar")
+        request_log.record_routing(route)
+    if LOG_VERBOSE:
+        logger.info(f"♻️ Analyse réutilisée depuis le use case similaire {use_case_id} (similarité {score:.3f})"
+                    + (f", {', '.join(update.sections)} à régénérer" if update.sections else ""))
+    return update, route
+
+
+# ==================== DÉDUPLICATION DES ANALYSES ====================
+
+# Appels OpenAI en cours par clé d'analyse : les requêtes identiques simultanées partagent le même appel
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def analysis_key(form_data: FormData, model: Optional[str] = None) -> str:
+    """
+    Clé d'une analyse : formulaire normalisé + modèle routé + version du prompt (= clé du cache).
+    Sert au cache et à la coalescence des appels en cours ; l'en-tête Idempotency-Key n'y entre pas.
+    """
+    return make_cache_key(form_data, model or route_for(form_data).model, PROMPT_VERSION)
+
+
+def use_case_key(form_data: FormData, idempotency_key: Optional[str] = None, model: Optional[str] = None) -> str:
+    """
+    Clé d'identification du use case sauvegardé : clé d'analyse, combinée à l'en-tête Idempotency-Key
+    s'il est fourni (même en-tête + formulaire modifié = autre use case, jamais l'analyse de l'ancien).
+    """
+    key = analysis_key(form_data, model)
+    if idempotency_key:
+        return hashlib.sha256(f"idempotency:{idempotency_key}:{key}".encode("utf-8")).hexdigest()
+    return key
+
+
+# Intervalle (s) de relecture du cache quand un autre worker fait déjà l'appel
+PEER_POLL_INTERVAL = 0.2
+
+
+async def wait_for_peer(key: str, lease: str) -> Optional[dict]:
+    """
+    Analyse identique en cours sur un autre worker (bail inflight:{key} dans l'état partagé) :
+    attend son résultat dans le cache partagé. None si le bail disparaît sans résultat (erreur).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ROUTING.timeout
+    while loop.time() < deadline:
+        await asyncio.sleep(PEER_POLL_INTERVAL)
+        result_json = await run_in_threadpool(analysis_cache.get, key)
+        if result_json is not None:
+            return result_json
+        if await run_in_threadpool(shared_state.get, f"inflight:{key}") != lease:
+            return await run_in_threadpool(analysis_cache.get, key)
+    return None
+
+
+async def shared_analysis(key: str, fetch: Callable[[], Awaitable[dict]], trace: Optional[RouteTrace] = None) -> dict:
+    """
+    JSON de l'IA pour cette clé : un seul fetch() à la fois, les requêtes identiques arrivées
+    pendant l'appel reçoivent le même résultat (ou la même erreur). Le résultat est mis en cache,
+    sauf s'il vient d'un autre modèle que celui de la clé (trace.served_by : secours ou couverture).
+    L'appel tourne dans sa propre tâche : la déconnexion d'un client ne l'annule pas pour les autres.
+    Avec un état partagé (et le cache actif), la coalescence vaut aussi entre workers.
+    """
+    future = _inflight.get(key)
+    if future is not None:
+        request_log.record_cache("coalesced")
+        if LOG_VERBOSE:
+            logger.info(f"🔗 Analyse identique déjà en cours, résultat partagé ({key[:12]})")
+        return await asyncio.shield(future)
+
+    async def run() -> dict:
+        lease = None
+        if shared_state.distributed and analysis_cache:
+            lease = uuid.uuid4().hex
+            holder = await run_in_threadpool(shared_state.setdefault, f"inflight:{key}", lease, ROUTING.timeout + 5)
+            if holder != lease:
+                lease = None
+                result_json = await wait_for_peer(key, holder)
+                if result_json is not None:
+                    request_log.record_cache("coalesced")
+                    if LOG_VERBOSE:
+                        logger.info(f"🔗 Analyse identique faite par un autre worker, résultat partagé ({key[:12]})")
+                    return result_json
+        try:
+            result_json = await fetch()
+            # Clé construite sur le modèle routé : la réponse du modèle de secours n'y a pas sa place
+            served_by_other = trace is not None and trace.served_by not in (None, trace.model)
+            if analysis_cache and not served_by_other:
+                await run_in_threadpool(analysis_cache.set, key, result_json)
+            elif served_by_other and LOG_VERBOSE:
+                logger.info(f"↪️ Réponse de {trace.served_by} (secours de {trace.model}) non mise en cache")
+            return result_json
+        finally:
+            if lease is not None:
+                await run_in_threadpool(shared_state.delete, f"inflight:{key}", lease)
+
+    task = asyncio.create_task(run())
+    _inflight[key] = task
+    task.add_done_callback(lambda t: _inflight.pop(key, None) if _inflight.get(key) is t else None)
+    return await asyncio.shield(task)
+
+
+# ==================== PERSISTANCE CÔTÉ SERVEUR ====================
+
+# Écritures lancées par /analyze (persist) pas encore terminées : /save avec l'ID attend leur fin
+_pending_writes: Dict[str, threading.Event] = {}
+# Identifiant réservé par clé d'analyse pour ces écritures (deux persist identiques -> même use case)
+_pending_keys: Dict[str, str] = {}
+_reserve_lock = asyncio.Lock()
+# Durée de vie (s) des réservations partagées entre workers (identifiant par clé, écriture en cours)
+PENDING_RESERVATION_TTL = 60
+
+
+def persist_analysis(use_case_id: str, form_data: FormData, analysis: FormAnalysisResponse, key: Optional[str] = None,
+                     route: Optional[dict] = None):
+    """Écrit le use case analysé (tâche de fond, après l'envoi de la réponse)"""
+    try:
+        with request_log.stage("save_write"):
+            payload = build_payload(form_data, analysis, route=route)
+            use_case_store.insert(payload, use_case_id=use_case_id, analysis_key=key)
+        if similarity_index:
+            similarity_index.notify_saved(use_case_id)
+        if LOG_VERBOSE:
+            logger.info(f"💾 Use case sauvegardé après analyse: {use_case_id}")
+    except Exception as e:
+        logger.error(f"❌ Erreur sauvegarde {use_case_id}: {str(e)}")
+    finally:
+        if key is not None and _pending_keys.get(key) == use_case_id:
+            del _pending_keys[key]
+        if shared_state.distributed:
+            shared_state.delete(f"pending-write:{use_case_id}")
+        event = _pending_writes.pop(use_case_id, None)
+        if event is not None:
+            event.set()
+
+
+async def schedule_persist(background_tasks: BackgroundTasks, form_data: FormData,
+                           analysis: FormAnalysisResponse, key: str, route: Optional[dict] = None) -> str:
+    """
+    Réserve l'identifiant du use case et programme son écriture en tâche de fond.
+    Même clé d'analyse qu'un use case existant (ou en cours d'écriture) : même identifiant, remplacé.
+    Avec un état partagé, la réservation vaut pour tous les workers.
+    """
+    async with _reserve_lock:
+        use_case_id = _pending_keys.get(key) or await run_in_threadpool(use_case_store.find_by_analysis_key, key)
+        use_case_id = use_case_id or uuid.uuid4().hex
+        if shared_state.distributed:
+            use_case_id = await run_in_threadpool(shared_state.setdefault, f"use-case-key:{key}", use_case_id,
+                                                  PENDING_RESERVATION_TTL)
+            await run_in_threadpool(shared_state.set, f"pending-write:{use_case_id}", "1", PENDING_RESERVATION_TTL)
+        _pending_keys[key] = use_case_id
+        _pending_writes.setdefault(use_case_id, threading.Event())
+    background_tasks.add_task(persist_analysis, use_case_id, form_data, analysis, key, route)
+    return use_case_id
+
+
+async def _persist_if_requested(req: AnalyzeRequest, result: FormAnalysisResponse, key: str,
+                                background_tasks: BackgroundTasks, response: Response,
+                                route: Optional[dict] = None) -> FormAnalysisResponse:
+    if req.persist:
+        response.headers["X-Use-Case-Id"] = await schedule_persist(background_tasks, req.form_data, result, key, route)
+    return result
+
+
+def record_route(trace: RouteTrace, headers: Optional[MutableMapping[str, str]] = None) -> dict:
+    """Décision de routage et tentatives : log de la requête, métriques, en-têtes X-LLM-*"""
+    if not trace.attempts and trace.source == "llm":
+        trace.source = "coalesced"
+    route = trace.to_dict()
+    request_log.record_routing(route)
+    if headers is not None:
+        headers["X-LLM-Route"] = trace.tier
+        headers["X-LLM-Model"] = trace.served_by or trace.model
+    return route
+
+
+# ==================== RÉ-ANALYSE INCRÉMENTALE ====================
+
+async def resolve_incremental(req: AnalyzeRequest, trace: RouteTrace) -> Optional[IncrementalUpdate]:
+    """
+    Analyse précédente du use case (store si base_use_case_id, sinon cache ou analyse fournie
+    par le client) et sections à redemander. None : analyse complète.
+    """
+    if not incremental.enabled() or (req.previous is None and not req.base_use_case_id):
+        return None
+    if req.base_use_case_id:
+        payload = await run_in_threadpool(use_case_store.get, req.base_use_case_id)
+        if payload is None:
+            raise HTTPException(status_code=404, detail=f"Use case introuvable: {req.base_use_case_id}")
+        previous_form, previous_analysis, trusted = form_data_from_payload(payload), payload.get("ai_analysis"), True
+    else:
+        previous_form = req.previous.form_data
+        # Même formulaire déjà analysé ici : la version du cache fait foi
+        cached = await run_in_threadpool(analysis_cache.get, analysis_key(previous_form)) if analysis_cache else None
+        previous_analysis, trusted = (cached, True) if cached is not None else (req.previous.analysis, False)
+    update = incremental.plan_update(previous_form, previous_analysis, req.form_data, trusted)
+    if update is not None:
+        trace.sections = update.sections
+        for name in incremental.SECTIONS:
+            metrics.INCREMENTAL_SECTIONS.inc(section=name, outcome="regenerated" if name in update.sections else "reused")
+        if LOG_VERBOSE:
+            logger.info(f"✂️ Ré-analyse incrémentale: {', '.join(update.changed) or 'aucune réponse modifiée'} -> "
+                        f"{', '.join(update.sections) or 'aucune section'} à régénérer")
+    return update
+
+
+async def compute_analysis(req: AnalyzeRequest, idempotency_key: Optional[str] = None,
+                           headers: Optional[MutableMapping[str, str]] = None) -> Tuple[FormAnalysisResponse, str, Optional[dict]]:
+    """
+    Analyse de /analyze (et des jobs en tâche de fond) : cache, ré-analyse incrémentale,
+    use case similaire, puis appel LLM partagé. Retourne (analyse, clé du use case, route) ;
+    les en-têtes X-* sont écrits dans headers. Erreurs LLM levées telles quelles (voir analysis_http_error).
+    """
+    d = req.form_data
+    headers = headers if headers is not None else {}
+    # Cache : même formulaire normalisé + même modèle + même prompt = même réponse IA
+    trace = route_for(d)
+    key = analysis_key(d, trace.model)
+    saved_key = use_case_key(d, idempotency_key, trace.model)
+    cached = await get_cached_analysis(d, key)
+    if cached is not None:
+        return cached, saved_key, None
+    update = await resolve_incremental(req, trace)
+    if update is not None:
+        headers["X-Incremental-Sections"] = ",".join(update.sections) or "none"
+        if not update.sections:
+            # Aucune réponse lue par l'IA n'a changé : analyse précédente, scoring recalculé
+            return finalize_analysis(d, update.merge({})), saved_key, None
+    else:
+        similar = await get_similar_analysis(d, trace)
+        if similar is not None:
+            update, route = similar
+            headers["X-Reused-From"] = route["use_case_id"]
+            if not update.sections:
+                return finalize_analysis(d, update.merge({})), saved_key, route
+            headers["X-Incremental-Sections"] = ",".join(update.sections)
+    
+    require_llm_backend()
+
+    plan = prepare_prompt(d, trace.model, update)
+
+    async def fetch() -> dict:
+        try:
+            async with llm_admission.slot():
+                result_json = await request_llm_analysis(plan, trace=trace)
+        except AdmissionRejected:
+            trace.source = "rejected"
+            raise
+        result_json = check_sources(d, result_json)
+        return update.merge(result_json) if update is not None else result_json
+
+    try:
+        if update is not None and not update.trusted:
+            # Sections reprises fournies par le client : résultat propre à la requête (ni cache ni partage)
+            result_json = await fetch()
+        else:
+            result_json = await shared_analysis(key, fetch, trace)
+    finally:
+        route = record_route(trace, headers)
+    return finalize_analysis(d, result_json), saved_key, route
+
+
+def analysis_http_error(e: Exception) -> HTTPException:
+    """Erreur d'une analyse -> réponse HTTP (journalisée) : 429 budget LLM, 504 délai, 502 JSON ou OpenAI"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AdmissionRejected):
+        logger.warning(f"🚦 {e}")
+        request_log.record_error(str(e), 429)
+        return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, LLMTimeout):
+        logger.error(f"❌ {e}")
+        request_log.record_error(str(e), 504)
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, json.JSONDecodeError):
+        logger.error(f"❌ Erreur parsing JSON: {str(e)}")
+        request_log.record_error(f"Erreur parsing JSON: {str(e)}", 502)
+        return HTTPException(status_code=502, detail=f"Erreur parsing JSON: {str(e)}")
+    # Log détaillé de l'erreur
+    import traceback
+    logger.error("❌ ERREUR OPENAI:")
+    logger.error(traceback.format_exc())
+    error_detail = f"Erreur OpenAI: {str(e)}"
+    request_log.record_error(error_detail, 502)
+    return HTTPException(status_code=502, detail=error_detail)
+
+
+@app.post("/analyze", response_model=FormAnalysisResponse)
+async def analyze_form(
+    req: AnalyzeRequest,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Analyse structurée du formulaire avec Structured Outputs.
+    Garantit une structure JSON fixe et des catégories strictes.
+    Avec "persist": true, le use case est sauvegardé en tâche de fond et son identifiant
+    renvoyé dans l'en-tête X-Use-Case-Id (plus besoin de renvoyer l'analyse à /save).
+    Idempotent : même formulaire normalisé = un seul appel OpenAI, partagé par les requêtes
+    simultanées ; même formulaire (et même Idempotency-Key s'il est fourni) = un seul use case sauvegardé.
+    Modèle routé selon la complexité du formulaire (en-têtes X-LLM-Route, X-LLM-Model).
+    Avec "previous" (formulaire + analyse précédents) ou "base_use_case_id" : seules les sections
+    touchées par les réponses modifiées sont redemandées (en-tête X-Incremental-Sections).
+    Avec "background": true : 202 immédiat avec le job (file à priorités "interactive" / "bulk"),
+    résultat via GET /jobs/{id} ou GET /jobs/{id}/events.
+    """
+    if req.background:
+        return await enqueue_analysis(req, idempotency_key)
+    d = req.form_data
+    if LOG_VERBOSE:
+        logger.info("=" * 80)
+        logger.info("📥 NOUVELLE REQUÊTE D'ANALYSE")
+        logger.info("=" * 80)
+        logger.info(f"📋 Données formulaire reçues:")
+        logger.info(f"   - Persona: {d.q1} {d.q2} ({d.q3} - {d.q4})")
+        logger.info(f"   - Brief: {(d.q5 or '')[:100]}...")
+        logger.info(f"   - Volumétrie: {d.q7} / {d.q8} exec / {d.q9} unitaire")
+    
+    try:
+        validated_result, key, route = await compute_analysis(req, idempotency_key, response.headers)
+    except Exception as e:
+        raise analysis_http_error(e)
+    return await _persist_if_requested(req, validated_result, key, background_tasks, response, route)
+
+
+# ==================== ANALYSE EN STREAMING (SSE) ====================
+
+# Modèle Pydantic de chaque section produite par l'IA, dans l'ordre du schéma
+SECTION_MODELS = {
+    name: field.annotation
+    for name, field in FormAnalysisResponseWithoutScoring.model_fields.items()
+}
+
+
+def _section_events(result: dict):
+    """Événements 'section' d'une analyse complète (scoring juste après elements_sources)"""
+    for name in SECTION_MODELS:
+        yield sse_event("section", {"name": name, "data": result[name]})
+        if name == "elements_sources":
+            yield sse_event("section", {"name": "scoring", "data": result["scoring"]})
+
+
+async def stream_analysis_events(
+    form_data: FormData,
+    persist_to: Optional[BackgroundTasks] = None,
+    idempotency_key: Optional[str] = None,
+    trace: Optional[RouteTrace] = None,
+    update: Optional[IncrementalUpdate] = None,
+):
+    """
+    Générateur SSE : une section dès que son JSON est complet dans le flux OpenAI,
+    le scoring dès que elements_sources est reçu, puis 'route' (modèle, tentatives)
+    et 'done' avec la réponse validée.
+    Si persist_to est fourni : écriture programmée en fin de flux et événement 'saved' {id}.
+    Une analyse identique déjà en cours n'est pas relancée : son résultat est attendu puis rejoué.
+    Couverture et bascule jusqu'au premier fragment du flux ; ensuite le flux est suivi jusqu'au bout
+    (dans le délai LLM_REQUEST_TIMEOUT).
+    Ré-analyse incrémentale (update) : les sections reprises sont envoyées d'abord, seules les autres sont demandées.
+    """
+    trace = trace or route_for(form_data)
+    key = analysis_key(form_data, trace.model)
+    saved_key = use_case_key(form_data, idempotency_key, trace.model)
+    cached = await get_cached_analysis(form_data, key)
+    if cached is None and update is not None and not update.sections:
+        cached = finalize_analysis(form_data, update.merge({}))
+    pending = _inflight.get(key) if cached is None else None
+    route = None
+    if cached is None and pending is None and update is None:
+        similar = await get_similar_analysis(form_data, trace)
+        if similar is not None:
+            similar_update, similar_route = similar
+            if similar_update.sections:
+                # Persona différente : user_story redemandée au LLM, le reste repris (route finale : reused_from)
+                update = similar_update
+            else:
+                cached, route = finalize_analysis(form_data, similar_update.merge({})), similar_route
+                yield sse_event("route", route)
+    if pending is not None:
+        request_log.record_cache("coalesced")
+        try:
+            cached = finalize_analysis(form_data, await asyncio.shield(pending))
+        except HTTPException as e:
+            request_log.record_error(str(e.detail), e.status_code)
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            request_log.record_error(f"Erreur OpenAI: {str(e)}", 502)
+            yield sse_event("error", {"status": 502, "detail": f"Erreur OpenAI: {str(e)}"})
+            return
+    if cached is not None:
+        result = cached.model_dump(mode="json")
+        for event in _section_events(result):
+            yield event
+        yield sse_event("done", result)
+        if persist_to is not None:
+            yield sse_event("saved", {"id": await schedule_persist(persist_to, form_data, cached, saved_key, route)})
+        return
+    
+    # Les requêtes identiques arrivant pendant le flux attendent ce résultat (sauf sections fournies par le client)
+    shareable = update is None or update.trusted
+    loop = asyncio.get_running_loop()
+    shared = loop.create_future()
+    if shareable:
+        _inflight[key] = shared
+    stream = None
+    slot = None
+    try:
+        if update is not None:
+            # Sections reprises de l'analyse précédente : affichées sans attendre le LLM
+            for name, data in update.reused.items():
+                yield sse_event("section", {"name": name, "data": data})
+                if name == "elements_sources":
+                    yield sse_event("section", {"name": "scoring", "data": score_from_elements(form_data, data).model_dump()})
+        # SOURCE_CLASSIFIER=local : sources reconnues localement, section et scoring envoyés sans attendre le LLM
+        local_sources = None
+        if source_classifier.mode() == "local" and (update is None or "elements_sources" in update.sections):
+            classification = source_classifier.classify_sources(form_data.q14)
+            if classification.confident:
+                local_sources = classification.elements_sources()
+                yield sse_event("section", {"name": "elements_sources", "data": local_sources})
+                yield sse_event("section", {"name": "scoring", "data": score_from_elements(form_data, local_sources).model_dump()})
+        client = llm.get_client()
+        slot = await llm_admission.acquire()
+        slot_started = time.monotonic()
+        plan = prepare_prompt(form_data, trace.model, update)
+        if LOG_VERBOSE:
+            logger.info(f"🤖 Appel OpenAI en streaming (modèle {trace.model}, niveau {trace.tier})")
+        start_time = time.time()
+        deadline = loop.time() + ROUTING.timeout
+
+        async def open_stream(model: str):
+            # Flux ouvert et premier fragment reçu = tentative réussie
+            opened = await client.chat.completions.create(
+                **build_llm_request(plan, model),
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            try:
+                iterator = opened.__aiter__()
+                return opened, iterator, await iterator.__anext__()
+            except BaseException:
+                await close_stream(opened)
+                raise
+
+        stream, iterator, first_chunk = await run_routed(
+            trace, open_stream, ROUTING, on_lose=lambda lost: close_stream(lost[0])
+        )
+        model = trace.served_by
+
+        async def chunks():
+            yield first_chunk
+            async for chunk in iterate_until(iterator, deadline):
+                yield chunk
         
-        return validated_result
+        parser = SectionStreamParser()
+        first_section_at = None
+        async for chunk in chunks():
+            if getattr(chunk, 'usage', None):
+                request_log.record_usage(chunk.usage, model)
+                if not plan.sections:
+                    prompts.OUTPUT_BUDGET.observe(chunk.usage.completion_tokens)
+                if LOG_VERBOSE:
+                    logger.info(f"📊 Tokens utilisés: {chunk.usage.prompt_tokens} prompt / {chunk.usage.completion_tokens} completion")
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            for name, data in parser.feed(delta):
+                section_model = SECTION_MODELS.get(name)
+                if section_model is None or (name == "elements_sources" and local_sources is not None):
+                    continue
+                section = section_model.model_validate(data)
+                if first_section_at is None:
+                    first_section_at = time.time() - start_time
+                    request_log.add_stage("llm_first_section", first_section_at * 1000)
+                    if LOG_VERBOSE:
+                        logger.info(f"⚡ Première section ({name}) en {first_section_at:.2f}s")
+                yield sse_event("section", {"name": name, "data": section.model_dump(mode="json")})
+                if name == "elements_sources":
+                    scoring = score_from_elements(form_data, data)
+                    yield sse_event("section", {"name": "scoring", "data": scoring.model_dump()})
         
-    except HTTPException:
-        raise
-    except json.JSONDecodeError as e:
-        logger.error(f"❌ Erreur parsing JSON: {str(e)}")
-        raise HTTPException(status_code=502, detail=f"Erreur parsing JSON: {str(e)}")
+        elapsed = time.time() - start_time
+        request_log.add_stage("llm", elapsed * 1000)
+        trace.total_ms = round(elapsed * 1000, 1)
+        if LOG_VERBOSE:
+            logger.info(f"✅ Flux OpenAI ({model}) terminé en {elapsed:.2f}s")
+        if not parser.text:
+            raise ValueError("Réponse OpenAI vide")
+        with request_log.stage("json_parse"):
+            result_json = json.loads(parser.text)
+        result_json = check_sources(form_data, result_json)
+        if update is not None:
+            result_json = update.merge(result_json)
+        request_log.capture(model, plan.context, parser.text)
+        shared.set_result(result_json)
+        # Réponse du modèle de secours : pas sous la clé du modèle routé (voir shared_analysis)
+        if analysis_cache and shareable and model == trace.model:
+            await run_in_threadpool(analysis_cache.set, key, result_json)
+        validated_result = finalize_analysis(form_data, result_json)
+        route = record_route(trace)
+        yield sse_event("route", route)
+        yield sse_event("done", validated_result.model_dump(mode="json"))
+        if persist_to is not None:
+            yield sse_event("saved", {"id": await schedule_persist(persist_to, form_data, validated_result, saved_key, route)})
+    
+    except HTTPException as e:
+        request_log.record_error(str(e.detail), e.status_code)
+        yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+    except AdmissionRejected as e:
+        # En-têtes déjà envoyés : le délai conseillé est dans l'événement
+        logger.warning(f"🚦 {e}")
+        request_log.record_error(str(e), 429)
+        yield sse_event("error", {"status": 429, "detail": str(e), "retry_after": e.retry_after})
+    except LLMTimeout as e:
+        logger.error(f"❌ {e}")
+        record_route(trace)
+        request_log.record_error(str(e), 504)
+        yield sse_event("error", {"status": 504, "detail": str(e)})
+    except llm.BackendUnavailable as e:
+        # Client OpenAI indisponible (clé ou package manquant)
+        request_log.record_error(str(e), 500)
+        yield sse_event("error", {"status": 500, "detail": str(e)})
     except Exception as e:
-        # Log détaillé de l'erreur
         import traceback
-        logger.error("❌ ERREUR OPENAI:")
+        record_route(trace)
+        logger.error("❌ ERREUR OPENAI (streaming):")
         logger.error(traceback.format_exc())
-        error_detail = f"Erreur OpenAI: {str(e)}"
-        raise HTTPException(status_code=502, detail=error_detail)
+        request_log.record_error(f"Erreur OpenAI: {str(e)}", 502)
+        yield sse_event("error", {"status": 502, "detail": f"Erreur OpenAI: {str(e)}"})
+    finally:
+        if stream is not None:
+            await close_stream(stream)
+        if slot is not None:
+            await llm_admission.release(slot, slot_started)
+        if _inflight.get(key) is shared:
+            del _inflight[key]
+        if not shared.done():
+            shared.set_exception(RuntimeError("Analyse en streaming interrompue"))
+            shared.exception()  # erreur transmise aux requêtes en attente, pas d'avertissement asyncio
+
+
+@app.post("/analyze/stream")
+async def analyze_form_stream(req: AnalyzeRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Variante streaming de /analyze (Server-Sent Events).
+    Événements : 'section' {name, data} pour user_story, execution_schema, elements_sources,
+    scoring, analysis, pro_con, delivery ; puis 'done' (FormAnalysisResponse) ou 'error' {status, detail}
+    (429 : budget LLM épuisé, avec retry_after en s).
+    Avec "persist": true, un événement 'saved' {id} suit 'done' ; l'écriture a lieu après le flux.
+    Avec "previous" ou "base_use_case_id" : ré-analyse incrémentale, comme /analyze.
+    """
+    background = BackgroundTasks() if req.persist else None
+    trace = route_for(req.form_data)
+    # Sections reprises / redemandées : champ "sections" de l'événement 'route'
+    update = await resolve_incremental(req, trace)
+    return StreamingResponse(
+        stream_analysis_events(req.form_data, background, idempotency_key, trace, update),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background
+    )
 
 
 class SaveRequest(BaseModel):
-    """Requête de sauvegarde"""
-    form_data: FormData
-    ai_analysis: FormAnalysisResponse
+    """Requête de sauvegarde : identifiant d'un use case déjà persisté par /analyze, ou analyse complète"""
+    use_case_id: Optional[str] = None
+    form_data: Optional[FormData] = None
+    ai_analysis: Optional[FormAnalysisResponse] = None
+
+
+# Attente max (s) d'une écriture /analyze encore en cours lors d'un /save par identifiant
+PENDING_WRITE_TIMEOUT = 10
+
+
+async def confirm_persisted(use_case_id: str) -> dict:
+    """/save par identifiant : attend l'écriture de fond si besoin et vérifie qu'elle a abouti"""
+    event = _pending_writes.get(use_case_id)
+    if event is not None:
+        await run_in_threadpool(event.wait, PENDING_WRITE_TIMEOUT)
+    elif shared_state.distributed:
+        # Écriture programmée par un autre worker : attendre qu'elle apparaisse dans le store
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PENDING_WRITE_TIMEOUT
+        while (loop.time() < deadline
+               and await run_in_threadpool(shared_state.get, f"pending-write:{use_case_id}")
+               and not await run_in_threadpool(use_case_store.get, use_case_id)):
+            await asyncio.sleep(PEER_POLL_INTERVAL)
+    exists = await run_in_threadpool(use_case_store.get, use_case_id)
+    if exists is None:
+        raise HTTPException(status_code=404, detail=f"Use case {use_case_id} introuvable")
+    return {"success": True, "id": use_case_id}
 
 
 @app.post("/save")
-async def save_use_case(req: SaveRequest):
+async def save_use_case(req: SaveRequest, idempotency_key: Optional[str] = Header(None)):
     """
-    Sauvegarde le use case complet (formulaire + résultats IA) dans un fichier JSON.
-    Format: YYYYMMDD_HHMMSS_[persona].json
+    Sauvegarde le use case complet (formulaire + résultats IA) dans le store SQLite.
+    Avec seulement use_case_id (analyse lancée avec "persist": true) : rien n'est renvoyé
+    ni revalidé, le backend confirme l'écriture faite à l'analyse.
+    Une sauvegarde répétée (même formulaire, et même Idempotency-Key s'il est fourni) met à jour le use case existant.
+    Retourne l'identifiant unique du use case.
     """
+    if req.ai_analysis is None or req.form_data is None:
+        if not req.use_case_id:
+            raise HTTPException(status_code=400, detail="use_case_id ou form_data + ai_analysis requis")
+        return await confirm_persisted(req.use_case_id)
     try:
-        # Créer le dossier use_cases
-        use_cases_dir = Path(__file__).parent / "use_cases"
-        use_cases_dir.mkdir(exist_ok=True)
-        
-        # Générer nom de fichier avec datetime
-        now = datetime.now()
-        timestamp = now.strftime("%Y%m%d_%H%M%S")
-        
-        # Nom basé sur persona
-        persona = f"{req.form_data.q1 or 'user'}_{req.form_data.q2 or 'unknown'}"
-        clean_name = "".join(c if c.isalnum() or c in ('_',) else '_' for c in persona)[:30]
-        
-        filename = f"{timestamp}_{clean_name}.json"
-        filepath = use_cases_dir / filename
-        
-        # Transformer les clés du formulaire en noms parlants
-        d = req.form_data
-        form_data_readable = {
-            "persona": {
-                "nom": d.q1,
-                "prenom": d.q2,
-                "role": d.q3,
-                "departement": d.q4
-            },
-            "contexte_besoin": {
-                "brief_utilisateur": d.q5,
-                "execution_actuelle": d.q6
-            },
-            "volumetrie": {
-                "frequence_besoin": d.q7,
-                "nb_executions_par_occurrence": d.q8,
-                "temps_execution_unitaire": d.q9,
-                "nb_personnes_executantes": d.q10,
-                "niveau_irritant": d.q11,
-                "pourquoi_irritant": d.q12,
-                "pourquoi_urgent": d.q13
-            },
-            "nature_tache": {
-                "elements_sources": d.q14,
-                "action_manuelle": d.q15,
-                "exemple_action_manuelle": d.q16,
-                "regles_simples_stables": d.q17,
-                "points_complexes_detailles": d.q18,
-                "complexite_organisationnelle": d.q19,
-                "outils_necessaires": d.q20
-            }
-        }
-        
-        # Construire JSON complet
-        etp_value = round(req.ai_analysis.scoring.gain_temps_mensuel_heures / 140, 1)
-        complete_data = {
-            "metadata": {
-                "saved_at": now.isoformat(),
-                "project_name": req.ai_analysis.user_story.project_name,
-                "persona": f"{d.q1} {d.q2}",
-                "role": d.q3,
-                "department": d.q4,
-                "etp": etp_value,
-                "faisabilite": req.ai_analysis.scoring.faisabilite_technique_score,
-                "urgence": req.ai_analysis.scoring.urgence_score,
-                "priority": req.ai_analysis.analysis.priority
-            },
-            "form_data": form_data_readable,
-            "ai_analysis": req.ai_analysis.model_dump()
-        }
+        payload = build_payload(req.form_data, req.ai_analysis)
+        key = use_case_key(req.form_data, idempotency_key)
+        with request_log.stage("save_write"):
+            use_case_id = await run_in_threadpool(use_case_store.insert, payload, None, None, key)
+        if similarity_index:
+            similarity_index.notify_saved(use_case_id)
         
-        # Sauvegarder
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(complete_data, f, indent=2, ensure_ascii=False)
-        
-        logger.info(f"💾 Use case sauvegardé: {filename}")
-        logger.info(f"   Persona: {req.form_data.q1} {req.form_data.q2}")
-        logger.info(f"   Faisabilité: {req.ai_analysis.scoring.faisabilite_technique_score}, Urgence: {req.ai_analysis.scoring.urgence_score}")
-        logger.info(f"   Fichier: {filepath}")
+        if LOG_VERBOSE:
+            logger.info(f"💾 Use case sauvegardé: {use_case_id}")
+            logger.info(f"   Persona: {req.form_data.q1} {req.form_data.q2}")
+            logger.info(f"   Faisabilité: {req.ai_analysis.scoring.faisabilite_technique_score}, Urgence: {req.ai_analysis.scoring.urgence_score}")
         
         return {
             "success": True,
-            "filename": filename,
-            "path": str(filepath)
+            "id": use_case_id
         }
         
     except Exception as e:
@@ -560,3 +1194,459 @@ async def save_use_case(req: SaveRequest):
         raise HTTPException(status_code=500, detail=f"Erreur sauvegarde: {str(e)}")
 
 
+# ==================== ANALYSE EN LOT ====================
+
+async def analyze_batch_item(form_data: FormData, limiter=None, max_retries: int = BATCH_MAX_RETRIES) -> FormAnalysisResponse:
+    """
+    Analyse d'un formulaire dans un lot : cache, puis appel OpenAI soumis au limiteur
+    RPM/TPM et relancé avec backoff sur 429/5xx. Formulaires identiques : un seul appel.
+    """
+    trace = route_for(form_data)
+    key = analysis_key(form_data, model=trace.model)
+    cached = await get_cached_analysis(form_data, key)
+    if cached is not None:
+        return cached
+    
+    plan = prepare_prompt(form_data, trace.model)
+    limiter = limiter or batch_limiter
+    
+    async def call():
+        # Retries gérés ici, pas par le SDK ; pas de couverture (appels doublés) ;
+        # chaque appel, bascule comprise, passe par le limiteur
+        return await request_llm_analysis(plan, max_retries=0, trace=trace, hedge=False, limiter=limiter)
+    
+    try:
+        result_json = await shared_analysis(key, lambda: call_with_retries(call, max_retries=max_retries), trace)
+    except Exception as e:
+        request_log.record_error(f"{type(e).__name__}: {e}", error_status(e) or 502)
+        raise
+    finally:
+        record_route(trace)
+    return finalize_analysis(form_data, result_json)
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(reqs: List[AnalyzeRequest], concurrency: Optional[int] = None):
+    """
+    Analyse un lot de formulaires en parallèle (concurrence bornée, limiteur RPM/TPM).
+    Réponse NDJSON en streaming : une ligne par formulaire dès qu'il est terminé,
+    {"ref": index, "ok": true, "analysis": {...}} ou {"ref": index, "ok": false, "status": ..., "error": ...}
+    """
+    require_llm_backend()
+    if len(reqs) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Lot trop volumineux ({len(reqs)} > {BATCH_MAX_ITEMS} formulaires)")
+    
+    concurrency = min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    logger.info(f"📦 Lot de {len(reqs)} formulaires (concurrence {concurrency})")
+    items = [(i, r.form_data) for i, r in enumerate(reqs)]
+    return StreamingResponse(
+        ndjson_lines(run_batch(items, analyze_batch_item, concurrency=concurrency)),
+        media_type="application/x-ndjson"
+    )
+
+
+# ==================== ANALYSES EN TÂCHE DE FOND ====================
+
+async def run_analysis_job(req: AnalyzeRequest, idempotency_key: Optional[str]) -> dict:
+    """
+    Exécution d'un job par un worker du pool : même analyse que /analyze, use case écrit avant
+    la fin du job si persist. Budget LLM épuisé : le job attend Retry-After puis réessaie.
+    """
+    headers: Dict[str, str] = {}
+    while True:
+        try:
+            result, key, route = await compute_analysis(req, idempotency_key, headers)
+            break
+        except AdmissionRejected as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            error = analysis_http_error(e)
+            raise JobFailed(error.status_code, str(error.detail))
+    use_case_id = None
+    if req.persist:
+        background = BackgroundTasks()
+        use_case_id = await schedule_persist(background, req.form_data, result, key, route)
+        await background()
+    if headers:
+        route = {**(route or {}), "headers": headers}
+    return {"result": result, "use_case_id": use_case_id, "route": route}
+
+
+# File à priorités et workers locaux (ANALYSIS_JOBS_WORKERS), résultats dans le store
+analysis_job_queue = queue_from_env(use_case_store, run_analysis_job)
+
+# Intervalle (s) des commentaires SSE de maintien de connexion sur /jobs/{id}/events
+JOB_EVENTS_KEEPALIVE = 15
+
+
+async def enqueue_analysis(req: AnalyzeRequest, idempotency_key: Optional[str]) -> JSONResponse:
+    """/analyze avec "background": true : job créé et mis en file, 202 + Location"""
+    if not analysis_job_queue.enabled:
+        raise HTTPException(status_code=400, detail="Analyses en tâche de fond désactivées (ANALYSIS_JOBS_WORKERS=0)")
+    require_llm_backend()
+    try:
+        job = await analysis_job_queue.submit(req, idempotency_key)
+    except QueueFull as e:
+        logger.warning(f"🚦 {e}")
+        request_log.record_error(str(e), 429)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except IdempotencyConflict as e:
+        request_log.record_error(str(e), 422)
+        raise HTTPException(status_code=422, detail=str(e))
+    return JSONResponse(status_code=202, content=job, headers={"Location": f"/jobs/{job['id']}"})
+
+
+@app.get("/jobs")
+async def list_analysis_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Jobs récents (sans résultat) et état de la file du worker qui répond"""
+    statuses = [value for value in status.split(",") if value] if status else None
+    items = await run_in_threadpool(use_case_store.list_analysis_jobs, statuses, limit)
+    return {"items": items, "queue": analysis_job_queue.stats()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """Statut du job ; "result" (FormAnalysisResponse) une fois terminé, "error" / "error_status" en cas d'échec"""
+    job = await analysis_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return job
+
+
+async def job_events(job: dict):
+    """Générateur SSE : 'status' à chaque changement, puis 'done' (job complet) ou 'error' {status, detail}"""
+    last_status = None
+    loop = asyncio.get_running_loop()
+    last_sent = loop.time()
+    while True:
+        if job["status"] != last_status:
+            last_status = job["status"]
+            last_sent = loop.time()
+            if job["status"] == "succeeded":
+                yield sse_event("done", job)
+                return
+            if job["status"] in ("failed", "cancelled"):
+                yield sse_event("error", {"status": job.get("error_status") or 409,
+                                          "detail": job.get("error") or "Job annulé", "job_id": job["id"]})
+                return
+            yield sse_event("status", {"id": job["id"], "status": job["status"]})
+        elif loop.time() - last_sent >= JOB_EVENTS_KEEPALIVE:
+            # Commentaire SSE : garde la connexion active derrière un proxy (timeout d'inactivité)
+            last_sent = loop.time()
+            yield ": keepalive\n\n"
+        job = await analysis_job_queue.wait(job["id"], JOB_EVENTS_KEEPALIVE) or job
+
+
+@app.get("/jobs/{job_id}/events")
+async def analysis_job_events(job_id: str):
+    """Suivi d'un job en Server-Sent Events (alternative au polling de GET /jobs/{id})"""
+    job = await analysis_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return StreamingResponse(
+        job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_analysis_job(job_id: str):
+    """Annule un job encore en attente (un job en cours va jusqu'au bout)"""
+    job = await analysis_job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return job
+
+
+# ==================== LECTURE DU PORTEFEUILLE ====================
+
+@app.get("/use-cases")
+async def list_use_cases(
+    department: Optional[str] = None,
+    priority: Optional[str] = None,
+    role: Optional[str] = None,
+    rules_version: Optional[str] = None,
+    faisabilite_min: Optional[int] = None,
+    faisabilite_max: Optional[int] = None,
+    urgence_min: Optional[int] = None,
+    urgence_max: Optional[int] = None,
+    etp_min: Optional[float] = None,
+    etp_max: Optional[float] = None,
+    saved_from: Optional[str] = None,
+    saved_to: Optional[str] = None,
+    sort: str = "saved_at",
+    order: str = "desc",
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    """
+    Liste paginée des use cases sauvegardés (résumé issu de metadata, sans le payload).
+    Tri : saved_at, etp, urgence ou faisabilite ; pagination par curseur (next_cursor).
+    """
+    filters = {
+        "department": department, "priority": priority, "role": role, "rules_version": rules_version,
+        "faisabilite_min": faisabilite_min, "faisabilite_max": faisabilite_max,
+        "urgence_min": urgence_min, "urgence_max": urgence_max,
+        "etp_min": etp_min, "etp_max": etp_max,
+        "saved_from": saved_from, "saved_to": saved_to,
+    }
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order doit valoir 'asc' ou 'desc'")
+    try:
+        items, next_cursor = await run_in_threadpool(
+            use_case_store.list, filters, sort, order == "desc", limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.get("/use-cases/stats")
+async def use_cases_stats():
+    """Agrégats du portefeuille (par département, par priorité, croisés), maintenus à chaque /save"""
+    return await run_in_threadpool(use_case_store.stats)
+
+
+@app.get("/use-cases/{use_case_id}")
+async def get_use_case(use_case_id: str):
+    """Payload complet d'un use case sauvegardé"""
+    payload = await run_in_threadpool(use_case_store.get, use_case_id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"Use case {use_case_id} introuvable")
+    return payload
+
+
+class SimilarRequest(BaseModel):
+    """Formulaire en cours de saisie (q5, q6, q14 suffisent) et nombre de résultats"""
+    form_data: FormData
+    limit: int = Field(5, ge=1, le=50)
+    min_score: Optional[float] = Field(None, ge=0, le=1)
+
+
+@app.post("/use-cases/similar")
+async def similar_use_cases(req: SimilarRequest):
+    """
+    Use cases déjà sauvegardés proches du formulaire (brief, exécution actuelle, sources),
+    à afficher avant de lancer l'analyse : résumé + similarité cosinus (0 à 1).
+    """
+    if not similarity_index:
+        raise HTTPException(status_code=503, detail="Index de similarité désactivé (SIMILARITY_ENABLED=0) ou en cours de chargement")
+    with request_log.stage("similarity_lookup"):
+        matches = await similarity_index.similar(req.form_data, req.limit, req.min_score)
+    return {"matches": matches, "index": similarity_index.stats()}
+
+
+# ==================== SCORING INSTANTANÉ ====================
+
+class ScoreRequest(BaseModel):
+    """Formulaire en cours de saisie (q7-q11, q14, q15, q17, q19 suffisent ; les autres champs sont ignorés)"""
+    form_data: FormData
+    hourly_cost: Optional[float] = Field(None, ge=0)  # Coût horaire du persona (€/h) : économie annuelle
+    detail: bool = False  # Ajoute le Scoring complet (formule, justification) et le détail des sources
+
+
+def score_preview(form_data: FormData, hourly_cost: Optional[float] = None, detail: bool = False) -> dict:
+    """Scores, ETP et coût annuel d'un formulaire partiel : sources de q14 pré-classées localement, sans LLM"""
+    rules = get_rules()
+    classification = source_classifier.classify_sources(form_data.q14)
+    complexity = classification.complexity_level.value
+    c = score_components(form_data, classification.total_sources, complexity, rules)
+    annual_hours = c.monthly_hours * 12
+    preview = {
+        "faisabilite": c.faisabilite_normalized,
+        "urgence": c.urgence_normalized,
+        "gain_temps_mensuel_heures": round(c.monthly_hours, 2),
+        "etp": round(c.monthly_hours / rules.weights.etp_hours, 2),
+        "annual_hours": round(annual_hours, 1),
+        "annual_cost": round(annual_hours * hourly_cost, 2) if hourly_cost else None,
+        "points": {
+            "rules": c.rules_points, "sources": c.sources_points, "complexity": c.complexity_points,
+            "orga": c.orga_points, "manual": c.manual_points, "urgence": c.urgence,
+        },
+        "sources": {
+            "count": classification.count, "total_sources": classification.total_sources,
+            "complexity_level": complexity, "confident": classification.confident,
+        },
+        "rules_version": rules.version,
+    }
+    if detail:
+        preview["scoring"] = calculate_scoring(form_data, classification.count, classification.total_sources,
+                                               complexity, rules).model_dump()
+        preview["sources"]["items"] = classification.describe()["sources"]
+    return preview
+
+
+@app.post("/score")
+async def score_form(req: ScoreRequest):
+    """
+    Scoring pendant la saisie (récapitulatif de la page 5, à chaque frappe), sans LLM ni état par requête :
+    faisabilité, urgence, ETP et coût annuel. /analyze reste la référence (sources classées par l'IA).
+    JSON sérialisé directement (pas de jsonable_encoder) : quelques dizaines de microsecondes par appel.
+    """
+    preview = score_preview(req.form_data, req.hourly_cost, req.detail)
+    return Response(content=json.dumps(preview, ensure_ascii=False, separators=(",", ":")),
+                    media_type="application/json")
+
+
+# ==================== RE-SCORING DU PORTEFEUILLE ====================
+
+class RescoreRequest(BaseModel):
+    """Jeux de pondérations "what-if" à comparer à la pondération actuelle"""
+    weight_sets: Dict[str, ScoringWeights] = {}
+    rank_by: str = "faisabilite"
+    top: int = Field(20, ge=1, le=500)
+
+
+# Archive chargée en colonnes, rechargée seulement quand le store change
+_scoring_frame = None
+_scoring_frame_fingerprint = None
+
+
+def get_scoring_frame():
+    """ScoringFrame de l'archive (rescoring et NumPy importés au premier appel)"""
+    global _scoring_frame, _scoring_frame_fingerprint
+    from rescoring import ScoringFrame
+
+    fingerprint = use_case_store.fingerprint()
+    if _scoring_frame is None or fingerprint != _scoring_frame_fingerprint:
+        start = time.time()
+        _scoring_frame = ScoringFrame.from_store(use_case_store)
+        _scoring_frame_fingerprint = fingerprint
+        logger.info(f"📊 Archive chargée pour re-scoring: {len(_scoring_frame)} use cases en {time.time() - start:.2f}s")
+    return _scoring_frame
+
+
+@app.post("/use-cases/rescore")
+async def rescore_use_cases(req: RescoreRequest):
+    """
+    Re-score vectorisé de toute l'archive avec la pondération actuelle et chaque jeu "what-if",
+    et compare les classements (top N, zones Faisabilité × ETP, déplacement moyen de rang).
+    """
+    from rescoring import compare_weight_sets
+
+    frame = await run_in_threadpool(get_scoring_frame)
+    try:
+        return compare_weight_sets(frame, req.weight_sets, req.rank_by, req.top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ==================== RÈGLES DE SCORING ====================
+
+def scoring_rules_status() -> dict:
+    rules = get_rules()
+    return {
+        "version": rules.version,
+        "weights": rules.weights.model_dump(),
+        "use_cases_by_version": use_case_store.count_by_rules_version(),
+        "use_cases_stale": use_case_store.count_stale(rules.version),
+    }
+
+
+@app.get("/scoring/rules")
+async def scoring_rules():
+    """
+    Barème de scoring actif (version + pondérations) et nombre de use cases
+    scorés avec une autre version (à re-scorer).
+    """
+    return await run_in_threadpool(scoring_rules_status)
+
+
+@app.post("/scoring/reload")
+async def scoring_reload():
+    """Relit scoring_rules.json immédiatement (sinon rechargé automatiquement quand il change)"""
+    previous = get_rules().version
+    try:
+        rules = reload_rules(strict=True)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Règles de scoring invalides ({previous} conservée): {e}")
+    if rules.version == previous:
+        logger.info(f"🧮 Règles de scoring relues: version {rules.version} inchangée")
+    status = await run_in_threadpool(scoring_rules_status)
+    status["previous_version"] = previous
+    return status
+
+
+# ==================== JOBS BATCH FOURNISSEUR ====================
+
+def notify_similarity(use_case_id: str):
+    """Use case écrit : à (ré)indexer (sans effet tant que l'index n'est pas chargé)"""
+    if similarity_index:
+        similarity_index.notify_saved(use_case_id)
+
+
+# Même requête Structured Outputs et même finalisation (calculate_scoring) que /analyze
+batch_job_manager = BatchJobManager(
+    use_case_store,
+    provider_from_env(),
+    build_request=build_llm_request,
+    finalize=finalize_analysis,
+    # Jobs batch : toujours le modèle principal (pas de routage), clé d'analyse alignée
+    key_for=lambda form_data: analysis_key(form_data, model=MODEL),
+    model=MODEL,
+    on_saved=notify_similarity,
+)
+
+
+class BatchJobRequest(BaseModel):
+    """Formulaires à analyser et/ou use cases archivés à ré-analyser (tous avec all_use_cases)"""
+    form_data: List[FormData] = Field(default_factory=list)
+    use_case_ids: List[str] = Field(default_factory=list)
+    all_use_cases: bool = False
+
+
+@app.post("/batch-jobs")
+async def create_batch_job(req: BatchJobRequest):
+    """
+    Soumet un job à l'API Batch du fournisseur (asynchrone, jusqu'à 24 h, coût réduit).
+    Les résultats sont scorés et écrits dans le store à la fin du job (suivi automatique,
+    ou GET /batch-jobs/{id}) ; un use case ré-analysé garde son identifiant.
+    """
+    require_llm_backend()
+    items = [(None, form_data) for form_data in req.form_data]
+    try:
+        ids = None if req.all_use_cases else req.use_case_ids
+        if ids is None or ids:
+            items += await run_in_threadpool(archived_items, use_case_store, ids)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Use case {e.args[0]} introuvable")
+    if not items:
+        raise HTTPException(status_code=400, detail="Aucun formulaire à analyser")
+    if len(items) > BATCH_JOB_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Job trop volumineux ({len(items)} > {BATCH_JOB_MAX_ITEMS} formulaires)")
+    try:
+        job = await batch_job_manager.submit(items)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Soumission du job batch impossible: {e}")
+    return await run_in_threadpool(batch_job_manager.job_summary, job)
+
+
+@app.get("/batch-jobs")
+async def list_batch_jobs(limit: int = Query(50, ge=1, le=500)):
+    return {"items": await run_in_threadpool(use_case_store.list_batch_jobs, None, limit)}
+
+
+@app.get("/batch-jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """Statut du job (rafraîchi auprès du fournisseur) ; résultats ingérés dès qu'il est terminé"""
+    try:
+        job = await batch_job_manager.refresh(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Suivi du job batch impossible: {e}")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return await run_in_threadpool(batch_job_manager.job_summary, job)
+
+
+@app.post("/batch-jobs/{job_id}/cancel")
+async def cancel_batch_job(job_id: str):
+    try:
+        job = await batch_job_manager.cancel(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Annulation du job batch impossible: {e}")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return await run_in_threadpool(batch_job_manager.job_summary, job)
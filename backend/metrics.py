@@ -0,0 +1,177 @@
+"""
+Métriques Prometheus (format texte 0.0.4) exposées par GET /metrics
+Compteurs, jauges et histogrammes minimalistes, sans dépendance : une addition sous verrou
+par mesure, assez léger pour rester actif en production (METRICS_ENABLED=0 pour couper).
+Valeurs par process : avec plusieurs workers, chaque worker a les siennes (cmform_worker_info donne le pid).
+"""
+import os
+import math
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bornes (s) des histogrammes de latence : de la milliseconde (scoring) à la minute (OpenAI)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# Bornes des histogrammes de tokens
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 2500, 3000, 4000, 6000, 8000, 12000, 16000)
+
+_enabled = os.environ.get("METRICS_ENABLED", "1") not in ("0", "false", "False")
+_lock = threading.Lock()
+_registry: List["_Metric"] = []
+
+
+def configure():
+    """Relit METRICS_ENABLED (appelé par main après load_dotenv)"""
+    global _enabled
+    _enabled = os.environ.get("METRICS_ENABLED", "1") not in ("0", "false", "False")
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# ==================== TYPES DE MÉTRIQUES ====================
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+                for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        # Recherche du seuil hors verrou (dichotomie) : seule l'incrémentation est protégée
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# ==================== MÉTRIQUES DU BACKEND ====================
+
+STAGE_SECONDS = Histogram(
+    "cmform_stage_duration_seconds",
+    "Durée des étapes d'une analyse (prompt_build, llm, llm_first_section, json_parse, scoring, validation, save_write...)",
+    ["stage"],
+)
+HTTP_REQUESTS = Counter("cmform_http_requests_total", "Requêtes HTTP par route et code de réponse", ["method", "route", "status"])
+HTTP_SECONDS = Histogram("cmform_http_request_duration_seconds", "Durée des requêtes HTTP (jusqu'à la fin du corps)", ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("cmform_http_requests_in_flight", "Requêtes HTTP en cours", ["route"])
+LLM_CALLS = Counter("cmform_llm_calls_total", "Appels LLM par modèle", ["model"])
+LLM_TOKENS = Counter("cmform_llm_tokens_total", "Tokens LLM par modèle et type (prompt, completion, cached)", ["model", "type"])
+CACHE_LOOKUPS = Counter("cmform_analysis_cache_total", "Recherches dans le cache d'analyses (hit, miss, disabled, coalesced, similar)", ["result"])
+PROMPT_INPUT_TOKENS = Histogram("cmform_prompt_input_tokens", "Tokens du prompt mesurés localement (après compaction)", buckets=TOKEN_BUCKETS)
+PROMPT_MAX_TOKENS = Histogram("cmform_prompt_max_tokens", "max_tokens demandé par requête", buckets=TOKEN_BUCKETS)
+PROMPT_COMPACTIONS = Counter("cmform_prompt_compactions_total", "Réponses libres compactées pour tenir dans le budget", ["field"])
+LLM_CALL_SECONDS = Histogram("cmform_llm_call_duration_seconds", "Durée des tentatives LLM par modèle et issue (ok, error, timeout, cancelled)", ["model", "outcome"])
+ROUTING_DECISIONS = Counter("cmform_routing_decisions_total", "Analyses par niveau routé (fast, strong) et modèle ayant répondu", ["tier", "model"])
+LLM_FAILOVERS = Counter("cmform_llm_failovers_total", "Appels de secours lancés (hedge : délai dépassé, fallback : erreur)", ["role"])
+ADMISSION_REJECTIONS = Counter("cmform_admission_rejections_total", "Analyses refusées (429) : budget de concurrence LLM épuisé")
+INCREMENTAL_SECTIONS = Counter("cmform_incremental_sections_total", "Ré-analyses incrémentales : sections redemandées au LLM ou reprises", ["section", "outcome"])
+SOURCE_AGREEMENT = Counter("cmform_source_classifier_agreement_total", "Pré-classification locale de q14 comparée à elements_sources de l'IA (agree, disagree)", ["field", "outcome"])
+ANALYSIS_JOBS = Counter("cmform_analysis_jobs_total", "Analyses en tâche de fond par priorité et issue (queued, rejected, succeeded, failed, cancelled)", ["priority", "outcome"])
+ANALYSIS_JOBS_QUEUED = Gauge("cmform_analysis_jobs_queued", "Analyses en tâche de fond en attente dans la file du process", ["priority"])
+ANALYSIS_JOB_WAIT = Histogram("cmform_analysis_job_wait_seconds", "Attente dans la file avant exécution d'une analyse en tâche de fond", ["priority"])
+ANALYSIS_ERRORS = Counter("cmform_analysis_errors_total", "Erreurs d'analyse par code HTTP renvoyé (y compris en SSE)", ["status"])
+
+
+def gauge_lines(name: str, documentation: str, value: Optional[float]) -> List[str]:
+    """Jauge calculée au moment de l'exposition (mémoire, retard de boucle...)"""
+    if value is None:
+        return []
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+
+
+def render(extra: Optional[List[str]] = None) -> str:
+    """Exposition texte de toutes les métriques (+ lignes déjà formatées fournies par l'appelant)"""
+    lines = [
+        "# HELP cmform_worker_info Process ayant servi cette exposition",
+        "# TYPE cmform_worker_info gauge",
+        f'cmform_worker_info{{worker="{os.getpid()}"}} 1',
+    ]
+    with _lock:
+        for metric in _registry:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+    if extra:
+        lines.extend(extra)
+    return "\n".join(lines) + "\n"
@@ -4,7 +4,7 @@ Garantit une structure JSON stricte et des catégories prédéfinies
 """
 from pydantic import BaseModel, Field
 from enum import Enum
-from typing import List, Optional, Any
+from typing import Dict, List, Literal, Optional, Any
 
 
 # ==================== ENUMS STRICTS ====================
@@ -168,6 +168,7 @@ class Scoring(BaseModel):
     formula: str
     justification: str
     gain_temps_mensuel_heures: int = Field(ge=0)
+    rules_version: Optional[str] = None  # Version du barème (scoring_rules.json) utilisée
 
 
 class Analysis(BaseModel):
@@ -237,9 +238,23 @@ class FormData(BaseModel):
     q18: Optional[str] = None  # Points complexes
     q19: Optional[str] = None  # Complexité orga
     q20: Optional[str] = None  # Outils
+    q9_total_hours: Optional[float] = Field(None, ge=0, allow_inf_nan=False)  # Q9 en heures (calculé par le frontend) ; q9 prime s'il est renseigné
+
+
+class PreviousAnalysis(BaseModel):
+    """Analyse précédente du même use case : formulaire analysé et réponse obtenue (scoring ignoré)"""
+    form_data: FormData
+    analysis: Dict[str, Any]
 
 
 class AnalyzeRequest(BaseModel):
     """Requête d'analyse"""
     form_data: FormData
+    persist: bool = False  # Sauvegarder le use case côté serveur (identifiant renvoyé)
+    # Ré-analyse incrémentale : seules les sections touchées par les réponses modifiées sont redemandées
+    previous: Optional[PreviousAnalysis] = None
+    base_use_case_id: Optional[str] = None  # ou analyse précédente lue dans le store
+    # Tâche de fond : réponse 202 immédiate avec l'identifiant du job, résultat via GET /jobs/{id}
+    background: bool = False
+    priority: Literal["interactive", "bulk"] = "interactive"  # bulk : passe après les analyses interactives
 
@@ -0,0 +1,264 @@
+"""
+Prompt et schéma de l'analyse IA, construits une seule fois à l'import
+Le message système (rôle + instructions statiques) est identique pour toutes les requêtes
+et placé en premier : le cache de préfixe du fournisseur le réutilise d'un appel à l'autre.
+Par requête, il ne reste qu'à remplir le modèle de contexte avec les réponses du formulaire,
+compactées si besoin pour tenir dans le budget de tokens (token_budget.py).
+"""
+import json
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models import FormAnalysisResponseWithoutScoring, FormData
+from token_budget import FREE_TEXT_FIELDS, InputBudget, OutputBudget, count_tokens, fit_fields
+
+# Version du prompt d'analyse : à incrémenter à chaque modification du contexte/instructions (invalide le cache)
+PROMPT_VERSION = "3"
+
+# Modèles compatibles Structured Outputs
+STRUCTURED_OUTPUT_MODELS = ("gpt-4o", "gpt-4o-mini", "gpt-4o-2024-08-06")
+
+TEMPERATURE = 0.3
+# Plafond de max_tokens (la valeur envoyée est ajustée aux réponses observées, voir OUTPUT_BUDGET)
+MAX_TOKENS = 2000
+
+SYSTEM_PROMPT = "Tu es un expert en analyse de processus métier et automatisation. Tu dois analyser un formulaire et produire une réponse JSON STRICTEMENT conforme au schéma fourni. Utilise UNIQUEMENT les catégories prédéfinies dans les enums."
+
+INSTRUCTIONS = """=== INSTRUCTIONS ===
+1. USER STORY:
+   - project_name: Génère un NOM DE PROJET court et impactant (3-6 mots max)
+     Exemple: "Automatisation Saisie Factures SAP" ou "Robot Rapprochement Comptable"
+   - html: User story HTML (max 100 mots) AVEC CONTEXTE
+     Format: <p><strong>En tant que</strong> [Prénom Nom], [Fonction/Rôle] au sein du [Département],</p>
+             <p><strong>j'ai besoin de</strong> [besoin détaillé]</p>
+             <p><strong>afin de</strong> [bénéfice concret et mesurable].</p>
+     IMPORTANT: Ne PAS mentionner la volumétrie dans le "En tant que", seulement le persona
+
+2. EXECUTION SCHEMA: Diagramme ASCII vertical UNIQUEMENT (pas de liste étapes)
+
+3. ELEMENTS SOURCES (Q14):
+   - types: Catégorise STRICTEMENT chaque source
+   - count: Nombre de TYPES UNIQUES (Excel GL + Excel OSB + SAP = 2 types: Excel, ERP_CRM)
+   - total_sources: Nombre TOTAL de sources (Excel GL + Excel OSB + SAP = 3 sources)
+   - complexity_level: Catégorise la complexité globale selon :
+     * Standard: Sources structurées et faciles (BD, CSV, XLSX, JSON)
+     * Intermédiaire: Semi-structurées, traitement modéré (APIs, XML, logs)
+     * Complexe: Non structurées, extraction avancée (PDF, texte libre, images OCR, audio)
+     * Non standardisée: Humaines/imprévisibles (emails libres, conversations orales)
+
+4. ANALYSIS: Pain points, bénéfices, score faisabilité, priorité
+
+5. PRO/CON:
+   - pros: 3-5 arguments POUR. Chaque: argument + weight (Faible/Moyen/Fort)
+   - cons: 2-4 arguments CONTRE. Chaque: argument + weight (Faible/Moyen/Fort)
+
+6. DELIVERY:
+   - dev_time: Temps total
+   - phases (2-3): Phases simples
+     * name: POC / MVP / Production
+     * feature_principale: LA feature principale exploitable
+     * risque_principal: LE risque principal
+     * duration: Durée
+   - quick_wins (3-5): "En attendant, essaye de..."
+"""
+
+# Contexte propre à chaque requête (seule partie variable du prompt)
+CONTEXT_TEMPLATE = """CONTEXTE FORMULAIRE - ANALYSE PROCESS DESIGNER
+
+=== PERSONA ===
+Nom: {q1} {q2}
+Rôle: {q3}
+Département: {q4}
+
+=== BESOIN ===
+Brief utilisateur:
+{q5}
+
+Exécution actuelle:
+{q6}
+
+=== VOLUMÉTRIE ===
+Fréquence: {q7}
+Nb exécutions/occurrence: {q8}
+Temps unitaire: {q9}
+Nb personnes: {q10}
+Irritant: {q11}/5
+Pourquoi irritant: {q12}
+Pourquoi urgent: {q13}
+
+=== NATURE TÂCHE ===
+Éléments sources: {q14}
+Action manuelle: {q15}
+Exemple action: {q16}
+Règles simples: {q17}
+Points complexes: {q18}
+Complexité orga: {q19}
+Outils: {q20}
+"""
+
+# Valeur affichée quand une question est vide ('-' par défaut)
+FIELD_DEFAULTS = {"q11": "3"}
+
+
+def _compile_template(template: str) -> List[Tuple[str, Optional[str]]]:
+    """Découpe le modèle une fois pour toutes en (texte fixe, champ à insérer)"""
+    return [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+
+
+_CONTEXT_PARTS = _compile_template(CONTEXT_TEMPLATE)
+
+
+def _field_labels() -> Dict[str, str]:
+    """Libellé de chaque question dans le contexte ("q14" -> "Éléments sources") ; q2 reprend celui de q1"""
+    labels, previous = {}, ""
+    for literal, field in _CONTEXT_PARTS:
+        if field is not None:
+            label = literal.strip().rsplit("\n", 1)[-1].strip().rstrip(":").strip()
+            labels[field] = previous = label or previous
+    return labels
+
+
+FIELD_LABELS = _field_labels()
+
+# Ré-analyse incrémentale : ajouté au contexte quand seules certaines sections sont redemandées
+UPDATE_TEMPLATE = """
+=== MISE À JOUR D'UNE ANALYSE EXISTANTE ===
+Réponses modifiées depuis l'analyse précédente: {changed}
+Produis UNIQUEMENT les sections: {sections}
+Sections conservées de l'analyse précédente (rester cohérent, ne pas les reproduire):
+{reused}
+"""
+
+# Message système complet et format de réponse : mêmes objets pour toutes les requêtes
+SYSTEM_CONTENT = SYSTEM_PROMPT + "\n\n" + INSTRUCTIONS
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_CONTENT}
+
+# Schéma JSON strict (sans scoring, calculé côté backend)
+RESPONSE_SCHEMA = FormAnalysisResponseWithoutScoring.model_json_schema()
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "form_analysis_response",
+        "strict": True,
+        "schema": RESPONSE_SCHEMA
+    }
+}
+
+
+@lru_cache(maxsize=64)
+def response_format_for(sections: Tuple[str, ...]) -> dict:
+    """Schéma strict restreint à certaines sections (ré-analyse incrémentale), $defs inutilisés retirés"""
+    properties = {name: RESPONSE_SCHEMA["properties"][name] for name in sections}
+    defs = RESPONSE_SCHEMA.get("$defs", {})
+    used, pending = set(), list(properties.values())
+    while pending:
+        raw = json.dumps(pending.pop())
+        for name in defs:
+            if f'"#/$defs/{name}"' in raw and name not in used:
+                used.add(name)
+                pending.append(defs[name])
+    schema = {key: value for key, value in RESPONSE_SCHEMA.items() if key not in ("properties", "required", "$defs")}
+    schema.update(properties=properties, required=list(sections))
+    if used:
+        schema["$defs"] = {name: defs[name] for name in defs if name in used}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "form_analysis_sections",
+            "strict": True,
+            "schema": schema
+        }
+    }
+
+
+def supports_structured_outputs(model: str) -> bool:
+    return model in STRUCTURED_OUTPUT_MODELS
+
+
+# Budgets de tokens (relus par configure_budgets() une fois le .env chargé)
+INPUT_BUDGET = InputBudget.from_env()
+OUTPUT_BUDGET = OutputBudget.from_env(MAX_TOKENS)
+
+
+def configure_budgets():
+    """Relit PROMPT_INPUT_BUDGET, PROMPT_FIELD_MAX_TOKENS, OUTPUT_* (appelé par main après load_dotenv)"""
+    global INPUT_BUDGET, OUTPUT_BUDGET
+    INPUT_BUDGET = InputBudget.from_env()
+    OUTPUT_BUDGET = OutputBudget.from_env(MAX_TOKENS)
+
+
+class PromptPlan:
+    """
+    Contexte prêt à envoyer + tokens mesurés (entrée) et demandés (max_tokens)
+    sections : None pour une analyse complète, sinon les seules sections demandées (ré-analyse incrémentale)
+    """
+
+    def __init__(self, context: str, input_tokens: int, max_tokens: int,
+                 compacted: Optional[Dict[str, Tuple[int, int]]] = None,
+                 sections: Optional[Tuple[str, ...]] = None):
+        self.context = context
+        self.input_tokens = input_tokens
+        self.max_tokens = max_tokens
+        self.compacted = compacted or {}
+        self.sections = sections
+
+    @property
+    def response_format(self) -> dict:
+        return response_format_for(self.sections) if self.sections else RESPONSE_FORMAT
+
+    def report(self) -> dict:
+        report = {"input_tokens": self.input_tokens, "max_tokens": self.max_tokens}
+        if self.compacted:
+            report["compacted"] = {field: {"before": before, "after": after}
+                                   for field, (before, after) in self.compacted.items()}
+        if self.sections:
+            report["sections"] = list(self.sections)
+        return report
+
+
+def _fill(values: Dict[str, Optional[str]]) -> str:
+    parts = []
+    for literal, field in _CONTEXT_PARTS:
+        parts.append(literal)
+        if field is not None:
+            parts.append(values.get(field) or FIELD_DEFAULTS.get(field, "-"))
+    return "".join(parts)
+
+
+@lru_cache(maxsize=1)
+def system_tokens() -> int:
+    """Tokens du message système (constant, mesuré au premier appel)"""
+    return count_tokens(SYSTEM_CONTENT)
+
+
+def build_prompt(d: FormData, model: Optional[str] = None) -> PromptPlan:
+    """
+    Remplit le modèle de contexte ; les réponses libres qui dépassent le budget d'entrée
+    (PROMPT_INPUT_BUDGET, PROMPT_FIELD_MAX_TOKENS) sont compactées avant insertion.
+    """
+    values = d.model_dump()
+    fixed = system_tokens() + count_tokens(_fill({k: v for k, v in values.items() if k not in FREE_TEXT_FIELDS}), model)
+    values, compacted, free_tokens = fit_fields(values, fixed, INPUT_BUDGET, model)
+    return PromptPlan(_fill(values), fixed + free_tokens, OUTPUT_BUDGET.max_tokens(), compacted)
+
+
+def build_update_prompt(d: FormData, sections: Sequence[str], reused: Dict[str, dict],
+                        changed: Sequence[str], model: Optional[str] = None) -> PromptPlan:
+    """
+    Prompt d'une ré-analyse incrémentale : même message système (préfixe caché), contexte complet
+    du formulaire modifié, puis les questions modifiées, les sections à produire et les sections conservées.
+    """
+    plan = build_prompt(d, model)
+    update = UPDATE_TEMPLATE.format(
+        changed=", ".join(f"{FIELD_LABELS.get(q, q)} ({q})" for q in changed),
+        sections=", ".join(sections),
+        reused=json.dumps(reused, ensure_ascii=False, separators=(",", ":")),
+    )
+    return PromptPlan(plan.context + update, plan.input_tokens + count_tokens(update, model),
+                      plan.max_tokens, plan.compacted, tuple(sections))
+
+
+def build_messages(context: str) -> List[dict]:
+    """Message système statique en premier (préfixe cachable), puis le contexte du formulaire"""
+    return [SYSTEM_MESSAGE, {"role": "user", "content": context}]
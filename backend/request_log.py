@@ -0,0 +1,379 @@
+"""
+Journal structuré des requêtes (mode production)
+LOG_FORMAT=json : une ligne JSON par requête HTTP (identifiant, latence par étape, tokens,
+cache, scoring) à la place des traces détaillées ; aucune donnée du formulaire dans la ligne.
+Capture optionnelle prompt / réponse (LOG_CAPTURE_SAMPLE_RATE), échantillonnée et écrite
+par un thread dédié, hors du chemin de la requête.
+Les mêmes points de mesure alimentent les métriques Prometheus (metrics.py), actives en permanence.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lignes JSON sur leur propre logger (sans préfixe date/niveau), configuré par configure()
+request_logger = logging.getLogger("cmform.requests")
+
+_json_mode = False
+_sample_rate = 0.0
+# Routes appelées à chaque frappe (POST /score) : métriques seulement, pas de ligne JSON
+_quiet_paths = frozenset()
+_capture_dir: Optional[Path] = None
+
+_current: ContextVar[Optional["RequestRecord"]] = ContextVar("request_record", default=None)
+
+
+def configure():
+    """Lit la configuration (appelé par main après load_dotenv)"""
+    global _json_mode, _sample_rate, _capture_dir, _quiet_paths
+    _json_mode = os.environ.get("LOG_FORMAT", "text").lower() == "json"
+    _quiet_paths = frozenset(p.strip() for p in os.environ.get("LOG_QUIET_ROUTES", "/score").split(",") if p.strip())
+    _sample_rate = float(os.environ.get("LOG_CAPTURE_SAMPLE_RATE", "0"))
+    _capture_dir = Path(os.environ.get("LOG_CAPTURE_DIR") or Path(__file__).parent / "logs" / "captures")
+    if _json_mode and not request_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        request_logger.addHandler(handler)
+        request_logger.setLevel(logging.INFO)
+        request_logger.propagate = False
+
+
+def json_mode() -> bool:
+    return _json_mode
+
+
+# ==================== ENREGISTREMENT PAR REQUÊTE ====================
+
+class RequestRecord:
+    """Mesures d'une requête, complétées au fil du traitement puis émises en une ligne"""
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self.cache = {}
+        self.llm_calls = 0
+        self.scored = 0
+        self.scoring = None
+        self.prompt = None
+        self.routing = None
+        self.sources = None
+        self.status = None
+        self.error = None
+        self.captured = 0
+        # Tirage fait une fois par requête : la capture concerne toute la requête ou rien
+        self.sampled = _sample_rate > 0 and random.random() < _sample_rate
+
+    def to_dict(self) -> dict:
+        line = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "latency_ms": round((time.perf_counter() - self.start) * 1000, 1),
+        }
+        if self.stages:
+            line["stages_ms"] = {k: round(v, 1) for k, v in self.stages.items()}
+        if self.llm_calls:
+            line["llm_calls"] = self.llm_calls
+        if self.prompt:
+            line["prompt"] = self.prompt
+        if self.routing:
+            line["routing"] = self.routing
+        if self.sources:
+            line["sources"] = self.sources
+        if self.tokens:
+            line["tokens"] = self.tokens
+        if self.cache:
+            line["cache"] = self.cache
+        if self.scoring:
+            line["scoring"] = self.scoring
+            if self.scored > 1:
+                line["scored"] = self.scored
+        if self.captured:
+            line["captured"] = self.captured
+        if self.error:
+            line["error"] = self.error
+        return line
+
+
+def current() -> Optional[RequestRecord]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Chronomètre une étape (histogramme + ligne JSON) ; cumulé si l'étape se répète (analyse en lot)"""
+    record = _current.get()
+    if record is None and not metrics.enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def add_stage(name: str, ms: float):
+    """Durée mesurée par l'appelant (ex. flux SSE, où un bloc with engloberait les yield)"""
+    metrics.STAGE_SECONDS.observe(ms / 1000, stage=name)
+    record = _current.get()
+    if record is not None:
+        record.stages[name] = record.stages.get(name, 0.0) + ms
+
+
+def record_usage(usage, model: str = ""):
+    """Tokens d'un appel OpenAI (dont tokens de préfixe servis par le cache du fournisseur)"""
+    metrics.LLM_CALLS.inc(model=model)
+    record = _current.get()
+    if record is not None:
+        record.llm_calls += 1
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    counts = {
+        "prompt": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion": getattr(usage, "completion_tokens", 0) or 0,
+        "total": getattr(usage, "total_tokens", 0) or 0,
+        "cached": getattr(details, "cached_tokens", 0) or 0,
+    }
+    for key in ("prompt", "completion", "cached"):
+        metrics.LLM_TOKENS.inc(counts[key], model=model, type=key)
+    if record is not None:
+        for key, value in counts.items():
+            record.tokens[key] = record.tokens.get(key, 0) + value
+
+
+def record_prompt(report: dict):
+    """Tokens d'entrée mesurés, max_tokens demandé et champs compactés (voir prompts.PromptPlan)"""
+    metrics.PROMPT_INPUT_TOKENS.observe(report["input_tokens"])
+    metrics.PROMPT_MAX_TOKENS.observe(report["max_tokens"])
+    for field in report.get("compacted", {}):
+        metrics.PROMPT_COMPACTIONS.inc(field=field)
+    record = _current.get()
+    if record is not None:
+        record.prompt = report
+
+
+def record_routing(route: dict):
+    """Niveau routé, modèle ayant répondu et tentatives (voir routing.RouteTrace)"""
+    attempts = route.get("attempts", [])
+    for attempt in attempts:
+        metrics.LLM_CALL_SECONDS.observe(attempt["latency_ms"] / 1000, model=attempt["model"], outcome=attempt["outcome"])
+        if attempt["role"] != "primary":
+            metrics.LLM_FAILOVERS.inc(role=attempt["role"])
+    if attempts:
+        metrics.ROUTING_DECISIONS.inc(tier=route["tier"], model=route.get("served_by") or "none")
+    record = _current.get()
+    if record is not None:
+        record.routing = route
+
+
+def record_sources(report: dict):
+    """Pré-classification locale de q14 et accord avec la section elements_sources de l'IA"""
+    for field, ok in report.get("agreement", {}).items():
+        metrics.SOURCE_AGREEMENT.inc(field=field, outcome="agree" if ok else "disagree")
+    record = _current.get()
+    if record is not None:
+        record.sources = report
+
+
+def record_cache(status: str):
+    """'hit', 'miss', 'disabled', 'coalesced' ou 'similar' (analyse d'un use case quasi identique)"""
+    metrics.CACHE_LOOKUPS.inc(result=status)
+    record = _current.get()
+    if record is not None:
+        record.cache[status] = record.cache.get(status, 0) + 1
+
+
+def record_scoring(scoring):
+    record = _current.get()
+    if record is None:
+        return
+    record.scored += 1
+    record.scoring = {
+        "faisabilite": scoring.faisabilite_technique_score,
+        "urgence": scoring.urgence_score,
+        "gain_temps_mensuel_heures": scoring.gain_temps_mensuel_heures,
+        "rules_version": scoring.rules_version,
+    }
+
+
+def record_error(detail: str, status: int = 502):
+    """Erreur renvoyée au client (status : code HTTP, ou code de l'événement SSE 'error')"""
+    metrics.ANALYSIS_ERRORS.inc(status=status)
+    record = _current.get()
+    if record is not None:
+        record.error = detail[:500]
+
+
+# ==================== MIDDLEWARE ASGI ====================
+
+class RequestLogMiddleware:
+    """
+    Ouvre un RequestRecord par requête HTTP (X-Request-ID repris ou généré, renvoyé en en-tête)
+    et émet la ligne JSON à la fin du corps de réponse, y compris pour SSE / NDJSON.
+    Alimente aussi les métriques HTTP (requêtes en cours, codes de réponse, durée par route).
+    Middleware ASGI pur : pas de copie du corps, sans effet hors LOG_FORMAT=json et métriques coupées.
+    Routes LOG_QUIET_ROUTES (défaut /score) : métriques seulement, sans ligne JSON ni X-Request-ID.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (_json_mode or metrics.enabled()):
+            await self.app(scope, receive, send)
+            return
+
+        record = None
+        token = None
+        if _json_mode and scope["path"] not in _quiet_paths:
+            request_id = None
+            for key, value in scope.get("headers", []):
+                if key == b"x-request-id":
+                    request_id = value.decode("latin-1")[:64]
+                    break
+            record = RequestRecord(request_id or uuid.uuid4().hex, scope["method"], scope["path"])
+            token = _current.set(record)
+        start = time.perf_counter()
+        status = None
+        emitted = False
+        # Route connue après le routage (scope["route"]) : chemin générique, pas d'identifiants
+        in_flight_route = _route_label(scope)
+        metrics.HTTP_IN_FLIGHT.inc(route=in_flight_route)
+
+        def emit():
+            nonlocal emitted
+            if emitted:
+                return
+            emitted = True
+            metrics.HTTP_IN_FLIGHT.dec(route=in_flight_route)
+            route = _route_label(scope)
+            metrics.HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status or 500)
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route)
+            if record is not None:
+                request_logger.info(json.dumps(record.to_dict(), ensure_ascii=False))
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if record is not None:
+                    record.status = status
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-request-id", record.request_id.encode("latin-1"))
+                    ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                emit()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            status = status or 500
+            if record is not None:
+                record.status = record.status or 500
+                record.error = record.error or f"{type(e).__name__}: {e}"[:500]
+            raise
+        finally:
+            emit()
+            if token is not None:
+                _current.reset(token)
+
+
+def _route_label(scope) -> str:
+    """Modèle de chemin de la route (/use-cases/{use_case_id}), 'unmatched' si aucune route"""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    return scope["path"] if scope["path"] in _STATIC_ROUTES else "unmatched"
+
+
+# Chemins fixes reconnus avant routage (libellé de la jauge des requêtes en cours)
+_STATIC_ROUTES = frozenset()
+
+
+def register_routes(paths):
+    """Déclare les chemins sans paramètre de l'application (appelé par main au démarrage)"""
+    global _STATIC_ROUTES
+    _STATIC_ROUTES = frozenset(p for p in paths if "{" not in p)
+
+
+# ==================== CAPTURE PROMPT / RÉPONSE ====================
+
+_capture_queue: "queue.Queue" = queue.Queue(maxsize=1000)
+_capture_thread: Optional[threading.Thread] = None
+_capture_lock = threading.Lock()
+capture_dropped = 0
+
+
+def _capture_worker():
+    while True:
+        item = _capture_queue.get()
+        if item is None:
+            return
+        try:
+            _capture_dir.mkdir(parents=True, exist_ok=True)
+            path = _capture_dir / f"captures-{item['ts'][:10]}.jsonl"
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"⚠️ Capture non écrite: {e}")
+
+
+def capture(model: str, prompt: str, response: str):
+    """Met en file le couple prompt/réponse si la requête est échantillonnée (jamais bloquant)"""
+    global _capture_thread, capture_dropped
+    record = _current.get()
+    if record is None or not record.sampled:
+        return
+    if _capture_thread is None:
+        with _capture_lock:
+            if _capture_thread is None:
+                _capture_thread = threading.Thread(target=_capture_worker, name="log-capture", daemon=True)
+                _capture_thread.start()
+    item = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "request_id": record.request_id,
+        "model": model,
+        "prompt": prompt,
+        "response": response,
+    }
+    try:
+        _capture_queue.put_nowait(item)
+        record.captured += 1
+    except queue.Full:
+        capture_dropped += 1
+
+
+def close_capture(timeout: float = 5.0):
+    """Vide la file de capture à l'arrêt du serveur"""
+    global _capture_thread
+    if _capture_thread is None:
+        return
+    try:
+        _capture_queue.put(None, timeout=timeout)
+    except queue.Full:
+        return
+    _capture_thread.join(timeout)
+    _capture_thread = None
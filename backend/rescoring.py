@@ -0,0 +1,275 @@
+"""
+Re-scoring vectorisé de l'archive des use cases (NumPy)
+Les entrées du scoring (Q7-Q11, Q15, Q17, Q19 + elements_sources de l'IA) sont chargées
+une fois en colonnes ; chaque jeu de pondérations est ensuite appliqué en une seule passe.
+Résultats identiques à calculate_scoring (faisabilité, urgence, gain de temps) ; la pondération
+de référence est celle du barème actif (scoring_rules.json).
+
+Usage CLI (depuis backend/):
+    python rescoring.py --check                      # compare à calculate_scoring, cas par cas
+    python rescoring.py --what-if poids.json --top 20
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from models import FormData
+from scoring import ScoringWeights, calculate_scoring, get_rules, parse_time_counts
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== CHARGEMENT EN COLONNES ====================
+
+def _to_float(value, default: float) -> float:
+    try:
+        return float(value or default)
+    except (ValueError, TypeError):
+        return default
+
+
+def _to_int(value, default: int) -> int:
+    try:
+        return int(value or default)
+    except (ValueError, TypeError):
+        return default
+
+
+class _Categorical:
+    """Colonne catégorielle encodée (vocabulaire + codes) : lookup de poids en O(n) vectorisé"""
+
+    def __init__(self, values: List[Optional[str]]):
+        self.vocabulary, self.codes = np.unique(
+            np.array(["" if v is None else v for v in values], dtype=object), return_inverse=True
+        )
+
+    def lookup(self, weights: Dict[str, int]) -> np.ndarray:
+        table = np.array([weights.get(v, 0) for v in self.vocabulary], dtype=np.int64)
+        return table[self.codes] if len(self.codes) else np.zeros(0, dtype=np.int64)
+
+
+class ScoringFrame:
+    """Entrées du scoring de toute l'archive, en colonnes NumPy"""
+
+    def __init__(self, ids: List[str], forms: List[FormData], elements: List[dict],
+                 rules_versions: Optional[List[Optional[str]]] = None):
+        n = len(ids)
+        self.ids = np.array(ids, dtype=object)
+        self.forms = forms
+        self.freq = np.fromiter((_to_float(f.q7, 0) for f in forms), dtype=np.float64, count=n)
+        self.exec = np.fromiter((_to_int(f.q8, 0) for f in forms), dtype=np.float64, count=n)
+        # Q9 gardé en (jours, heures, minutes) : day_hours peut varier d'un jeu de pondérations à l'autre
+        time_counts = np.array([parse_time_counts(f.q9 or "") for f in forms], dtype=np.int64).reshape(n, 3)
+        self.days, self.hours, self.mins = time_counts[:, 0], time_counts[:, 1], time_counts[:, 2]
+        # Q9 en heures (frontend) : utilisé seulement si Q9 texte est vide, comme dans score_components
+        self.total_hours = np.fromiter(
+            (f.q9_total_hours if not f.q9 and f.q9_total_hours is not None else np.nan for f in forms),
+            dtype=np.float64, count=n,
+        )
+        self.people = np.fromiter((_to_int(f.q10, 1) for f in forms), dtype=np.float64, count=n)
+        self.irritant = np.fromiter((_to_int(f.q11, 0) for f in forms), dtype=np.int64, count=n)
+        self.total_sources = np.fromiter((e.get("total_sources", 0) for e in elements), dtype=np.int64, count=n)
+        self.elements_count = np.fromiter((e.get("count", 0) for e in elements), dtype=np.int64, count=n)
+        self.rules = _Categorical([f.q17 for f in forms])
+        self.orga = _Categorical([f.q19 for f in forms])
+        self.manual = _Categorical([f.q15 for f in forms])
+        self.category = _Categorical([e.get("complexity_level", "Standard") for e in elements])
+        self.rules_versions = np.array(rules_versions or [None] * n, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_store(cls, store) -> "ScoringFrame":
+        from store import form_data_from_payload
+        ids, forms, elements, rules_versions = [], [], [], []
+        for use_case_id, payload in store.iter_payloads():
+            ai_analysis = payload.get("ai_analysis", {})
+            ids.append(use_case_id)
+            forms.append(form_data_from_payload(payload))
+            elements.append(ai_analysis.get("elements_sources", {}) or {})
+            rules_versions.append((ai_analysis.get("scoring") or {}).get("rules_version"))
+        return cls(ids, forms, elements, rules_versions)
+
+    def stale_count(self, rules_version: str) -> int:
+        """Use cases dont le scoring sauvegardé provient d'une autre version du barème"""
+        return int(np.sum(self.rules_versions != rules_version))
+
+
+# ==================== SCORING VECTORISÉ ====================
+
+def score_frame(frame: ScoringFrame, weights: Optional[ScoringWeights] = None) -> Dict[str, np.ndarray]:
+    """
+    Une passe vectorisée sur toute l'archive.
+    Retourne faisabilite / urgence (0-100), gain_temps (h/mois, tronqué) et etp (non arrondi).
+    """
+    w = weights or get_rules().weights
+
+    # np.select garde la première condition vraie : seuils triés comme dans CompiledRules
+    thresholds = sorted(w.sources_thresholds)
+    conditions = [frame.total_sources <= limit for limit, _ in thresholds]
+    choices = [np.int64(points) for _, points in thresholds]
+    sources_points = np.select(conditions, choices, default=w.sources_default) if conditions \
+        else np.full(len(frame), w.sources_default, dtype=np.int64)
+
+    faisabilite_score = (
+        frame.rules.lookup(w.rules)
+        + sources_points
+        + frame.category.lookup(w.complexity_category)
+        + frame.orga.lookup(w.orga)
+        + frame.manual.lookup(w.manual)
+    )
+    urgence_score = frame.irritant * w.irritant_factor
+
+    # Mêmes opérations flottantes que calculate_scoring ; np.rint = arrondi bancaire comme round()
+    faisabilite = np.rint((faisabilite_score / w.faisabilite_max) * 100).astype(np.int64)
+    urgence = np.rint((urgence_score / w.urgence_max) * 100).astype(np.int64)
+    # Même ordre d'opérations que parse_time_to_hours (heures entières puis minutes / 60)
+    unit_hours = (frame.days * w.day_hours + frame.hours) + np.where(frame.mins > 0, frame.mins / 60, 0)
+    unit_hours = np.where(np.isnan(frame.total_hours), unit_hours, np.maximum(frame.total_hours, 0))
+    temps_mensuel_total = frame.freq * frame.exec * unit_hours * frame.people
+    gain_temps = np.trunc(temps_mensuel_total).astype(np.int64)
+
+    return {
+        "faisabilite": faisabilite,
+        "urgence": urgence,
+        "gain_temps": gain_temps,
+        "etp": temps_mensuel_total / w.etp_hours,
+    }
+
+
+def ranking(scores: Dict[str, np.ndarray], rank_by: str) -> np.ndarray:
+    """Indices triés par métrique décroissante (tri stable, départage par ETP)"""
+    if rank_by not in scores:
+        raise ValueError(f"Critère de classement inconnu: {rank_by} (autorisés: {', '.join(scores)})")
+    return np.lexsort((-scores["etp"], -scores[rank_by]))
+
+
+def compare_weight_sets(
+    frame: ScoringFrame,
+    weight_sets: Dict[str, ScoringWeights],
+    rank_by: str = "faisabilite",
+    top: int = 20,
+) -> dict:
+    """
+    Compare le classement du portefeuille entre le barème actif et des jeux "what-if".
+    Pour chaque jeu : top N, zones du graphique Faisabilité × ETP, déplacement moyen de rang.
+    """
+    start = time.perf_counter()
+    n = len(frame)
+    rules = get_rules()
+    baseline = score_frame(frame, rules.weights)
+    baseline_order = ranking(baseline, rank_by)
+    baseline_rank = np.empty(n, dtype=np.int64)
+    baseline_rank[baseline_order] = np.arange(n)
+
+    def summarize(scores: Dict[str, np.ndarray], order: np.ndarray) -> dict:
+        high_fais = scores["faisabilite"] > 50
+        high_etp = scores["etp"] > 1
+        return {
+            "top": [
+                {
+                    "id": frame.ids[i],
+                    "faisabilite": int(scores["faisabilite"][i]),
+                    "urgence": int(scores["urgence"][i]),
+                    "gain_temps_mensuel_heures": int(scores["gain_temps"][i]),
+                    "etp": round(float(scores["etp"][i]), 1),
+                }
+                for i in order[:top]
+            ],
+            "zones": {
+                "faisable_fort_impact": int(np.sum(high_fais & high_etp)),
+                "faisable_faible_impact": int(np.sum(high_fais & ~high_etp)),
+                "difficile_fort_impact": int(np.sum(~high_fais & high_etp)),
+                "difficile_faible_impact": int(np.sum(~high_fais & ~high_etp)),
+            },
+            "faisabilite_moyenne": round(float(scores["faisabilite"].mean()), 1) if n else None,
+            "urgence_moyenne": round(float(scores["urgence"].mean()), 1) if n else None,
+        }
+
+    result = {
+        "count": n,
+        "rank_by": rank_by,
+        "rules_version": rules.version,
+        "perimes": frame.stale_count(rules.version),
+        "baseline": summarize(baseline, baseline_order),
+        "what_if": {},
+    }
+    for name, weights in weight_sets.items():
+        scores = score_frame(frame, weights)
+        order = ranking(scores, rank_by)
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        summary = summarize(scores, order)
+        summary["rang_deplacement_moyen"] = round(float(np.abs(rank - baseline_rank).mean()), 2) if n else 0.0
+        summary["cas_modifies"] = int(np.sum(
+            (scores["faisabilite"] != baseline["faisabilite"]) | (scores["urgence"] != baseline["urgence"])
+        ))
+        result["what_if"][name] = summary
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def check_against(frame: ScoringFrame) -> List[str]:
+    """Compare cas par cas à calculate_scoring (barème actif) ; retourne les ids en écart"""
+    rules = get_rules()
+    scores = score_frame(frame, rules.weights)
+    mismatches = []
+    for i, form in enumerate(frame.forms):
+        reference = calculate_scoring(
+            form, int(frame.elements_count[i]), int(frame.total_sources[i]),
+            frame.category.vocabulary[frame.category.codes[i]] or None, rules=rules
+        )
+        expected = (
+            int(reference.faisabilite_technique_score.split("/")[0]),
+            int(reference.urgence_score.split("/")[0]),
+            reference.gain_temps_mensuel_heures,
+        )
+        got = (int(scores["faisabilite"][i]), int(scores["urgence"][i]), int(scores["gain_temps"][i]))
+        if expected != got:
+            mismatches.append(frame.ids[i])
+    return mismatches
+
+
+# ==================== CLI ====================
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Re-scoring vectorisé de l'archive des use cases")
+    parser.add_argument("--check", action="store_true", help="Vérifie l'égalité avec calculate_scoring")
+    parser.add_argument("--what-if", help="Fichier JSON {nom: pondérations} à comparer à l'actuel")
+    parser.add_argument("--rank-by", default="faisabilite", choices=["faisabilite", "urgence", "gain_temps", "etp"])
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from store import store_from_env
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start = time.perf_counter()
+    frame = ScoringFrame.from_store(store_from_env())
+    logger.info(f"📥 {len(frame)} use cases chargés en {time.perf_counter() - start:.2f}s")
+
+    if args.check:
+        mismatches = check_against(frame)
+        logger.info(f"✅ {len(frame) - len(mismatches)}/{len(frame)} identiques à calculate_scoring")
+        if mismatches:
+            logger.error(f"❌ Écarts: {mismatches[:20]}")
+            return 1
+
+    weight_sets = {}
+    if args.what_if:
+        with open(args.what_if, "r", encoding="utf-8") as f:
+            weight_sets = {name: ScoringWeights(**w) for name, w in json.load(f).items()}
+    if weight_sets or not args.check:
+        print(json.dumps(compare_weight_sets(frame, weight_sets, args.rank_by, args.top), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,249 @@
+"""
+Routage multi-modèles des analyses
+- Formulaire simple (réponses libres courtes, peu de sources en q14, complexité orga "Simple")
+  -> modèle rapide (ROUTING_FAST_MODEL) ; sinon -> modèle principal (OPENAI_MODEL)
+- Délai max par requête (LLM_REQUEST_TIMEOUT), retries du SDK compris
+- Sans réponse après ROUTING_HEDGE_AFTER secondes : appel de couverture sur l'autre modèle,
+  la première réponse l'emporte ; délai dépassé ou erreur 5xx : bascule immédiate sur l'autre modèle
+  (jamais sur 4xx ni 429 : même requête refusée, quota partagé)
+- Décision, tentatives et latence par modèle conservées dans un RouteTrace (log, métriques, use case)
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from batch import error_status
+from source_classifier import classify_sources
+from token_budget import FREE_TEXT_FIELDS, count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def count_sources(text: Optional[str]) -> int:
+    """Nombre d'éléments sources cités en q14 (même découpage que la pré-classification locale)"""
+    return classify_sources(text).total_sources
+
+
+class RoutingConfig:
+    """Modèles des deux niveaux, critères d'un formulaire simple et délais"""
+
+    def __init__(self, strong_model: str, fast_model: Optional[str] = None, enabled: bool = True,
+                 simple_max_tokens: int = 400, simple_max_sources: int = 3,
+                 hedge_after: float = 20.0, timeout: float = 60.0, fallback: bool = True):
+        self.strong_model = strong_model
+        self.fast_model = fast_model or strong_model
+        self.enabled = enabled and self.fast_model != strong_model
+        self.simple_max_tokens = simple_max_tokens
+        self.simple_max_sources = simple_max_sources
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.fallback = fallback
+
+    @classmethod
+    def from_env(cls, strong_model: str) -> "RoutingConfig":
+        return cls(
+            strong_model=strong_model,
+            fast_model=os.environ.get("ROUTING_FAST_MODEL", "gpt-4o-mini").strip() or None,
+            enabled=os.environ.get("ROUTING_ENABLED", "1") not in ("0", "false", "False"),
+            simple_max_tokens=int(os.environ.get("ROUTING_SIMPLE_MAX_TOKENS", "400")),
+            simple_max_sources=int(os.environ.get("ROUTING_SIMPLE_MAX_SOURCES", "3")),
+            hedge_after=float(os.environ.get("ROUTING_HEDGE_AFTER", "20")),
+            timeout=float(os.environ.get("LLM_REQUEST_TIMEOUT", "60")),
+            fallback=os.environ.get("ROUTING_FALLBACK", "1") not in ("0", "false", "False"),
+        )
+
+    def describe(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "fast_model": self.fast_model,
+            "strong_model": self.strong_model,
+            "simple_max_tokens": self.simple_max_tokens,
+            "simple_max_sources": self.simple_max_sources,
+            "hedge_after_s": self.hedge_after,
+            "timeout_s": self.timeout,
+            "fallback": self.fallback,
+        }
+
+
+# ==================== DÉCISION ====================
+
+class RouteTrace:
+    """Décision de routage d'une analyse puis tentatives (modèle, rôle, latence, issue)"""
+
+    def __init__(self, tier: str, model: str, fallback: Optional[str], reasons: List[str]):
+        self.tier = tier
+        self.model = model
+        self.fallback = fallback
+        self.reasons = reasons
+        self.attempts: List[dict] = []
+        self.served_by: Optional[str] = None
+        self.total_ms: Optional[float] = None  # flux : durée complète (les tentatives mesurent le premier fragment)
+        self.source = "llm"  # "llm", ou "coalesced" si le résultat vient d'un appel identique en cours
+        self.sections: Optional[List[str]] = None  # ré-analyse incrémentale : sections redemandées au LLM
+        self.reused_from: Optional[dict] = None  # use case similaire dont les autres sections sont reprises
+
+    def record(self, model: str, role: str, started: float, outcome: str, error: Optional[str] = None) -> dict:
+        attempt = {"model": model, "role": role, "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                   "outcome": outcome}
+        if error:
+            attempt["error"] = error[:200]
+        self.attempts.append(attempt)
+        return attempt
+
+    def to_dict(self) -> dict:
+        route = {"tier": self.tier, "model": self.model, "reasons": self.reasons, "source": self.source}
+        if self.served_by:
+            route["served_by"] = self.served_by
+        if self.attempts:
+            route["attempts"] = self.attempts
+        if self.total_ms is not None:
+            route["total_ms"] = self.total_ms
+        if self.sections is not None:
+            route["sections"] = self.sections
+        if self.reused_from is not None:
+            route["reused_from"] = self.reused_from
+        return route
+
+
+def decide(form_data, config: RoutingConfig, model: Optional[str] = None) -> RouteTrace:
+    """
+    Niveau du formulaire : "fast" si tous les critères de simplicité sont remplis, sinon "strong".
+    Les raisons listent les critères mesurés (tracées avec le résultat).
+    """
+    free_tokens = sum(count_tokens(getattr(form_data, field, None), model) for field in FREE_TEXT_FIELDS)
+    sources = count_sources(form_data.q14)
+    orga = form_data.q19 or "-"
+    reasons = [f"texte_libre={free_tokens}", f"sources={sources}", f"orga={orga}"]
+    simple = (config.enabled
+              and free_tokens <= config.simple_max_tokens
+              and sources <= config.simple_max_sources
+              and orga == "Simple")
+    if not config.enabled:
+        reasons.append("routage désactivé")
+    tier = "fast" if simple else "strong"
+    primary = config.fast_model if simple else config.strong_model
+    other = config.strong_model if simple else config.fast_model
+    # Même modèle des deux côtés : la couverture relance le même modèle (utile contre la latence de queue)
+    fallback = other if config.fallback else None
+    return RouteTrace(tier, primary, fallback, reasons)
+
+
+# ==================== EXÉCUTION : DÉLAI, COUVERTURE, BASCULE ====================
+
+class LLMTimeout(asyncio.TimeoutError):
+    """Aucune réponse du LLM dans le délai de la requête"""
+    status_code = 504
+
+
+def should_fail_over(exc: BaseException) -> bool:
+    """Bascule sur l'autre modèle seulement pour un délai dépassé ou une erreur serveur (5xx)"""
+    status = error_status(exc)
+    if status is not None:
+        return status >= 500
+    return isinstance(exc, asyncio.TimeoutError) or type(exc).__name__ == "APITimeoutError"
+
+
+async def run_routed(trace: RouteTrace, call: Callable[[str], Awaitable[Any]], config: RoutingConfig,
+                     hedge: bool = True, on_lose: Optional[Callable[[Any], Awaitable[None]]] = None) -> Any:
+    """
+    Exécute call(model) sur le modèle choisi dans le délai config.timeout.
+    - hedge : après config.hedge_after s sans réponse, même appel lancé sur trace.fallback
+    - délai dépassé ou 5xx sur le premier appel : bascule sur trace.fallback (si pas déjà lancé) ;
+      les autres erreurs (4xx, 429) sont levées telles quelles, sans second appel
+    La première réponse réussie est retournée, les autres appels sont annulés ;
+    on_lose(résultat) libère un résultat perdant déjà obtenu (flux ouvert par exemple).
+    Lève la dernière erreur si tous les appels échouent, LLMTimeout au-delà du délai.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config.timeout
+    running = {}
+
+    def launch(model: str, role: str):
+        task = asyncio.ensure_future(call(model))
+        running[task] = (model, role, time.perf_counter())
+
+    launch(trace.model, "primary")
+    primary_started = time.perf_counter()
+    spare = trace.fallback
+    hedging = hedge and config.hedge_after > 0
+    errors: List[BaseException] = []
+    try:
+        while running:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            wait = remaining
+            if spare and hedging:
+                wait = min(remaining, max(0.0, primary_started + config.hedge_after - time.perf_counter()))
+            done, _ = await asyncio.wait(list(running), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            failed = None
+            for task in done:
+                model, role, started = running.pop(task)
+                if task.exception() is None:
+                    trace.record(model, role, started, "ok")
+                    if winner is None:
+                        winner = (model, task.result())
+                    elif on_lose is not None:
+                        await on_lose(task.result())
+                else:
+                    error = failed = task.exception()
+                    errors.append(error)
+                    trace.record(model, role, started, "error", f"{type(error).__name__}: {error}")
+            if winner is not None:
+                trace.served_by = winner[0]
+                return winner[1]
+            if failed is not None and not should_fail_over(failed):
+                # 4xx / 429 : l'autre modèle serait refusé de la même façon (ou consommerait le quota) ;
+                # un appel de couverture déjà lancé peut encore répondre
+                if running:
+                    continue
+                raise failed
+            if spare and done:
+                # Délai dépassé ou erreur serveur -> bascule
+                logger.warning(f"⚠️ Échec sur {trace.model}, bascule sur {spare}: {errors[-1]}")
+                launch(spare, "fallback")
+                spare = None
+            elif spare and hedging and loop.time() < deadline:
+                # Délai de couverture écoulé -> même appel en parallèle sur l'autre modèle
+                logger.info(f"⏱️ Pas de réponse de {trace.model} après {config.hedge_after:g}s, couverture sur {spare}")
+                launch(spare, "hedge")
+                spare = None
+        if running or not errors:
+            raise LLMTimeout(f"Délai LLM dépassé ({config.timeout:g}s)")
+        raise errors[-1]
+    finally:
+        for task, (model, role, started) in running.items():
+            task.cancel()
+            trace.record(model, role, started, "timeout" if loop.time() >= deadline else "cancelled")
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def close_stream(stream):
+    """Ferme un flux LLM abandonné (AsyncStream OpenAI : close(), générateur : aclose())"""
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+async def iterate_until(stream: AsyncIterator, deadline: float) -> AsyncIterator:
+    """Itère le flux jusqu'à deadline (horloge de la boucle) ; LLMTimeout au-delà"""
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise LLMTimeout("Délai LLM dépassé pendant le flux")
+        try:
+            chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            raise LLMTimeout("Délai LLM dépassé pendant le flux")
+        yield chunk
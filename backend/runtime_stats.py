@@ -0,0 +1,96 @@
+"""
+Mesures du process (par worker) : retard de la boucle asyncio et mémoire résidente
+Une tâche de fond se réveille toutes les LOOP_LAG_INTERVAL secondes et mesure son retard
+de réveil (temps pendant lequel la boucle était bloquée). Exposé par /health.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Nombre de mesures (instant, retard) conservées : 10 min à l'intervalle par défaut
+LAG_WINDOW = 6000
+
+_lags = deque(maxlen=LAG_WINDOW)
+_task: Optional[asyncio.Task] = None
+_started_at = time.time()
+
+
+def lag_interval() -> float:
+    """Intervalle de mesure (s) ; 0 désactive la mesure"""
+    return float(os.environ.get("LOOP_LAG_INTERVAL", "0.1"))
+
+
+async def _monitor(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        _lags.append((time.monotonic(), max(0.0, loop.time() - expected) * 1000))
+
+
+def start_monitor():
+    """Lance la mesure du retard de boucle (au démarrage, dans la boucle du serveur)"""
+    global _task
+    interval = lag_interval()
+    if _task is not None or interval <= 0:
+        return
+    _task = asyncio.get_running_loop().create_task(_monitor(interval))
+
+
+async def stop_monitor():
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def rss_mb() -> Optional[float]:
+    """Mémoire résidente du process en Mo (Linux : /proc, sinon pic via resource)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1048576, 1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss : Ko sous Linux, octets sous macOS
+        return round(peak / (1048576 if sys.platform == "darwin" else 1024), 1)
+    except Exception:
+        return None
+
+
+def snapshot(window: Optional[float] = None) -> dict:
+    """Identifiant du worker, mémoire et retard de boucle (ms) sur les window dernières secondes"""
+    since = time.monotonic() - window if window else float("-inf")
+    lags = sorted(lag for at, lag in list(_lags) if at >= since)
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - _started_at, 1),
+        "rss_mb": rss_mb(),
+        "loop_lag_ms": {
+            "samples": len(lags),
+            "p50": round(_percentile(lags, 0.50), 2),
+            "p99": round(_percentile(lags, 0.99), 2),
+            "max": round(lags[-1] if lags else 0.0, 2),
+        } if _task is not None else None,
+    }
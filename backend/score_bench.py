@@ -0,0 +1,208 @@
+"""
+Micro-benchmark du scoring instantané (POST /score), dans le process : pas de réseau ni de serveur
+Mesure la latence par appel (µs, percentiles) de chaque étage :
+- classify_cold / classify_warm : pré-classification de q14 (texte jamais vu / déjà en cache)
+- components : score_components (points et gain de temps, sans mise en forme)
+- calculate_scoring : Scoring complet (formule et justification, comme /analyze)
+- preview : score_preview (corps de la réponse /score)
+- endpoint / endpoint_cold : requête ASGI complète sur l'app FastAPI (middlewares, validation, routage),
+  q14 identique ou différent à chaque appel (saisie en cours)
+--budget-us : plafond de la médiane de endpoint_cold (échec au-delà) ; --baseline : comparaison à un run précédent.
+Le débit HTTP réel (uvicorn, plusieurs workers) se mesure avec loadtest.py --endpoints score.
+
+Usage :
+    python score_bench.py
+    python score_bench.py --output bench_results/score-old.json
+    python score_bench.py --baseline bench_results/score-old.json --budget-us 1000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from loadtest import DEFAULT_OUTPUT_DIR, FORM, _git_revision, percentile
+
+# Étages comparés à la baseline (médiane) : plus bas = mieux
+COMPARED = ("classify_cold", "components", "preview", "endpoint", "endpoint_cold")
+
+
+def _stats(samples_ns: List[int]) -> dict:
+    values = sorted(ns / 1000 for ns in samples_ns)
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p90": round(percentile(values, 90), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "ops_per_s": round(len(values) / (sum(values) / 1e6)) if sum(values) else None,
+    }
+
+
+def measure(func: Callable[[int], object], n: int, warmup: int = 200) -> dict:
+    """Durée de func(i) pour i = 0..n-1 (après warmup appels)"""
+    for i in range(warmup):
+        func(-1 - i)
+    samples = []
+    clock = time.perf_counter_ns
+    for i in range(n):
+        start = clock()
+        func(i)
+        samples.append(clock() - start)
+    return _stats(samples)
+
+
+async def measure_async(func, n: int, warmup: int = 200) -> dict:
+    for i in range(warmup):
+        await func(-1 - i)
+    samples = []
+    clock = time.perf_counter_ns
+    for i in range(n):
+        start = clock()
+        await func(i)
+        samples.append(clock() - start)
+    return _stats(samples)
+
+
+async def asgi_post(app, path: str, body: bytes) -> int:
+    """Requête ASGI minimale (sans client HTTP) ; renvoie le code de réponse"""
+    received = False
+    status = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80),
+    }
+    await app(scope, receive, send)
+    return status[0] if status else 0
+
+
+def _typing(i: int) -> str:
+    """q14 en cours de saisie : un texte différent à chaque appel"""
+    return f"{FORM['q14']}, Export {i}"
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="score-bench-"))
+    os.environ.update({
+        "LLM_BACKEND": "fake",
+        "USE_CASES_DB": str(workdir / "bench.db"),
+        "ANALYSIS_CACHE_DIR": str(workdir / "cache"),
+        "SIMILARITY_ENABLED": "0",
+        "LOG_FORMAT": "json",
+    })
+    import main
+    import source_classifier
+    from models import FormData
+    from scoring import calculate_scoring, get_rules, score_components
+
+    form = FormData(**FORM)
+    rules = get_rules()
+    classify = source_classifier.classify_sources
+    n = args.iterations
+
+    results: Dict[str, dict] = {}
+    results["classify_cold"] = measure(lambda i: classify(_typing(i)), n)
+    results["classify_warm"] = measure(lambda i: classify(FORM["q14"]), n)
+    results["components"] = measure(lambda i: score_components(form, 3, "Standard", rules), n)
+    results["calculate_scoring"] = measure(lambda i: calculate_scoring(form, 2, 3, "Standard", rules), n)
+    results["preview"] = measure(lambda i: main.score_preview(form, 50.0), n)
+
+    same = json.dumps({"form_data": FORM, "hourly_cost": 50}).encode()
+
+    async def endpoint(i):
+        status = await asgi_post(main.app, "/score", same)
+        if status != 200:
+            raise RuntimeError(f"/score a répondu {status}")
+
+    async def endpoint_cold(i):
+        body = json.dumps({"form_data": dict(FORM, q14=_typing(i), q8=str(i % 50))}).encode()
+        status = await asgi_post(main.app, "/score", body)
+        if status != 200:
+            raise RuntimeError(f"/score a répondu {status}")
+
+    async def requests():
+        results["endpoint"] = await measure_async(endpoint, n)
+        results["endpoint_cold"] = await measure_async(endpoint_cold, n)
+
+    asyncio.run(requests())
+    shutil.rmtree(workdir, ignore_errors=True)
+    for name, stats in results.items():
+        print(f"  {name:<18} p50 {stats['p50']:>8.2f} µs  p99 {stats['p99']:>8.2f} µs  {stats['ops_per_s'] or 0:>10} /s")
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": n,
+        },
+        "results": results,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: dict, tolerance: float) -> List[str]:
+    """Étages dont la médiane dépasse celle de la baseline de plus de tolerance"""
+    previous = baseline.get("results", {})
+    regressions = []
+    for name in COMPARED:
+        before = previous.get(name, {}).get("p50")
+        after = results.get(name, {}).get("p50")
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{name}: {before} -> {after} µs")
+    return regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark du scoring instantané (POST /score)")
+    parser.add_argument("--iterations", type=int, default=5000, help="Appels mesurés par étage")
+    parser.add_argument("--budget-us", type=float, default=1000, help="Médiane maximale de endpoint_cold (µs)")
+    parser.add_argument("--output", type=Path, help="Fichier JSON (défaut: bench_results/score-<date>.json)")
+    parser.add_argument("--baseline", type=Path, help="Résultats d'une version précédente à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Écart toléré avant régression (0.3 = 30 %%)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = args.output or DEFAULT_OUTPUT_DIR / f"score-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Résultats: {output}")
+
+    failures = []
+    cold = report["results"]["endpoint_cold"]["p50"]
+    if cold > args.budget_us:
+        failures.append(f"endpoint_cold p50 {cold} µs > budget {args.budget_us:.0f} µs")
+    if args.baseline:
+        failures += compare(report["results"], json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+    if failures:
+        print(f"⚠️ {len(failures)} régression(s):")
+        for line in failures:
+            print(f"   - {line}")
+        return 1
+    print(f"✅ /score dans le budget ({cold} µs ≤ {args.budget_us:.0f} µs)"
+          + (f", aucune régression par rapport à {args.baseline}" if args.baseline else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,285 @@
+"""
+Scoring déterministe (Faisabilité / Urgence / Gain de temps)
+Le barème est lu dans un fichier de règles versionné (scoring_rules.json), compilé une fois
+(tables de lookup, regex Q9 précompilées) et rechargé à chaud quand le fichier change.
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from models import FormData, Scoring
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "scoring_rules.json"
+
+# Parser Q9 (format "1j 2h 30min") : regex compilées une seule fois
+_DAYS_RE = re.compile(r'(\d+)j')
+_HOURS_RE = re.compile(r'(\d+)h')
+_MINS_RE = re.compile(r'(\d+)min')
+
+
+# ==================== BARÈME ====================
+
+class ScoringWeights(BaseModel):
+    """Pondérations du scoring (valeurs par défaut = barème historique)"""
+    rules: Dict[str, int] = {"Oui": 10, "Partiellement": 6, "Non": 2}
+    # (nombre max de sources, points) par seuil croissant ; au-delà : sources_default
+    sources_thresholds: List[Tuple[int, int]] = [(2, 5), (5, 3), (10, 1)]
+    sources_default: int = 0
+    complexity_category: Dict[str, int] = {"Standard": 5, "Intermédiaire": 3, "Complexe": 1, "Non standardisée": 0}
+    orga: Dict[str, int] = {"Simple": 7, "Moyenne": 4, "Complexe": 1}
+    manual: Dict[str, int] = {"Non": 3, "Oui": 0}
+    irritant_factor: int = 6
+    # Diviseurs des scores sur 100 et de l'ETP : strictement positifs (sinon ZeroDivisionError à chaque scoring)
+    faisabilite_max: int = Field(30, gt=0)
+    urgence_max: int = Field(30, gt=0)
+    day_hours: int = Field(7, gt=0)
+    etp_hours: float = Field(140, gt=0, allow_inf_nan=False)
+
+
+class ScoringRules(BaseModel):
+    """Fichier de règles : version + pondérations"""
+    version: str
+    description: Optional[str] = None
+    weights: ScoringWeights = ScoringWeights()
+
+
+class CompiledRules:
+    """Barème prêt à l'emploi : seuils de sources triés, tables de lookup, version"""
+
+    def __init__(self, rules: ScoringRules):
+        self.version = rules.version
+        self.weights = rules.weights
+        self.sources_thresholds = sorted(rules.weights.sources_thresholds)
+
+    def sources_points(self, total_sources: int) -> int:
+        for limit, points in self.sources_thresholds:
+            if total_sources <= limit:
+                return points
+        return self.weights.sources_default
+
+
+def parse_time_counts(time_str: str) -> Tuple[int, int, int]:
+    """Q9 "1j 2h 30min" -> (jours, heures, minutes) ; 0 pour une composante absente"""
+    if not time_str:
+        return 0, 0, 0
+    days_match = _DAYS_RE.search(time_str)
+    hours_match = _HOURS_RE.search(time_str)
+    mins_match = _MINS_RE.search(time_str)
+    return (
+        int(days_match.group(1)) if days_match else 0,
+        int(hours_match.group(1)) if hours_match else 0,
+        int(mins_match.group(1)) if mins_match else 0,
+    )
+
+
+def parse_time_to_hours(time_str: str, day_hours: int = 7) -> float:
+    """Parser Q9 (format "1j 2h 30min" ou juste nombre) en heures (1 jour = day_hours)"""
+    days, hours, mins = parse_time_counts(time_str)
+    total = days * day_hours + hours
+    if mins:
+        total += mins / 60
+    return total
+
+
+# ==================== CHARGEMENT / RECHARGEMENT À CHAUD ====================
+
+def rules_path() -> Path:
+    """Chemin du fichier de règles (lu à chaque appel : le .env est chargé après l'import)"""
+    return Path(os.environ.get("SCORING_RULES_PATH") or DEFAULT_RULES_PATH)
+
+
+def check_interval() -> float:
+    """Intervalle minimal (s) entre deux vérifications de la date de modification du fichier"""
+    return float(os.environ.get("SCORING_RULES_CHECK_INTERVAL", "2"))
+
+
+_rules: Optional[CompiledRules] = None
+_last_check = 0.0
+# Date de modification du fichier déjà traitée (chargé ou rejeté) : pas de nouvel essai avant modification
+_seen_mtime = None
+_lock = threading.Lock()
+
+
+def load_rules(path: Path = None) -> CompiledRules:
+    """Lit et compile le fichier de règles (lève une erreur si invalide)"""
+    path = Path(path or rules_path())
+    with open(path, "r", encoding="utf-8") as f:
+        rules = ScoringRules(**json.load(f))
+    return CompiledRules(rules)
+
+
+def reload_rules(path: Path = None, strict: bool = False) -> CompiledRules:
+    """Recharge le barème ; fichier invalide : l'ancien barème reste actif (erreur levée si strict)"""
+    global _rules, _seen_mtime
+    with _lock:
+        try:
+            _seen_mtime = Path(path or rules_path()).stat().st_mtime
+        except OSError:
+            pass
+        try:
+            compiled = load_rules(path)
+        except Exception as e:
+            if _rules is None or strict:
+                raise
+            logger.error(f"❌ Règles de scoring invalides, version {_rules.version} conservée: {e}")
+            return _rules
+        if _rules is None or compiled.version != _rules.version:
+            logger.info(f"🧮 Règles de scoring chargées: version {compiled.version}")
+        _rules = compiled
+        return _rules
+
+
+def get_rules() -> CompiledRules:
+    """Barème courant ; vérifie au plus toutes les check_interval() s si le fichier a changé"""
+    global _last_check
+    if _rules is None:
+        return reload_rules()
+    now = time.monotonic()
+    if now - _last_check >= check_interval():
+        _last_check = now
+        try:
+            if rules_path().stat().st_mtime != _seen_mtime:
+                return reload_rules()
+        except OSError:
+            pass
+    return _rules
+
+
+# ==================== CALCUL DU SCORING ====================
+
+class ScoreComponents:
+    """
+    Valeurs brutes du scoring (volumétrie, points par critère, scores sur 100), sans mise en forme :
+    partagées par calculate_scoring (formule et justification lisibles) et POST /score (saisie en cours)
+    """
+
+    __slots__ = (
+        "freq", "executions", "unit_hours", "people", "monthly_hours", "rules_points", "sources_points",
+        "complexity_points", "orga_points", "manual_points", "faisabilite", "urgence",
+        "faisabilite_normalized", "urgence_normalized",
+    )
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def score_components(
+    form_data: FormData,
+    total_sources: int,
+    complexity_category: str = "Standard",
+    rules: Optional[CompiledRules] = None,
+) -> ScoreComponents:
+    """
+    Points de faisabilité et d'urgence, gain de temps mensuel.
+    Q9 : texte "1j 2h 30min" (jour = day_hours du barème) ; à défaut, q9_total_hours (heures déjà calculées).
+    """
+    rules = rules or get_rules()
+    w = rules.weights
+    c = ScoreComponents()
+
+    # Q7 - Fréquence (jours par mois - valeur brute saisie)
+    try:
+        c.freq = float(form_data.q7 or 0)
+    except (ValueError, TypeError):
+        c.freq = 0
+
+    # Q8 - Nombre d'exécutions (valeur brute)
+    try:
+        c.executions = int(form_data.q8 or 0)
+    except ValueError:
+        c.executions = 0
+
+    # Q9 - Temps unitaire en heures
+    if form_data.q9 or form_data.q9_total_hours is None:
+        c.unit_hours = parse_time_to_hours(form_data.q9 or "", w.day_hours)
+    else:
+        c.unit_hours = max(form_data.q9_total_hours, 0)
+
+    # Q10 - Nombre de personnes (valeur brute saisie)
+    try:
+        c.people = int(form_data.q10 or 1)
+    except (ValueError, TypeError):
+        c.people = 1
+
+    # CALCUL DU GAIN DE TEMPS MENSUEL (heures) - Pour information uniquement (ETP)
+    # Gain total = fréquence × exécutions × temps unitaire (temps par personne) × nombre de personnes
+    c.monthly_hours = c.freq * c.executions * c.unit_hours * c.people
+
+    # FAISABILITÉ TECHNIQUE (0-faisabilite_max points)
+    # Q17 - Règles claires
+    c.rules_points = w.rules.get(form_data.q17, 0)
+    # Nombre TOTAL de sources (calculé par l'IA) : plus il y en a, plus c'est complexe à intégrer
+    c.sources_points = rules.sources_points(total_sources)
+    # Catégorie de complexité des sources (calculée par l'IA)
+    c.complexity_points = w.complexity_category.get(complexity_category, 0)
+    # Q19 - Complexité organisationnelle
+    c.orga_points = w.orga.get(form_data.q19, 0)
+    # Q15 - Action manuelle requise
+    c.manual_points = w.manual.get(form_data.q15, 0)
+    c.faisabilite = c.rules_points + c.sources_points + c.complexity_points + c.orga_points + c.manual_points
+
+    # URGENCE (0-urgence_max points)
+    try:
+        irritant = int(form_data.q11 or 0)
+        c.urgence = irritant * w.irritant_factor
+    except ValueError:
+        c.urgence = 0
+
+    # Convertir en base 100 pour l'affichage
+    c.faisabilite_normalized = round((c.faisabilite / w.faisabilite_max) * 100)
+    c.urgence_normalized = round((c.urgence / w.urgence_max) * 100)
+    return c
+
+
+def calculate_scoring(
+    form_data: FormData,
+    elements_count: int,
+    total_sources: int,
+    complexity_category: str = "Standard",
+    rules: Optional[CompiledRules] = None,
+) -> Scoring:
+    """
+    Calcule le scoring de manière déterministe côté backend.
+    Basé sur les réponses du formulaire + analyse IA (nombre et catégorie des sources).
+    """
+    rules = rules or get_rules()
+    w = rules.weights
+    c = score_components(form_data, total_sources, complexity_category, rules)
+
+    # Formule lisible
+    formula = (
+        f"Faisabilité[Règles({form_data.q17}={c.rules_points}) + "
+        f"NbSources({total_sources}={c.sources_points}pts) + "
+        f"CatégorieSources({complexity_category}={c.complexity_points}pts) + "
+        f"ComplexitéOrga({form_data.q19}={c.orga_points}) + "
+        f"ActionManuelle({form_data.q15}={c.manual_points}) = {c.faisabilite}/{w.faisabilite_max} = {c.faisabilite_normalized}/100] | "
+        f"Urgence[Irritant({form_data.q11}×{w.irritant_factor}) = {c.urgence}/{w.urgence_max} = {c.urgence_normalized}/100]"
+    )
+
+    justification = (
+        f"Faisabilité Technique {c.faisabilite_normalized}/100 "
+        f"({total_sources} sources ({elements_count} types) catégorie {complexity_category}, règles {form_data.q17 or 'non spécifié'}, "
+        f"complexité orga {form_data.q19 or 'non spécifié'}), "
+        f"Urgence {c.urgence_normalized}/100 (irritant {form_data.q11}/5). "
+        f"Gain de temps mensuel : {c.monthly_hours:.1f}h = {c.freq}j/mois × {c.executions} exécutions × "
+        f"{form_data.q9 or f'{c.unit_hours:g}h'} × {c.people} personnes = {c.monthly_hours/w.etp_hours:.1f} ETP."
+    )
+
+    return Scoring(
+        faisabilite_technique_score=f"{c.faisabilite_normalized}/100",
+        urgence_score=f"{c.urgence_normalized}/100",
+        formula=formula,
+        justification=justification,
+        # GAIN TEMPS MENSUEL (heures)
+        gain_temps_mensuel_heures=int(c.monthly_hours),
+        rules_version=rules.version
+    )
@@ -0,0 +1,430 @@
+"""
+État partagé entre workers (mode multi-worker / multi-nœud)
+Clés avec expiration, réservations atomiques, jetons de concurrence (baux expirants) et
+budgets à seaux de jetons, sur l'un des backends choisis par SHARED_STATE_URL :
+- vide (défaut) : en mémoire, propre au process (un seul worker)
+- sqlite:///shared_state.db : fichier SQLite partagé par les workers d'une même machine
+- redis://host:6379/0 : Redis (ou compatible), partagé entre machines (package redis requis)
+Appels bloquants (fichier, réseau) : depuis la boucle asyncio, passer par run_in_threadpool.
+"""
+import os
+import math
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+def _refill(tokens: List[float], updated: float, now: float, rates: List[float], capacities: List[float]) -> List[float]:
+    return [min(capacity, level + (now - updated) * rate) for level, rate, capacity in zip(tokens, rates, capacities)]
+
+
+def _consume(levels: List[float], costs: List[float], rates: List[float]) -> Tuple[List[float], float]:
+    """Prélève costs si tous les seaux le permettent : (niveaux, 0) ; sinon (niveaux inchangés, attente en s)"""
+    wait = max((cost - level) / rate if level < cost else 0.0 for level, cost, rate in zip(levels, costs, rates))
+    if wait > 0:
+        return levels, wait
+    return [level - cost for level, cost in zip(levels, costs)], 0.0
+
+
+# ==================== BACKENDS ====================
+
+class LocalState:
+    """État en mémoire du process : comportement d'un déploiement à un seul worker"""
+
+    distributed = False
+
+    def __init__(self):
+        self.name = "local"
+        self._lock = threading.Lock()
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._slots: Dict[str, Dict[str, float]] = {}
+        self._buckets: Dict[str, Tuple[List[float], float]] = {}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._values[key]
+                return None
+            return entry[0]
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def setdefault(self, key: str, value: str, ttl: Optional[float] = None) -> str:
+        """Écrit value si la clé est absente (ou expirée) ; retourne la valeur en place"""
+        now = time.time()
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                return entry[0]
+            self._values[key] = (value, now + ttl if ttl else None)
+            return value
+
+    def delete(self, key: str, value: Optional[str] = None):
+        """Supprime la clé (seulement si elle vaut encore value, quand value est fourni)"""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and (value is None or entry[0] == value):
+                del self._values[key]
+
+    def acquire_slot(self, name: str, limit: int, ttl: float) -> Optional[str]:
+        """Jeton parmi `limit` places (bail de ttl s, libéré par release_slot), None si tout est pris"""
+        now = time.time()
+        with self._lock:
+            slots = self._slots.setdefault(name, {})
+            for token in [t for t, expires in slots.items() if expires <= now]:
+                del slots[token]
+            if len(slots) >= limit:
+                return None
+            token = uuid.uuid4().hex
+            slots[token] = now + ttl
+            return token
+
+    def release_slot(self, name: str, token: str):
+        with self._lock:
+            self._slots.get(name, {}).pop(token, None)
+
+    def slot_count(self, name: str) -> int:
+        now = time.time()
+        with self._lock:
+            return sum(1 for expires in self._slots.get(name, {}).values() if expires > now)
+
+    def take(self, name: str, costs: List[float], rates: List[float], capacities: List[float]) -> float:
+        """
+        Seaux de jetons (un par dimension, ex. requêtes et tokens par seconde), prélevés ensemble :
+        0 si costs est accordé, sinon attente estimée (s) avant de réessayer.
+        """
+        now = time.time()
+        with self._lock:
+            levels, updated = self._buckets.get(name, (list(capacities), now))
+            levels, wait = _consume(_refill(levels, updated, now, rates, capacities), costs, rates)
+            self._buckets[name] = (levels, now)
+            return wait
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "distributed": self.distributed}
+
+
+class SQLiteState(LocalState):
+    """
+    État dans un fichier SQLite (WAL) partagé par les workers d'une machine : les opérations
+    de réservation se font dans une transaction BEGIN IMMEDIATE (un écrivain à la fois).
+    """
+
+    distributed = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS shared_values (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL);
+    CREATE TABLE IF NOT EXISTS shared_slots (name TEXT NOT NULL, token TEXT NOT NULL, expires_at REAL NOT NULL,
+                                             PRIMARY KEY (name, token));
+    CREATE TABLE IF NOT EXISTS shared_buckets (name TEXT PRIMARY KEY, levels TEXT NOT NULL, updated REAL NOT NULL);
+    """
+
+    def __init__(self, path: Path):
+        super().__init__()
+        self.path = Path(path)
+        self.name = f"sqlite:{self.path}"
+        self._local = threading.local()
+        self._writes = 0
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM shared_values WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO shared_values (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None),
+        )
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self._connect().execute("DELETE FROM shared_values WHERE expires_at <= ?", (time.time(),))
+
+    def setdefault(self, key: str, value: str, ttl: Optional[float] = None) -> str:
+        now = time.time()
+        conn = self._transaction()
+        try:
+            row = conn.execute(
+                "SELECT value FROM shared_values WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("INSERT OR REPLACE INTO shared_values (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, value, now + ttl if ttl else None))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else value
+
+    def delete(self, key: str, value: Optional[str] = None):
+        if value is None:
+            self._connect().execute("DELETE FROM shared_values WHERE key = ?", (key,))
+        else:
+            self._connect().execute("DELETE FROM shared_values WHERE key = ? AND value = ?", (key, value))
+
+    def acquire_slot(self, name: str, limit: int, ttl: float) -> Optional[str]:
+        now = time.time()
+        conn = self._transaction()
+        try:
+            conn.execute("DELETE FROM shared_slots WHERE name = ? AND expires_at <= ?", (name, now))
+            used = conn.execute("SELECT COUNT(*) FROM shared_slots WHERE name = ?", (name,)).fetchone()[0]
+            token = None
+            if used < limit:
+                token = uuid.uuid4().hex
+                conn.execute("INSERT INTO shared_slots (name, token, expires_at) VALUES (?, ?, ?)", (name, token, now + ttl))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return token
+
+    def release_slot(self, name: str, token: str):
+        self._connect().execute("DELETE FROM shared_slots WHERE name = ? AND token = ?", (name, token))
+
+    def slot_count(self, name: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM shared_slots WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()[0]
+
+    def take(self, name: str, costs: List[float], rates: List[float], capacities: List[float]) -> float:
+        now = time.time()
+        conn = self._transaction()
+        try:
+            row = conn.execute("SELECT levels, updated FROM shared_buckets WHERE name = ?", (name,)).fetchone()
+            levels, updated = ([float(v) for v in row[0].split(",")], row[1]) if row else (list(capacities), now)
+            if len(levels) != len(capacities):
+                levels = list(capacities)
+            levels, wait = _consume(_refill(levels, updated, now, rates, capacities), costs, rates)
+            conn.execute("INSERT OR REPLACE INTO shared_buckets (name, levels, updated) VALUES (?, ?, ?)",
+                         (name, ",".join(repr(v) for v in levels), now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+# Scripts Lua : chaque opération de réservation est atomique côté Redis (horloge du serveur)
+_NOW_LUA = "local t = redis.call('TIME'); local now = tonumber(t[1]) + tonumber(t[2]) / 1000000\n"
+
+_ACQUIRE_SLOT_LUA = _NOW_LUA + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then return 0 end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) * 1000) + 60000)
+return 1
+"""
+
+_TAKE_LUA = _NOW_LUA + """
+local n = #ARGV / 3
+local state = redis.call('HMGET', KEYS[1], 'levels', 'updated')
+local updated = tonumber(state[2]) or now
+local levels = {}
+local i = 1
+for v in string.gmatch(state[1] or '', '[^,]+') do levels[i] = tonumber(v); i = i + 1 end
+local wait = 0
+for k = 1, n do
+  local cost, rate, capacity = tonumber(ARGV[k]), tonumber(ARGV[n + k]), tonumber(ARGV[2 * n + k])
+  local level = math.min(capacity, (levels[k] or capacity) + (now - updated) * rate)
+  levels[k] = level
+  if level < cost then wait = math.max(wait, (cost - level) / rate) end
+end
+if wait == 0 then
+  for k = 1, n do levels[k] = levels[k] - tonumber(ARGV[k]) end
+end
+local parts = {}
+for k = 1, n do parts[k] = string.format('%.6f', levels[k]) end
+redis.call('HSET', KEYS[1], 'levels', table.concat(parts, ','), 'updated', string.format('%.6f', now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return string.format('%.6f', wait)
+"""
+
+_DELETE_IF_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RedisState(LocalState):
+    """État dans Redis (clés préfixées) : partagé par tous les workers de toutes les machines"""
+
+    distributed = True
+
+    def __init__(self, url: str, prefix: str = "cmform:"):
+        if redis is None:
+            raise RuntimeError("Package redis manquant (pip install redis) pour SHARED_STATE_URL=redis://")
+        super().__init__()
+        self.name = "redis"
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=5)
+        self._acquire_slot = self.client.register_script(_ACQUIRE_SLOT_LUA)
+        self._take = self.client.register_script(_TAKE_LUA)
+        self._delete_if = self.client.register_script(_DELETE_IF_LUA)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def setdefault(self, key: str, value: str, ttl: Optional[float] = None) -> str:
+        if self.client.set(self.prefix + key, value, nx=True, px=int(ttl * 1000) if ttl else None):
+            return value
+        # Clé expirée entre les deux appels : nouvel essai
+        return self.client.get(self.prefix + key) or self.setdefault(key, value, ttl)
+
+    def delete(self, key: str, value: Optional[str] = None):
+        if value is None:
+            self.client.delete(self.prefix + key)
+        else:
+            self._delete_if(keys=[self.prefix + key], args=[value])
+
+    def acquire_slot(self, name: str, limit: int, ttl: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        return token if self._acquire_slot(keys=[self.prefix + "slots:" + name], args=[limit, ttl, token]) else None
+
+    def release_slot(self, name: str, token: str):
+        self.client.zrem(self.prefix + "slots:" + name, token)
+
+    def slot_count(self, name: str) -> int:
+        return self.client.zcount(self.prefix + "slots:" + name, time.time(), "+inf")
+
+    def take(self, name: str, costs: List[float], rates: List[float], capacities: List[float]) -> float:
+        return float(self._take(keys=[self.prefix + "bucket:" + name], args=[*costs, *rates, *capacities]))
+
+
+def state_from_env():
+    """Backend de l'état partagé selon SHARED_STATE_URL (vide : en mémoire, un seul worker)"""
+    url = os.environ.get("SHARED_STATE_URL", "").strip()
+    if not url:
+        return LocalState()
+    if url.startswith("sqlite:///"):
+        return SQLiteState(Path(url[len("sqlite:///"):]))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url, prefix=os.environ.get("SHARED_STATE_PREFIX", "cmform:"))
+    raise RuntimeError(f"SHARED_STATE_URL non reconnu: {url} (attendu: sqlite:///chemin ou redis://hôte)")
+
+
+# ==================== CONTRÔLE D'ADMISSION ====================
+
+class AdmissionRejected(Exception):
+    """Budget de concurrence LLM épuisé : 429 avec Retry-After"""
+    status_code = 429
+
+    def __init__(self, retry_after: int, limit: int):
+        super().__init__(f"Trop d'analyses en cours ({limit} appels LLM simultanés), réessayer dans {retry_after}s")
+        self.retry_after = retry_after
+
+
+class LLMAdmission:
+    """
+    Nombre d'appels LLM simultanés borné (tous workers confondus avec un état partagé).
+    Au-delà : attente d'au plus max_wait s, puis AdmissionRejected au lieu d'une file sans limite.
+    Retry-After : durée moyenne d'un appel (moyenne mobile) divisée par le nombre de places,
+    soit l'intervalle moyen entre deux libérations.
+    """
+
+    def __init__(self, state, limit: int = 0, lease: float = 120.0, max_wait: float = 0.0):
+        self.state = state
+        self.limit = limit
+        self.lease = lease
+        self.max_wait = max_wait
+        self.rejected = 0
+        self._average = 10.0  # s, avant la première mesure
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def retry_after(self) -> int:
+        return int(min(60, max(1, math.ceil(self._average / self.limit))))
+
+    async def acquire(self) -> Optional[str]:
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while True:
+            token = await run_in_threadpool(self.state.acquire_slot, "llm", self.limit, self.lease)
+            if token is not None:
+                return token
+            if loop.time() >= deadline:
+                self.rejected += 1
+                metrics.ADMISSION_REJECTIONS.inc()
+                raise AdmissionRejected(self.retry_after(), self.limit)
+            await asyncio.sleep(min(0.05, max(0.0, deadline - loop.time())))
+
+    async def release(self, token: Optional[str], started: float):
+        if token is None:
+            return
+        self._average = 0.8 * self._average + 0.2 * (time.monotonic() - started)
+        await run_in_threadpool(self.state.release_slot, "llm", token)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Place réservée pendant le bloc (rien si LLM_MAX_CONCURRENCY=0)"""
+        token = await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            await self.release(token, started)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit or None,
+            "in_use": self.state.slot_count("llm") if self.enabled else None,
+            "rejected": self.rejected,
+            "max_wait_s": self.max_wait,
+            "retry_after_s": self.retry_after() if self.enabled else None,
+        }
+
+
+def admission_from_env(state, lease: float) -> LLMAdmission:
+    return LLMAdmission(
+        state,
+        limit=int(os.environ.get("LLM_MAX_CONCURRENCY", "0")),
+        lease=lease,
+        max_wait=float(os.environ.get("LLM_ADMISSION_WAIT", "0")),
+    )
@@ -0,0 +1,516 @@
+"""
+Use cases similaires (quasi-doublons) par embeddings
+- Texte indexé : brief (q5), exécution actuelle (q6) et éléments sources (q14)
+- Embeddings : locaux (hachage des mots et n-grammes de caractères, sans modèle ni réseau) ou
+  via le client LLM partagé (EMBEDDING_BACKEND=llm : API embeddings OpenAI, ou backend fake)
+- Index en mémoire : recherche exacte tant que l'index est petit, sinon IVF (k-means sur les
+  vecteurs, seules les SIMILARITY_NPROBE listes les plus proches sont parcourues)
+- Vecteurs persistés dans SQLite (use_case_embeddings) et ajoutés à chaque sauvegarde
+
+CLI (depuis backend/) :
+    python similarity.py build                   # embeddings manquants de toute l'archive
+    python similarity.py duplicates --min-score 0.9
+"""
+import os
+import re
+import sys
+import zlib
+import math
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+import llm
+from models import FormData
+from store import UseCaseStore, form_data_from_payload
+from token_budget import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+# Fenêtre (s) relue à chaque rafraîchissement de l'index (vecteurs déjà connus ignorés via leur hash)
+REFRESH_OVERLAP = 60
+
+# Champs décrivant le process (mêmes mots d'un département à l'autre)
+SIMILARITY_FIELDS = (("q5", "Besoin"), ("q6", "Exécution actuelle"), ("q14", "Sources"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def similarity_text(form_data: FormData) -> str:
+    """Texte indexé du formulaire ("" si aucun des champs n'est rempli)"""
+    parts = [f"{label}: {value.strip()}" for field, label in SIMILARITY_FIELDS
+             if (value := getattr(form_data, field, None)) and value.strip()]
+    return "\n".join(parts)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# ==================== EMBEDDINGS ====================
+
+class HashingEmbedder:
+    """
+    Embedding local : mots (sans accents ni mots vides, tronqués à 6 lettres pour rapprocher
+    les formes fléchies), paires de mots et trigrammes de caractères, projetés par hachage
+    signé dans `dim` dimensions. Poids sous-linéaires (1 + log tf), vecteur normalisé.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hash-v1-{dim}"
+
+    def _features(self, text: str) -> Dict[str, float]:
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        words = [w for w in _WORD_RE.findall(text) if len(w) > 2 and w not in STOPWORDS]
+        counts: Dict[str, float] = {}
+        for i, word in enumerate(words):
+            stem = word[:6]
+            counts["w:" + stem] = counts.get("w:" + stem, 0) + 1.0
+            if i:
+                pair = "p:" + words[i - 1][:6] + "_" + stem
+                counts[pair] = counts.get(pair, 0) + 0.5
+            padded = f" {word} "
+            for j in range(len(padded) - 2):
+                gram = "c:" + padded[j:j + 3]
+                counts[gram] = counts.get(gram, 0) + 0.25
+        return counts
+
+    def vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in self._features(text).items():
+            # crc32 : stable d'un process à l'autre (vecteurs persistés), contrairement à hash()
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count + 1.0))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return await run_in_threadpool(lambda: np.stack([self.vector(t) for t in texts]))
+
+
+class LLMEmbedder:
+    """Embeddings du fournisseur via le client LLM partagé (par paquets de EMBEDDING_BATCH textes)"""
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 512, batch_size: int = 256):
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.name = f"{model}@{dim}"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        client = llm.get_client()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            chunk = texts[start:start + self.batch_size]
+            response = await client.embeddings.create(model=self.model, input=chunk, dimensions=self.dim)
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        if not vectors:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+def embedder_from_env():
+    dim = int(os.environ.get("EMBEDDING_DIM", "512"))
+    if os.environ.get("EMBEDDING_BACKEND", "local").strip().lower() == "llm":
+        return LLMEmbedder(
+            model=os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small"),
+            dim=dim,
+            batch_size=int(os.environ.get("EMBEDDING_BATCH", "256")),
+        )
+    return HashingEmbedder(dim)
+
+
+# ==================== INDEX VECTORIEL ====================
+
+class VectorIndex:
+    """
+    Index cosinus (vecteurs normalisés, produit scalaire) avec ajout incrémental.
+    Sous ivf_min_size vecteurs : recherche exacte. Au-delà : IVF, ~sqrt(n) centroïdes appris par
+    k-means sphérique, chaque vecteur rangé dans la liste de son centroïde ; une requête ne
+    compare que les vecteurs des nprobe listes les plus proches. Réapprentissage quand la taille
+    a doublé depuis le dernier apprentissage.
+    """
+
+    def __init__(self, dim: int, ivf_min_size: int = 5000, nprobe: int = 8, seed: int = 0):
+        self.dim = dim
+        self.ivf_min_size = ivf_min_size
+        self.nprobe = nprobe
+        self.seed = seed
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._assignment: List[int] = []
+        self._trained_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def upsert_many(self, ids: List[str], vectors: np.ndarray):
+        with self._lock:
+            for use_case_id, vector in zip(ids, vectors):
+                self._upsert(use_case_id, vector)
+            if self._size >= self.ivf_min_size and self._size >= 2 * self._trained_size:
+                self._train()
+
+    def _upsert(self, use_case_id: str, vector: np.ndarray):
+        position = self.positions.get(use_case_id)
+        if position is None:
+            position = self._size
+            if position == len(self._vectors):
+                grown = np.zeros((max(1024, 2 * len(self._vectors)), self.dim), dtype=np.float32)
+                grown[:position] = self._vectors[:position]
+                self._vectors = grown
+            self.ids.append(use_case_id)
+            self.positions[use_case_id] = position
+            self._assignment.append(-1)
+            self._size += 1
+        self._vectors[position] = vector
+        if self._centroids is not None:
+            previous = self._assignment[position]
+            if previous >= 0:
+                self._lists[previous].remove(position)
+            cell = int(np.argmax(self._centroids @ vector))
+            self._lists[cell].append(position)
+            self._assignment[position] = cell
+
+    def _train(self, iterations: int = 10, sample: int = 50000):
+        vectors = self._vectors[:self._size]
+        k = max(2, int(math.sqrt(self._size)))
+        rng = np.random.default_rng(self.seed)
+        training = vectors[rng.choice(self._size, min(sample, self._size), replace=False)]
+        centroids = training[rng.choice(len(training), k, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(training @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, training)
+            empty = np.bincount(labels, minlength=k) == 0
+            # Centroïde vide : réinitialisé sur un vecteur au hasard
+            sums[empty] = training[rng.choice(len(training), int(empty.sum()))]
+            centroids = _normalize_rows(sums)
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        self._centroids = centroids
+        self._lists = [[] for _ in range(k)]
+        for position, cell in enumerate(labels.tolist()):
+            self._lists[cell].append(position)
+        self._assignment = labels.tolist()
+        self._trained_size = self._size
+        logger.info(f"🧭 Index de similarité : {k} listes IVF pour {self._size} use cases")
+
+    def search(self, vector: np.ndarray, k: int = 5, min_score: float = 0.0,
+               exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """(identifiant, similarité cosinus) des k plus proches, similarité >= min_score"""
+        with self._lock:
+            if not self._size:
+                return []
+            if self._centroids is None:
+                candidates = None
+                scores = self._vectors[:self._size] @ vector
+            else:
+                cells = np.argsort(-(self._centroids @ vector))[:self.nprobe]
+                candidates = np.fromiter((p for c in cells for p in self._lists[c]), dtype=np.int64)
+                scores = self._vectors[candidates] @ vector
+            if not len(scores):
+                return []
+            ids = self.ids
+            count = min(len(scores), k + 1)
+            top = np.argpartition(-scores, count - 1)[:count] if count < len(scores) else np.arange(len(scores))
+            results = []
+            for index in top[np.argsort(-scores[top])]:
+                position = int(index if candidates is None else candidates[index])
+                score = float(scores[index])
+                if score < min_score or ids[position] == exclude:
+                    continue
+                results.append((ids[position], score))
+            return results[:k]
+
+    def items(self):
+        """(identifiant, vecteur) de tous les use cases indexés"""
+        for position, use_case_id in enumerate(list(self.ids)):
+            yield use_case_id, self._vectors[position]
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "mode": "ivf" if self._centroids is not None else "exact",
+            "lists": len(self._lists),
+            "nprobe": self.nprobe if self._centroids is not None else None,
+        }
+
+
+# ==================== SERVICE ====================
+
+class SimilarityIndex:
+    """
+    Embeddings des use cases sauvegardés + index vectoriel, tenus à jour en tâche de fond :
+    au démarrage, vecteurs relus depuis SQLite puis calcul des manquants ; ensuite chaque
+    sauvegarde signalée par notify_saved() est (ré)indexée. La recherche répond pendant le rattrapage.
+    """
+
+    def __init__(self, store: UseCaseStore, embedder, min_score: float = 0.5, reuse_threshold: float = 0.0,
+                 ivf_min_size: int = 5000, nprobe: int = 8, batch_size: int = 64, refresh_interval: float = 0.0):
+        self.store = store
+        self.embedder = embedder
+        self.min_score = min_score
+        self.reuse_threshold = reuse_threshold
+        self.batch_size = batch_size
+        # Plusieurs workers : relecture périodique des vecteurs écrits par les autres (0 = jamais)
+        self.refresh_interval = refresh_interval
+        self._loaded_until: Optional[str] = None
+        self.index = VectorIndex(embedder.dim, ivf_min_size=ivf_min_size, nprobe=nprobe)
+        self._hashes: Dict[str, str] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.ready = False
+        self.indexed = 0
+
+    # ---------- Cycle de vie ----------
+
+    def start(self):
+        """Lance le chargement puis la mise à jour continue (dans la boucle du serveur)"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify_saved(self, use_case_id: str):
+        """Use case écrit (ou remplacé) : à (ré)indexer. Appelable depuis un thread."""
+        if self._loop is None or self._queue is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, use_case_id)
+        except RuntimeError:
+            pass  # boucle fermée (arrêt du serveur)
+
+    async def _run(self):
+        try:
+            await self.load()
+            await self.backfill()
+        except Exception as e:
+            logger.error(f"❌ Index de similarité : chargement interrompu ({type(e).__name__}: {e})")
+        self.ready = True
+        while True:
+            try:
+                ids = [await asyncio.wait_for(self._queue.get(), self.refresh_interval or None)]
+            except asyncio.TimeoutError:
+                try:
+                    await self.load()
+                except Exception as e:
+                    logger.warning(f"⚠️ Relecture de l'index de similarité en échec: {e}")
+                continue
+            while not self._queue.empty() and len(ids) < self.batch_size:
+                ids.append(self._queue.get_nowait())
+            try:
+                rows = await run_in_threadpool(lambda: [(i, self.store.get(i)) for i in dict.fromkeys(ids)])
+                await self._index_payloads([(i, p) for i, p in rows if p is not None])
+            except Exception as e:
+                logger.warning(f"⚠️ Indexation de similarité en échec ({len(ids)} use cases): {e}")
+
+    async def load(self) -> int:
+        """Relit les vecteurs calculés pour ce modèle d'embedding (ensuite : seulement les nouveaux)"""
+        def read():
+            ids, hashes, vectors = [], [], []
+            latest = since = self._loaded_until
+            if since is not None:
+                # Marge : une écriture d'un autre worker peut être validée après une plus récente
+                since = (datetime.fromisoformat(since) - timedelta(seconds=REFRESH_OVERLAP)).isoformat()
+            for use_case_id, hashed, blob, updated_at in self.store.iter_embeddings(
+                    self.embedder.name, updated_after=since):
+                if self._hashes.get(use_case_id) != hashed:
+                    ids.append(use_case_id)
+                    hashes.append(hashed)
+                    vectors.append(np.frombuffer(blob, dtype=np.float32))
+                latest = max(latest or updated_at, updated_at)
+            if ids:
+                self.index.upsert_many(ids, np.stack(vectors))
+            return ids, hashes, latest
+
+        first = self._loaded_until is None
+        ids, hashes, self._loaded_until = await run_in_threadpool(read)
+        self._hashes.update(zip(ids, hashes))
+        if ids and first:
+            logger.info(f"🧭 Index de similarité : {len(ids)} vecteurs chargés ({self.embedder.name})")
+        return len(ids)
+
+    async def backfill(self) -> int:
+        """Calcule les embeddings manquants (use cases importés, ou changement de modèle)"""
+        total = 0
+        pending: List[Tuple[str, dict]] = []
+        iterator = self.store.iter_missing_embeddings(self.embedder.name)
+        while True:
+            batch = await run_in_threadpool(lambda: [row for _, row in zip(range(self.batch_size * 8), iterator)])
+            pending.extend(batch)
+            if pending and (len(pending) >= self.batch_size * 8 or not batch):
+                total += await self._index_payloads(pending)
+                pending = []
+            if not batch:
+                break
+        if total:
+            logger.info(f"🧭 Index de similarité : {total} embeddings calculés ({self.embedder.name})")
+        return total
+
+    async def _index_payloads(self, rows: List[Tuple[str, dict]]) -> int:
+        """Embeddings des use cases dont le texte indexé a changé, puis écriture SQLite + index"""
+        todo = []
+        for use_case_id, payload in rows:
+            try:
+                text = similarity_text(form_data_from_payload(payload))
+            except Exception:
+                continue
+            hashed = text_hash(text)
+            if text and self._hashes.get(use_case_id) != hashed:
+                todo.append((use_case_id, hashed, text))
+        if not todo:
+            return 0
+        vectors = await self.embedder.embed([text for _, _, text in todo])
+        ids = [use_case_id for use_case_id, _, _ in todo]
+        await run_in_threadpool(
+            self.store.upsert_embeddings, self.embedder.name,
+            [(use_case_id, hashed, vector.astype(np.float32).tobytes()) for (use_case_id, hashed, _), vector in zip(todo, vectors)]
+        )
+        await run_in_threadpool(self.index.upsert_many, ids, vectors)
+        self._hashes.update((use_case_id, hashed) for use_case_id, hashed, _ in todo)
+        self.indexed += len(todo)
+        return len(todo)
+
+    # ---------- Recherche ----------
+
+    async def search(self, form_data: FormData, limit: int = 5, min_score: Optional[float] = None,
+                     exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        text = similarity_text(form_data)
+        if not text or not len(self.index):
+            return []
+        vector = (await self.embedder.embed([text]))[0]
+        threshold = self.min_score if min_score is None else min_score
+        return await run_in_threadpool(self.index.search, vector, limit, threshold, exclude)
+
+    async def similar(self, form_data: FormData, limit: int = 5, min_score: Optional[float] = None) -> List[dict]:
+        """Use cases existants les plus proches du formulaire (résumé + score), du plus proche au moins proche"""
+        matches = await self.search(form_data, limit, min_score)
+        summaries = await run_in_threadpool(self.store.summaries, [use_case_id for use_case_id, _ in matches])
+        return [{**summaries[use_case_id], "score": round(score, 3)}
+                for use_case_id, score in matches if use_case_id in summaries]
+
+    async def reusable(self, form_data: FormData) -> Optional[Tuple[str, float, dict]]:
+        """(identifiant, score, payload) du use case réutilisable (score >= reuse_threshold), sinon None"""
+        if self.reuse_threshold <= 0:
+            return None
+        matches = await self.search(form_data, 1, self.reuse_threshold)
+        if not matches:
+            return None
+        use_case_id, score = matches[0]
+        payload = await run_in_threadpool(self.store.get, use_case_id)
+        return (use_case_id, score, payload) if payload else None
+
+    def stats(self) -> dict:
+        return {
+            "embedder": self.embedder.name,
+            "ready": self.ready,
+            "indexed_since_start": self.indexed,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "min_score": self.min_score,
+            "reuse_threshold": self.reuse_threshold or None,
+            **self.index.stats(),
+        }
+
+
+def similarity_from_env(store: UseCaseStore) -> Optional[SimilarityIndex]:
+    """Index de similarité configuré par l'environnement, None si SIMILARITY_ENABLED=0"""
+    if os.environ.get("SIMILARITY_ENABLED", "1") in ("0", "false", "False"):
+        return None
+    return SimilarityIndex(
+        store,
+        embedder_from_env(),
+        min_score=float(os.environ.get("SIMILARITY_MIN_SCORE", "0.5")),
+        reuse_threshold=float(os.environ.get("SIMILARITY_REUSE_THRESHOLD", "0")),
+        ivf_min_size=int(os.environ.get("SIMILARITY_IVF_MIN_SIZE", "5000")),
+        nprobe=int(os.environ.get("SIMILARITY_NPROBE", "8")),
+        refresh_interval=float(os.environ.get("SIMILARITY_REFRESH_INTERVAL", "30")),
+    )
+
+
+# ==================== CLI ====================
+
+def duplicate_pairs(index: VectorIndex, min_score: float, limit: int) -> List[Tuple[str, str, float]]:
+    """Paires de use cases au-dessus du seuil (chaque paire une seule fois), les plus proches d'abord"""
+    pairs = []
+    for use_case_id, vector in index.items():
+        for other, score in index.search(vector, 5, min_score, exclude=use_case_id):
+            if use_case_id < other:
+                pairs.append((use_case_id, other, score))
+    pairs.sort(key=lambda pair: -pair[2])
+    return pairs[:limit]
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    from store import store_from_env
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Index de similarité des use cases (quasi-doublons)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="Calcule les embeddings manquants de l'archive")
+    duplicates = sub.add_parser("duplicates", help="Liste les paires de use cases quasi identiques")
+    duplicates.add_argument("--min-score", type=float, default=0.9)
+    duplicates.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    store = store_from_env()
+    service = similarity_from_env(store) or SimilarityIndex(store, embedder_from_env())
+
+    async def run() -> int:
+        try:
+            await service.load()
+            await service.backfill()
+            if args.command == "build":
+                logger.info(f"🧭 {len(service.index)} use cases indexés ({service.embedder.name})")
+                return 0
+            pairs = duplicate_pairs(service.index, args.min_score, args.limit)
+            summaries = store.summaries(list({i for pair in pairs for i in pair[:2]}))
+            for first, second, score in pairs:
+                a, b = summaries.get(first, {}), summaries.get(second, {})
+                print(f"{score:.3f}  {first} ({a.get('department') or '-'}: {a.get('project_name') or '-'})"
+                      f"  <->  {second} ({b.get('department') or '-'}: {b.get('project_name') or '-'})")
+            logger.info(f"🔁 {len(pairs)} paires au-dessus de {args.min_score}")
+            return 0
+        finally:
+            await llm.close_client()
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
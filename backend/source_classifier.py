@@ -0,0 +1,381 @@
+"""
+Pré-classification locale des éléments sources (q14), sans LLM
+Le scoring (faisabilité) ne dépend de l'IA que par elements_sources : nombre de types (count),
+nombre total de sources (total_sources) et complexity_level. Ce module les déduit du texte de q14 :
+- découpage de la liste (lignes, puces, virgules, "et") : une source par élément
+- catégorie (ElementCategory) par tables de mots-clés, puis correspondance approchée (fautes de frappe)
+- complexité de chaque source (ComplexityLevel) selon la grille du prompt ; niveau global = la plus élevée
+Résultats mis en cache par texte (lru_cache) : quelques microsecondes pour un q14 déjà vu.
+
+Utilisé par POST /score (scoring instantané pendant la saisie) et pour contrôler la section
+elements_sources de l'IA (taux d'accord sur /metrics et dans le log JSON).
+SOURCE_CLASSIFIER : "check" (défaut, contrôle seul), "local" (section de l'IA remplacée quand toutes
+les sources sont reconnues), "off".
+
+CLI (depuis backend/) :
+    python source_classifier.py classify "Excel GL, Excel OSB, SAP"
+    python source_classifier.py evaluate        # accord avec elements_sources de l'archive
+"""
+import os
+import re
+import sys
+import argparse
+import difflib
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from models import ComplexityLevel, ElementCategory
+
+MODES = ("check", "local", "off")
+
+# Séparateurs d'une liste de sources en texte libre : lignes (et ";"), puis virgules, "et", "+"
+_LINES_RE = re.compile(r"[\n;]+")
+_ITEMS_RE = re.compile(r",+|\s+(?:et|and|\+)\s+", re.IGNORECASE)
+_BULLET_CHARS = " .-*•–—>"
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Ordre croissant de complexité : le niveau global est celui de la source la plus complexe
+COMPLEXITY_ORDER = (
+    ComplexityLevel.STANDARD,
+    ComplexityLevel.INTERMEDIAIRE,
+    ComplexityLevel.COMPLEXE,
+    ComplexityLevel.NON_STANDARDISEE,
+)
+_COMPLEXITY_RANK = {level: rank for rank, level in enumerate(COMPLEXITY_ORDER)}
+
+
+# ==================== TABLES DE MOTS-CLÉS ====================
+
+# Mots-clés (minuscules, sans accents) par catégorie. Une source qui en cite plusieurs prend la
+# première catégorie de cette liste : le format du document prime sur le système d'origine
+# ("Export Excel de SAP" -> Excel, "Factures PDF reçues par mail" -> PDF).
+KEYWORDS: Tuple[Tuple[ElementCategory, Tuple[str, ...]], ...] = (
+    (ElementCategory.PDF, ("pdf", "pdfs")),
+    (ElementCategory.EXCEL, (
+        "excel", "xls", "xlsx", "xlsm", "csv", "tableur", "tableurs", "classeur", "classeurs",
+        "spreadsheet", "gsheet", "google sheets", "google sheet",
+    )),
+    (ElementCategory.WORD, ("word", "docx", "doc", "document word", "documents word")),
+    (ElementCategory.IMAGE, (
+        "image", "images", "photo", "photos", "jpg", "jpeg", "png", "tiff", "scan", "scans", "scanne",
+        "scannes", "scannee", "scannees", "capture d ecran", "captures d ecran", "screenshot", "screenshots",
+    )),
+    (ElementCategory.AUDIO, (
+        "audio", "audios", "vocal", "vocaux", "vocale", "enregistrement", "enregistrements", "appel",
+        "appels", "telephone", "telephonique", "telephoniques", "oral", "orale", "oraux", "conversation",
+        "conversations", "reunion", "reunions", "visio", "visioconference",
+    )),
+    (ElementCategory.PAPIER, (
+        "papier", "papiers", "courrier", "courriers", "fax", "manuscrit", "manuscrits", "manuscrite",
+        "manuscrites", "imprime", "imprimes", "impression", "bordereau", "bordereaux",
+    )),
+    (ElementCategory.FORMULAIRE, (
+        "formulaire", "formulaires", "form", "forms", "questionnaire", "questionnaires", "typeform",
+        "google forms", "google form", "sondage", "sondages",
+    )),
+    (ElementCategory.EMAIL, (
+        "email", "emails", "mail", "mails", "courriel", "courriels", "outlook", "gmail", "messagerie",
+        "boite mail", "boite aux lettres", "lotus notes",
+    )),
+    (ElementCategory.BDD, (
+        "bdd", "bd", "base de donnees", "bases de donnees", "base donnees", "database", "databases", "sql",
+        "mysql", "postgres", "postgresql", "sqlite", "mongodb", "access", "datawarehouse", "data warehouse",
+        "entrepot de donnees", "datalake", "data lake", "bigquery", "snowflake", "requete", "requetes",
+        "infocentre", "sql server",
+    )),
+    (ElementCategory.ERP_CRM, (
+        "erp", "crm", "sap", "salesforce", "sage", "dynamics", "navision", "hubspot", "netsuite", "workday",
+        "cegid", "odoo", "oracle", "divalto", "sirh", "zoho", "pipedrive", "coupa", "ariba", "concur",
+        "servicenow", "quickbooks", "pennylane", "logiciel comptable", "progiciel", "sylob", "qad", "jde",
+    )),
+    (ElementCategory.AUTRE, (
+        "api", "apis", "xml", "json", "log", "logs", "webservice", "webservices", "web service",
+        "web services", "extranet", "intranet", "site web", "portail", "sharepoint", "ftp", "sftp",
+    )),
+)
+
+# Complexité d'une source selon sa catégorie (grille "complexity_level" du prompt)
+CATEGORY_COMPLEXITY: Dict[ElementCategory, ComplexityLevel] = {
+    ElementCategory.EXCEL: ComplexityLevel.STANDARD,
+    ElementCategory.BDD: ComplexityLevel.STANDARD,
+    ElementCategory.ERP_CRM: ComplexityLevel.STANDARD,
+    ElementCategory.FORMULAIRE: ComplexityLevel.STANDARD,
+    ElementCategory.WORD: ComplexityLevel.INTERMEDIAIRE,
+    ElementCategory.AUTRE: ComplexityLevel.INTERMEDIAIRE,
+    ElementCategory.PDF: ComplexityLevel.COMPLEXE,
+    ElementCategory.IMAGE: ComplexityLevel.COMPLEXE,
+    ElementCategory.PAPIER: ComplexityLevel.COMPLEXE,
+    ElementCategory.AUDIO: ComplexityLevel.COMPLEXE,
+    ElementCategory.EMAIL: ComplexityLevel.NON_STANDARDISEE,
+}
+
+# Mots-clés dont la complexité diffère de celle de leur catégorie
+KEYWORD_COMPLEXITY: Dict[str, ComplexityLevel] = {
+    "json": ComplexityLevel.STANDARD,
+    "ftp": ComplexityLevel.STANDARD,
+    "sftp": ComplexityLevel.STANDARD,
+    "manuscrit": ComplexityLevel.NON_STANDARDISEE,
+    "manuscrits": ComplexityLevel.NON_STANDARDISEE,
+    "manuscrite": ComplexityLevel.NON_STANDARDISEE,
+    "manuscrites": ComplexityLevel.NON_STANDARDISEE,
+    "oral": ComplexityLevel.NON_STANDARDISEE,
+    "orale": ComplexityLevel.NON_STANDARDISEE,
+    "oraux": ComplexityLevel.NON_STANDARDISEE,
+    "conversation": ComplexityLevel.NON_STANDARDISEE,
+    "conversations": ComplexityLevel.NON_STANDARDISEE,
+    "reunion": ComplexityLevel.NON_STANDARDISEE,
+    "reunions": ComplexityLevel.NON_STANDARDISEE,
+    "appel": ComplexityLevel.NON_STANDARDISEE,
+    "appels": ComplexityLevel.NON_STANDARDISEE,
+}
+
+# Correspondance approchée : mots d'au moins FUZZY_MIN_LENGTH lettres, ressemblance >= FUZZY_CUTOFF
+# ("exel" -> excel, "outlok" -> outlook, "salesforse" -> salesforce)
+FUZZY_MIN_LENGTH = 4
+FUZZY_CUTOFF = 0.85
+
+
+def _compile_tables():
+    """Mots simples -> (rang de priorité, catégorie, mot-clé) ; expressions de plusieurs mots à part"""
+    words, phrases = {}, []
+    for rank, (category, keywords) in enumerate(KEYWORDS):
+        for keyword in keywords:
+            entry = (rank, category, keyword)
+            if " " in keyword:
+                phrases.append((f" {keyword} ", entry))
+            else:
+                words.setdefault(keyword, entry)
+    return words, tuple(phrases)
+
+
+_WORDS, _PHRASES = _compile_tables()
+# Vocabulaire de la correspondance approchée : mots-clés assez longs pour éviter les faux positifs
+_FUZZY_VOCABULARY = tuple(word for word in _WORDS if len(word) > FUZZY_MIN_LENGTH)
+
+
+def mode() -> str:
+    """SOURCE_CLASSIFIER : check (défaut), local ou off"""
+    value = os.environ.get("SOURCE_CLASSIFIER", "check").strip().lower()
+    return value if value in MODES else "check"
+
+
+def normalize(text: str) -> str:
+    """Minuscules sans accents ("Données" -> "donnees", "l’ERP" -> "l erp")"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def split_sources(text: Optional[str]) -> List[List[str]]:
+    """Éléments sources cités en q14, groupés par ligne (les éléments d'une même ligne se suivent)"""
+    if not text:
+        return []
+    lines = []
+    for line in _LINES_RE.split(text):
+        items = [item.strip(_BULLET_CHARS) for item in _ITEMS_RE.split(line)]
+        items = [item for item in items if item]
+        if items:
+            lines.append(items)
+    return lines
+
+
+@lru_cache(maxsize=4096)
+def _fuzzy_word(word: str) -> Optional[str]:
+    matches = difflib.get_close_matches(word, _FUZZY_VOCABULARY, n=1, cutoff=FUZZY_CUTOFF)
+    return matches[0] if matches else None
+
+
+def _match(item: str) -> Optional[Tuple[int, ElementCategory, str, str]]:
+    """(rang, catégorie, mot-clé, "keyword" | "fuzzy") de la catégorie prioritaire citée, ou None"""
+    words = _WORD_RE.findall(normalize(item))
+    best = None
+    for word in words:
+        entry = _WORDS.get(word)
+        if entry is not None and (best is None or entry[0] < best[0]):
+            best = entry
+    if _PHRASES:
+        joined = f" {' '.join(words)} "
+        for phrase, entry in _PHRASES:
+            if (best is None or entry[0] < best[0]) and phrase in joined:
+                best = entry
+    if best is not None:
+        return best + ("keyword",)
+    for word in words:
+        if len(word) >= FUZZY_MIN_LENGTH and not word.isdigit():
+            keyword = _fuzzy_word(word)
+            if keyword is not None:
+                entry = _WORDS[keyword]
+                if best is None or entry[0] < best[0]:
+                    best = entry
+    return best + ("fuzzy",) if best is not None else None
+
+
+# ==================== CLASSIFICATION ====================
+
+class ClassifiedSource:
+    """Une source de q14 : texte, catégorie, complexité et origine (keyword, fuzzy, inherited, default)"""
+
+    __slots__ = ("text", "category", "complexity", "matched_by", "keyword")
+
+    def __init__(self, text: str, category: ElementCategory, complexity: ComplexityLevel,
+                 matched_by: str, keyword: Optional[str] = None):
+        self.text = text
+        self.category = category
+        self.complexity = complexity
+        self.matched_by = matched_by
+        self.keyword = keyword
+
+    @property
+    def recognized(self) -> bool:
+        return self.matched_by != "default"
+
+
+class SourceClassification:
+    """Résultat pour un texte q14 (partagé via le cache : ne pas modifier, elements_sources() renvoie une copie)"""
+
+    def __init__(self, sources: Tuple[ClassifiedSource, ...]):
+        self.sources = sources
+        self.total_sources = len(sources)
+        self.categories = tuple(dict.fromkeys(s.category for s in sources))
+        self.count = len(self.categories)
+        levels = [s.complexity for s in sources]
+        self.complexity_level = max(levels, key=_COMPLEXITY_RANK.get) if levels else ComplexityLevel.STANDARD
+        self.recognized = sum(1 for s in sources if s.recognized)
+
+    @property
+    def confident(self) -> bool:
+        """Toutes les sources reconnues (aucune catégorie par défaut)"""
+        return self.total_sources > 0 and self.recognized == self.total_sources
+
+    def elements_sources(self) -> dict:
+        """Section elements_sources (même forme que la réponse de l'IA, types regroupés par catégorie)"""
+        descriptions: Dict[ElementCategory, List[str]] = {}
+        for source in self.sources:
+            descriptions.setdefault(source.category, []).append(source.text)
+        return {
+            "types": [{"category": category.value, "description": ", ".join(texts)}
+                      for category, texts in descriptions.items()],
+            "count": self.count,
+            "total_sources": self.total_sources,
+            "complexity_level": self.complexity_level.value,
+        }
+
+    def describe(self) -> dict:
+        return {
+            "count": self.count,
+            "total_sources": self.total_sources,
+            "complexity_level": self.complexity_level.value,
+            "confident": self.confident,
+            "sources": [{"text": s.text, "category": s.category.value, "complexity": s.complexity.value,
+                         "matched_by": s.matched_by} for s in self.sources],
+        }
+
+
+@lru_cache(maxsize=4096)
+def classify_sources(text: Optional[str]) -> SourceClassification:
+    """
+    Classe chaque source citée en q14. Un élément sans mot-clé prend la catégorie de l'élément
+    reconnu qui le précède sur la même ligne ("Excel GL, OSB" : deux sources Excel), sinon "Autre".
+    """
+    sources = []
+    for items in split_sources(text):
+        previous = None
+        for item in items:
+            match = _match(item)
+            if match is not None:
+                _, category, keyword, matched_by = match
+                complexity = KEYWORD_COMPLEXITY.get(keyword, CATEGORY_COMPLEXITY[category])
+                previous = ClassifiedSource(item, category, complexity, matched_by, keyword)
+                sources.append(previous)
+            elif previous is not None:
+                sources.append(ClassifiedSource(item, previous.category, previous.complexity, "inherited"))
+            else:
+                category = ElementCategory.AUTRE
+                sources.append(ClassifiedSource(item, category, CATEGORY_COMPLEXITY[category], "default"))
+    return SourceClassification(tuple(sources))
+
+
+# ==================== CONTRÔLE DE LA SECTION DE L'IA ====================
+
+# Champs comparés : ceux qui alimentent le scoring, plus l'ensemble des catégories
+AGREEMENT_FIELDS = ("count", "total_sources", "complexity_level", "categories", "faisabilite")
+
+
+def compare(local: SourceClassification, elements_sources: dict, rules=None) -> Dict[str, bool]:
+    """
+    Accord champ par champ entre la classification locale et la section elements_sources de l'IA.
+    faisabilite : mêmes points de faisabilité liés aux sources (nombre total + catégorie) avec le barème courant.
+    """
+    from scoring import get_rules
+
+    rules = rules or get_rules()
+    llm_total = elements_sources.get("total_sources", 0)
+    llm_level = elements_sources.get("complexity_level", ComplexityLevel.STANDARD.value)
+    llm_categories = {t.get("category") for t in elements_sources.get("types", []) if isinstance(t, dict)}
+    complexity_points = rules.weights.complexity_category
+
+    def source_points(total, level):
+        return rules.sources_points(total) + complexity_points.get(level, 0)
+
+    return {
+        "count": local.count == elements_sources.get("count", 0),
+        "total_sources": local.total_sources == llm_total,
+        "complexity_level": local.complexity_level.value == llm_level,
+        "categories": {c.value for c in local.categories} == llm_categories,
+        "faisabilite": source_points(local.total_sources, local.complexity_level.value) == source_points(llm_total, llm_level),
+    }
+
+
+# ==================== CLI ====================
+
+def _evaluate(store, limit: Optional[int] = None) -> dict:
+    """Taux d'accord sur les use cases archivés (q14 + elements_sources de l'IA)"""
+    from store import form_data_from_payload
+
+    agree, total, confident = Counter(), 0, 0
+    for _, payload in store.iter_payloads():
+        elements = (payload.get("ai_analysis") or {}).get("elements_sources")
+        q14 = form_data_from_payload(payload).q14
+        if not elements or not q14:
+            continue
+        local = classify_sources(q14)
+        confident += local.confident
+        for field, ok in compare(local, elements).items():
+            agree[field] += ok
+        total += 1
+        if limit and total >= limit:
+            break
+    return {
+        "use_cases": total,
+        "confident": round(confident / total, 3) if total else None,
+        "agreement": {field: round(agree[field] / total, 3) if total else None for field in AGREEMENT_FIELDS},
+    }
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    import json
+
+    parser = argparse.ArgumentParser(description="Pré-classification locale des éléments sources (q14)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    classify = sub.add_parser("classify", help="Classe un texte q14")
+    classify.add_argument("text")
+    evaluate = sub.add_parser("evaluate", help="Accord avec elements_sources des use cases archivés")
+    evaluate.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "classify":
+        print(json.dumps(classify_sources(args.text).describe(), indent=2, ensure_ascii=False))
+        return 0
+
+    from dotenv import load_dotenv
+    from store import store_from_env
+
+    load_dotenv()
+    report = _evaluate(store_from_env(), args.limit)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
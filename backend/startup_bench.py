@@ -0,0 +1,233 @@
+"""
+Benchmark du démarrage à froid : temps jusqu'à /health et /ready, première analyse, mémoire par worker
+Lance uvicorn plusieurs fois par mode de démarrage (STARTUP_MODE=eager / fast) et par backend LLM
+("fake" : local ; "openai" : clé factice, le client est construit mais aucun appel n'est fait).
+Chaque run mesure depuis le lancement du process :
+- health_s : port ouvert, /health répond (ce que voit un hébergeur sans sonde de disponibilité)
+- ready_s : /ready répond 200 (les versions sans /ready : /health fait foi)
+- first_analyze_ms : premier POST /analyze (backend fake uniquement)
+- rss_mb : mémoire résidente de chaque worker une fois prêt, puis après la première analyse
+et, à part, le temps d'import de main (python -c "import main").
+--backend-dir mesure une autre copie du backend (ex. un git worktree d'une révision précédente).
+
+Usage :
+    python startup_bench.py --runs 5
+    python startup_bench.py --backend-dir /tmp/cmform-old/backend --output bench_results/startup-old.json
+    python startup_bench.py --baseline bench_results/startup-old.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import statistics
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from loadtest import DEFAULT_OUTPUT_DIR, FORM, _free_port, _git_revision, sample_workers
+
+BACKEND_DIR = Path(__file__).parent
+MODES = ("eager", "fast")
+BACKENDS = ("fake", "openai")
+POLL_INTERVAL = 0.01
+
+# Métriques comparées à la baseline : plus bas = mieux
+COMPARED = ("import_s", "health_s", "ready_s", "rss_ready_mb")
+
+
+def _server_env(backend: str, mode: str, workdir: Path) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": backend,
+        "STARTUP_MODE": mode,
+        "FAKE_LLM_LATENCY_MS": "0",
+        "FAKE_LLM_JITTER_MS": "0",
+        "USE_CASES_DB": str(workdir / "startup.db"),
+        "ANALYSIS_CACHE_DIR": str(workdir / "cache"),
+        "LOG_FORMAT": "json",
+    })
+    if backend == "openai":
+        env.setdefault("OPENAI_API_KEY", "sk-startup-bench")
+    return env
+
+
+def measure_import(backend_dir: Path, env: dict) -> float:
+    """Temps d'import de main dans un process neuf (s)"""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=backend_dir, env=env,
+                         capture_output=True, text=True, timeout=60)
+    if out.returncode != 0:
+        raise RuntimeError(f"Import de main en échec : {out.stderr.strip()[-500:]}")
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+async def _poll(client: httpx.AsyncClient, url: str, proc: subprocess.Popen, started: float,
+                timeout: float, accept=(200,)) -> tuple:
+    """Premier code HTTP dans accept : (secondes depuis le lancement, code)"""
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté (code {proc.returncode})")
+        try:
+            response = await client.get(url, headers={"Connection": "close"})
+            if response.status_code in accept:
+                return time.perf_counter() - started, response.status_code
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(POLL_INTERVAL)
+    raise RuntimeError(f"{url} sans réponse après {timeout:.0f}s")
+
+
+async def run_once(backend_dir: Path, backend: str, mode: str, workers: int, timeout: float) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="startup-"))
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+    ]
+    log = open(workdir / "server.log", "w")
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=backend_dir, env=_server_env(backend, mode, workdir),
+                            stdout=log, stderr=subprocess.STDOUT)
+    result = {}
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            result["health_s"], _ = await _poll(client, f"{url}/health", proc, started, timeout)
+            ready_s, status = await _poll(client, f"{url}/ready", proc, started, timeout, accept=(200, 404))
+            result["ready_s"] = result["health_s"] if status == 404 else ready_s
+            result["rss_ready_mb"] = _max_rss(await sample_workers(client, url, 5, workers))
+            if backend == "fake":
+                start = time.perf_counter()
+                response = await client.post(f"{url}/analyze", json={"form_data": FORM})
+                result["first_analyze_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                result["first_analyze_status"] = response.status_code
+                result["rss_after_analyze_mb"] = _max_rss(await sample_workers(client, url, 5, workers))
+    except Exception:
+        print(f"❌ Journal du serveur : {workdir / 'server.log'}")
+        raise
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in result.items()}
+
+
+def _max_rss(workers: Dict[str, dict]) -> Optional[float]:
+    values = [w["rss_mb"] for w in workers.values() if w.get("rss_mb") is not None]
+    return max(values) if values else None
+
+
+def summarize(runs: List[dict]) -> dict:
+    """Médiane et minimum de chaque mesure numérique"""
+    summary = {}
+    for key in sorted({k for run in runs for k in run}):
+        values = [run[key] for run in runs if isinstance(run.get(key), (int, float))]
+        if values and not key.endswith("_status"):
+            summary[key] = {"median": round(statistics.median(values), 3), "min": round(min(values), 3)}
+    return summary
+
+
+def compare(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """Mesures (médianes) en hausse de plus de tolerance par rapport à la baseline"""
+    previous = {(r["backend"], r["mode"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = previous.get((r["backend"], r["mode"])) or previous.get((r["backend"], "eager"))
+        if old is None:
+            continue
+        for key in COMPARED:
+            before = old["summary"].get(key, {}).get("median")
+            after = r["summary"].get(key, {}).get("median")
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(f"{r['backend']}/{r['mode']} {key}: {before} -> {after}")
+    return regressions
+
+
+async def run(args) -> dict:
+    backend_dir = Path(args.backend_dir).resolve() if args.backend_dir else BACKEND_DIR
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = (set(modes) - set(MODES)) | (set(backends) - set(BACKENDS))
+    if unknown:
+        raise SystemExit(f"Valeurs inconnues: {', '.join(sorted(unknown))}")
+
+    results = []
+    for backend in backends:
+        for mode in modes:
+            workdir = Path(tempfile.mkdtemp(prefix="startup-import-"))
+            env = _server_env(backend, mode, workdir)
+            runs = []
+            for _ in range(args.runs):
+                run_result = await run_once(backend_dir, backend, mode, args.workers, args.timeout)
+                run_result["import_s"] = round(measure_import(backend_dir, env), 3)
+                runs.append(run_result)
+            shutil.rmtree(workdir, ignore_errors=True)
+            summary = summarize(runs)
+            results.append({"backend": backend, "mode": mode, "runs": runs, "summary": summary})
+            med = {k: v["median"] for k, v in summary.items()}
+            first = f"  1re analyse {med['first_analyze_ms']:>6.1f} ms" if "first_analyze_ms" in med else ""
+            print(
+                f"  {backend:<6} {mode:<5} import {med['import_s']:.2f}s  /health {med['health_s']:.2f}s  "
+                f"/ready {med['ready_s']:.2f}s  RSS {med.get('rss_ready_mb') or 0:.1f} Mo{first}"
+            )
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "backend_dir": str(backend_dir),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": args.workers,
+            "runs": args.runs,
+        },
+        "results": results,
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark du démarrage à froid (temps et mémoire par worker)")
+    parser.add_argument("--runs", type=int, default=5, help="Lancements par mode et par backend")
+    parser.add_argument("--modes", default="eager,fast", help="Modes de démarrage (STARTUP_MODE)")
+    parser.add_argument("--backends", default="fake,openai", help="Backends LLM (openai : clé factice, aucun appel)")
+    parser.add_argument("--workers", type=int, default=1, help="Workers uvicorn")
+    parser.add_argument("--backend-dir", help="Autre copie du backend à mesurer (défaut : ce dossier)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", type=Path, help="Fichier JSON (défaut: bench_results/startup-<date>.json)")
+    parser.add_argument("--baseline", type=Path, help="Résultats d'une version précédente à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Écart toléré avant régression (0.2 = 20 %%)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    output = args.output or DEFAULT_OUTPUT_DIR / f"startup-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Résultats: {output}")
+
+    if args.baseline:
+        regressions = compare(report["results"], json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        if regressions:
+            print(f"⚠️ {len(regressions)} régression(s) par rapport à {args.baseline}:")
+            for line in regressions:
+                print(f"   - {line}")
+            return 1
+        print(f"✅ Aucune régression par rapport à {args.baseline} (tolérance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,923 @@
+"""
+Stockage des use cases (SQLite en mode WAL)
+Même payload JSON qu'avant (metadata / form_data / ai_analysis), champs de metadata indexés
+
+Import unique des anciens fichiers JSON (depuis backend/):
+    python store.py import [use_cases/]
+"""
+import os
+import sys
+import json
+import uuid
+import base64
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from models import FormData, FormAnalysisResponse
+from scoring import get_rules
+
+logger = logging.getLogger(__name__)
+
+# Base d'un ETP : 7h/jour × 20 jours (anciens payloads sans etp ; sinon etp_hours du barème)
+ETP_HOURS = 140
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS use_cases (
+    id TEXT PRIMARY KEY,
+    saved_at TEXT NOT NULL,
+    project_name TEXT,
+    persona TEXT,
+    role TEXT,
+    department TEXT,
+    priority TEXT,
+    faisabilite INTEGER,
+    urgence INTEGER,
+    etp REAL,
+    rules_version TEXT,
+    analysis_key TEXT,
+    source_file TEXT UNIQUE,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_use_cases_saved_at ON use_cases(saved_at);
+CREATE INDEX IF NOT EXISTS idx_use_cases_department ON use_cases(department);
+CREATE INDEX IF NOT EXISTS idx_use_cases_priority ON use_cases(priority);
+CREATE INDEX IF NOT EXISTS idx_use_cases_faisabilite ON use_cases(faisabilite);
+CREATE INDEX IF NOT EXISTS idx_use_cases_urgence ON use_cases(urgence);
+CREATE INDEX IF NOT EXISTS idx_use_cases_etp ON use_cases(etp);
+-- Index de pagination (tri + id pour un curseur stable, NULL rangés en -1)
+CREATE INDEX IF NOT EXISTS idx_use_cases_sort_saved_at ON use_cases(saved_at, id);
+CREATE INDEX IF NOT EXISTS idx_use_cases_sort_etp ON use_cases(COALESCE(etp, -1), id);
+CREATE INDEX IF NOT EXISTS idx_use_cases_sort_urgence ON use_cases(COALESCE(urgence, -1), id);
+CREATE INDEX IF NOT EXISTS idx_use_cases_sort_faisabilite ON use_cases(COALESCE(faisabilite, -1), id);
+
+-- Agrégats du portefeuille, mis à jour dans la même transaction que chaque insertion
+CREATE TABLE IF NOT EXISTS use_case_stats (
+    department TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    etp_sum REAL NOT NULL DEFAULT 0,
+    faisabilite_sum INTEGER NOT NULL DEFAULT 0,
+    faisabilite_count INTEGER NOT NULL DEFAULT 0,
+    urgence_sum INTEGER NOT NULL DEFAULT 0,
+    urgence_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (department, priority)
+);
+
+-- Jobs batch fournisseur (analyses asynchrones en masse) et leurs formulaires
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    provider_batch_id TEXT,
+    status TEXT NOT NULL,
+    model TEXT,
+    prompt_version TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    item_count INTEGER NOT NULL,
+    succeeded INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    ingested_at TEXT,
+    ingesting_since TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_batch_jobs_status ON batch_jobs(status);
+CREATE TABLE IF NOT EXISTS batch_job_items (
+    job_id TEXT NOT NULL,
+    custom_id TEXT NOT NULL,
+    use_case_id TEXT,
+    form_data TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result_use_case_id TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, custom_id)
+);
+
+-- Analyses en tâche de fond (POST /analyze avec "background": true) : requête, état et résultat
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    request TEXT NOT NULL,
+    idempotency_key TEXT,
+    submit_key TEXT UNIQUE,
+    request_hash TEXT,
+    owner TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    use_case_id TEXT,
+    route TEXT,
+    error TEXT,
+    error_status INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status, updated_at);
+
+-- Embeddings des use cases (recherche de quasi-doublons), un vecteur par use case et par modèle
+CREATE TABLE IF NOT EXISTS use_case_embeddings (
+    use_case_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (model, use_case_id)
+);
+CREATE INDEX IF NOT EXISTS idx_use_case_embeddings_updated ON use_case_embeddings(model, updated_at);
+"""
+
+# Colonnes ajoutées après coup : (nom, type, index) pour migrer les bases existantes
+MIGRATIONS = [
+    ("use_cases", "rules_version", "TEXT", "CREATE INDEX IF NOT EXISTS idx_use_cases_rules_version ON use_cases(rules_version)"),
+    # Clé d'idempotence (formulaire normalisé, combiné à l'Idempotency-Key s'il est fourni) : une sauvegarde répétée remplace le use case
+    ("use_cases", "analysis_key", "TEXT", "CREATE UNIQUE INDEX IF NOT EXISTS idx_use_cases_analysis_key ON use_cases(analysis_key)"),
+    # Bail d'ingestion d'un job batch (un seul worker ingère les résultats)
+    ("batch_jobs", "ingesting_since", "TEXT", None),
+    # Empreinte de la requête d'un job : même Idempotency-Key avec une autre requête = 422
+    ("analysis_jobs", "request_hash", "TEXT", None),
+]
+
+# Incrément des agrégats pour un use case (department/priority NULL regroupés sous '')
+STATS_UPSERT = """
+INSERT INTO use_case_stats (department, priority, count, etp_sum,
+                            faisabilite_sum, faisabilite_count, urgence_sum, urgence_count)
+VALUES (COALESCE(:department, ''), COALESCE(:priority, ''), 1, COALESCE(:etp, 0),
+        COALESCE(:faisabilite, 0), :faisabilite IS NOT NULL, COALESCE(:urgence, 0), :urgence IS NOT NULL)
+ON CONFLICT (department, priority) DO UPDATE SET
+    count = count + 1,
+    etp_sum = etp_sum + excluded.etp_sum,
+    faisabilite_sum = faisabilite_sum + excluded.faisabilite_sum,
+    faisabilite_count = faisabilite_count + excluded.faisabilite_count,
+    urgence_sum = urgence_sum + excluded.urgence_sum,
+    urgence_count = urgence_count + excluded.urgence_count
+"""
+
+# Retrait d'un use case des agrégats (remplacement lors d'une sauvegarde répétée)
+STATS_REMOVE = """
+UPDATE use_case_stats SET
+    count = count - 1,
+    etp_sum = etp_sum - COALESCE(:etp, 0),
+    faisabilite_sum = faisabilite_sum - COALESCE(:faisabilite, 0),
+    faisabilite_count = faisabilite_count - (:faisabilite IS NOT NULL),
+    urgence_sum = urgence_sum - COALESCE(:urgence, 0),
+    urgence_count = urgence_count - (:urgence IS NOT NULL)
+WHERE department = COALESCE(:department, '') AND priority = COALESCE(:priority, '')
+"""
+
+# Colonnes de tri autorisées pour GET /use-cases -> expression SQL indexée
+SORT_EXPRESSIONS = {
+    "saved_at": "saved_at",
+    "etp": "COALESCE(etp, -1)",
+    "urgence": "COALESCE(urgence, -1)",
+    "faisabilite": "COALESCE(faisabilite, -1)",
+}
+
+# Colonnes retournées par le listing (sans le payload complet)
+SUMMARY_COLUMNS = "id, saved_at, project_name, persona, role, department, priority, faisabilite, urgence, etp, rules_version"
+
+
+def _score_value(score) -> Optional[int]:
+    """'83/100' -> 83 (None si absent ou illisible)"""
+    if score is None:
+        return None
+    try:
+        return int(str(score).split("/")[0])
+    except ValueError:
+        return None
+
+
+# ==================== FORMAT DU PAYLOAD ====================
+
+def readable_form_data(d: FormData) -> dict:
+    """Transformer les clés du formulaire en noms parlants"""
+    return {
+        "persona": {
+            "nom": d.q1,
+            "prenom": d.q2,
+            "role": d.q3,
+            "departement": d.q4
+        },
+        "contexte_besoin": {
+            "brief_utilisateur": d.q5,
+            "execution_actuelle": d.q6
+        },
+        "volumetrie": {
+            "frequence_besoin": d.q7,
+            "nb_executions_par_occurrence": d.q8,
+            "temps_execution_unitaire": d.q9,
+            "temps_execution_unitaire_heures": d.q9_total_hours,
+            "nb_personnes_executantes": d.q10,
+            "niveau_irritant": d.q11,
+            "pourquoi_irritant": d.q12,
+            "pourquoi_urgent": d.q13
+        },
+        "nature_tache": {
+            "elements_sources": d.q14,
+            "action_manuelle": d.q15,
+            "exemple_action_manuelle": d.q16,
+            "regles_simples_stables": d.q17,
+            "points_complexes_detailles": d.q18,
+            "complexite_organisationnelle": d.q19,
+            "outils_necessaires": d.q20
+        }
+    }
+
+
+def form_data_from_payload(payload: dict) -> FormData:
+    """Inverse de readable_form_data : reconstruit le FormData (q1-q20) d'un use case sauvegardé"""
+    f = payload.get("form_data", {})
+    persona = f.get("persona", {})
+    besoin = f.get("contexte_besoin", {})
+    volumetrie = f.get("volumetrie", {})
+    nature = f.get("nature_tache", {})
+    return FormData(
+        q1=persona.get("nom"),
+        q2=persona.get("prenom"),
+        q3=persona.get("role"),
+        q4=persona.get("departement"),
+        q5=besoin.get("brief_utilisateur"),
+        q6=besoin.get("execution_actuelle"),
+        q7=volumetrie.get("frequence_besoin"),
+        q8=volumetrie.get("nb_executions_par_occurrence"),
+        q9=volumetrie.get("temps_execution_unitaire"),
+        q9_total_hours=volumetrie.get("temps_execution_unitaire_heures"),
+        q10=volumetrie.get("nb_personnes_executantes"),
+        q11=volumetrie.get("niveau_irritant"),
+        q12=volumetrie.get("pourquoi_irritant"),
+        q13=volumetrie.get("pourquoi_urgent"),
+        q14=nature.get("elements_sources"),
+        q15=nature.get("action_manuelle"),
+        q16=nature.get("exemple_action_manuelle"),
+        q17=nature.get("regles_simples_stables"),
+        q18=nature.get("points_complexes_detailles"),
+        q19=nature.get("complexite_organisationnelle"),
+        q20=nature.get("outils_necessaires"),
+    )
+
+
+def build_payload(form_data: FormData, ai_analysis: FormAnalysisResponse, saved_at: Optional[datetime] = None,
+                  route: Optional[dict] = None) -> dict:
+    """
+    Construit le JSON complet d'un use case (metadata + formulaire lisible + analyse IA)
+    route : décision de routage de l'analyse (modèle, tentatives), ajoutée à metadata si fournie
+    """
+    d = form_data
+    now = saved_at or datetime.now()
+    etp_value = round(ai_analysis.scoring.gain_temps_mensuel_heures / get_rules().weights.etp_hours, 1)
+    payload = {
+        "metadata": {
+            "saved_at": now.isoformat(),
+            "project_name": ai_analysis.user_story.project_name,
+            "persona": f"{d.q1} {d.q2}",
+            "role": d.q3,
+            "department": d.q4,
+            "etp": etp_value,
+            "faisabilite": ai_analysis.scoring.faisabilite_technique_score,
+            "urgence": ai_analysis.scoring.urgence_score,
+            "priority": ai_analysis.analysis.priority.value,
+            "rules_version": ai_analysis.scoring.rules_version
+        },
+        "form_data": readable_form_data(d),
+        "ai_analysis": ai_analysis.model_dump(mode="json")
+    }
+    if route:
+        payload["metadata"]["routing"] = route
+    return payload
+
+
+def _index_columns(payload: dict) -> dict:
+    """Colonnes indexées extraites du payload (tolère les anciens formats de metadata)"""
+    metadata = payload.get("metadata", {})
+    scoring = payload.get("ai_analysis", {}).get("scoring", {})
+    etp = metadata.get("etp")
+    if etp is None and scoring.get("gain_temps_mensuel_heures") is not None:
+        etp = round(scoring["gain_temps_mensuel_heures"] / ETP_HOURS, 1)
+    return {
+        "saved_at": metadata.get("saved_at") or datetime.now().isoformat(),
+        "project_name": metadata.get("project_name"),
+        "persona": metadata.get("persona"),
+        "role": metadata.get("role"),
+        "department": metadata.get("department"),
+        "priority": metadata.get("priority") or payload.get("ai_analysis", {}).get("analysis", {}).get("priority"),
+        "faisabilite": _score_value(metadata.get("faisabilite", scoring.get("faisabilite_technique_score"))),
+        "urgence": _score_value(metadata.get("urgence", scoring.get("urgence_score"))),
+        "etp": etp,
+        "rules_version": metadata.get("rules_version") or scoring.get("rules_version"),
+    }
+
+
+def encode_cursor(sort_value, use_case_id: str) -> str:
+    raw = json.dumps([sort_value, use_case_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[object, str]:
+    try:
+        sort_value, use_case_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return sort_value, use_case_id
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Curseur invalide: {cursor}") from e
+
+
+# ==================== STORE ====================
+
+class UseCaseStore:
+    """
+    Use cases dans une base SQLite (WAL : lectures concurrentes pendant les écritures).
+    Une connexion par thread ; chaque écriture est une transaction atomique.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    self._migrate(conn)
+                    self._ensure_stats(conn)
+                    self._initialized = True
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Ajoute les colonnes manquantes (MIGRATIONS) à une base créée par une version antérieure"""
+        with conn:
+            for table, column, column_type, index_sql in MIGRATIONS:
+                existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                if index_sql:
+                    conn.execute(index_sql)
+
+    def _ensure_stats(self, conn: sqlite3.Connection):
+        """Reconstruit les agrégats si la table vient d'être créée sur une base existante"""
+        has_stats = conn.execute("SELECT 1 FROM use_case_stats LIMIT 1").fetchone()
+        has_cases = conn.execute("SELECT 1 FROM use_cases LIMIT 1").fetchone()
+        if has_cases and not has_stats:
+            self.rebuild_stats(conn)
+
+    def rebuild_stats(self, conn: Optional[sqlite3.Connection] = None):
+        """Recalcule entièrement use_case_stats depuis use_cases"""
+        conn = conn or self._connect()
+        with conn:
+            conn.execute("DELETE FROM use_case_stats")
+            conn.execute(
+                """
+                INSERT INTO use_case_stats
+                SELECT COALESCE(department, ''), COALESCE(priority, ''), COUNT(*), COALESCE(SUM(etp), 0),
+                       COALESCE(SUM(faisabilite), 0), COUNT(faisabilite),
+                       COALESCE(SUM(urgence), 0), COUNT(urgence)
+                FROM use_cases
+                GROUP BY COALESCE(department, ''), COALESCE(priority, '')
+                """
+            )
+
+    def insert(
+        self,
+        payload: dict,
+        use_case_id: Optional[str] = None,
+        source_file: Optional[str] = None,
+        analysis_key: Optional[str] = None,
+        replace: bool = False,
+    ) -> str:
+        """
+        Enregistre un use case et retourne son identifiant unique.
+        Si analysis_key correspond déjà à un use case, celui-ci est remplacé (même identifiant).
+        replace=True : le use case use_case_id existant est remplacé (ré-analyse d'un use case archivé) ;
+        analysis_key n'est alors enregistrée que si aucun autre use case ne la porte.
+        """
+        columns = _index_columns(payload)
+        conn = self._connect()
+        with conn:
+            # Verrou d'écriture dès la lecture de la clé : deux sauvegardes identiques simultanées
+            # sont sérialisées (la seconde voit la première et la remplace, sans violer l'unicité)
+            conn.execute("BEGIN IMMEDIATE")
+            if replace and use_case_id is not None:
+                # Ré-analyse d'un use case archivé : même identifiant, fichier source conservé
+                existing = conn.execute(
+                    "SELECT id, department, priority, etp, faisabilite, urgence, source_file FROM use_cases WHERE id = ?",
+                    (use_case_id,),
+                ).fetchone()
+                if existing is not None:
+                    source_file = source_file or existing["source_file"]
+                    conn.execute(STATS_REMOVE, dict(existing))
+                    conn.execute("DELETE FROM use_cases WHERE id = ?", (use_case_id,))
+                # Clé déjà portée par un autre use case (formulaire en double dans l'archive) : pas de fusion
+                if analysis_key is not None and conn.execute(
+                    "SELECT 1 FROM use_cases WHERE analysis_key = ?", (analysis_key,)
+                ).fetchone():
+                    analysis_key = None
+            elif analysis_key is not None:
+                existing = conn.execute(
+                    "SELECT id, department, priority, etp, faisabilite, urgence FROM use_cases WHERE analysis_key = ?",
+                    (analysis_key,),
+                ).fetchone()
+                if existing is not None:
+                    # Supprimer puis réinsérer : nouveau rowid, donc fingerprint() voit le changement
+                    use_case_id = existing["id"]
+                    conn.execute(STATS_REMOVE, dict(existing))
+                    conn.execute("DELETE FROM use_cases WHERE id = ?", (use_case_id,))
+            use_case_id = use_case_id or uuid.uuid4().hex
+            conn.execute(
+                """
+                INSERT INTO use_cases (id, saved_at, project_name, persona, role, department, priority,
+                                       faisabilite, urgence, etp, rules_version, analysis_key, source_file, payload)
+                VALUES (:id, :saved_at, :project_name, :persona, :role, :department, :priority,
+                        :faisabilite, :urgence, :etp, :rules_version, :analysis_key, :source_file, :payload)
+                """,
+                {
+                    **columns,
+                    "id": use_case_id,
+                    "analysis_key": analysis_key,
+                    "source_file": source_file,
+                    "payload": json.dumps(payload, ensure_ascii=False),
+                },
+            )
+            conn.execute(STATS_UPSERT, columns)
+        return use_case_id
+
+    def find_by_analysis_key(self, analysis_key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT id FROM use_cases WHERE analysis_key = ?", (analysis_key,)
+        ).fetchone()
+        return row["id"] if row else None
+
+    def get(self, use_case_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT payload FROM use_cases WHERE id = ?", (use_case_id,)
+        ).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM use_cases").fetchone()[0]
+
+    def fingerprint(self) -> Tuple[int, int]:
+        """(nombre de use cases, dernier rowid) : change à chaque insertion"""
+        row = self._connect().execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM use_cases").fetchone()
+        return row[0], row[1]
+
+    def count_by_rules_version(self) -> dict:
+        """Nombre de use cases par version du barème de scoring (None : antérieurs au versionnage)"""
+        rows = self._connect().execute(
+            "SELECT rules_version, COUNT(*) FROM use_cases GROUP BY rules_version"
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def count_stale(self, rules_version: str) -> int:
+        """Use cases scorés avec une autre version du barème (ou sans version)"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM use_cases WHERE rules_version IS NOT ?", (rules_version,)
+        ).fetchone()[0]
+
+    def iter_payloads(self, batch_size: int = 1000):
+        """Parcourt (id, payload) de tous les use cases, par paquets"""
+        cursor = self._connect().execute("SELECT id, payload FROM use_cases ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row["id"], json.loads(row["payload"])
+
+    def iter_rows_since(self, last_rowid: int = 0, batch_size: int = 1000):
+        """
+        Parcourt (rowid, id, payload) des use cases écrits après last_rowid, par paquets.
+        Un use case remplacé est réinséré (nouveau rowid) : il réapparaît ici avec sa dernière version.
+        """
+        while True:
+            rows = self._connect().execute(
+                "SELECT rowid, id, payload FROM use_cases WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1]["rowid"]
+            for row in rows:
+                yield row["rowid"], row["id"], json.loads(row["payload"])
+
+    def summaries(self, ids: List[str]) -> Dict[str, dict]:
+        """Résumés (colonnes du listing) des use cases demandés, par identifiant"""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" for _ in ids)
+        rows = self._connect().execute(
+            f"SELECT {SUMMARY_COLUMNS} FROM use_cases WHERE id IN ({placeholders})", list(ids)
+        ).fetchall()
+        return {row["id"]: dict(row) for row in rows}
+
+    # ---------- Embeddings (quasi-doublons) ----------
+
+    def upsert_embeddings(self, model: str, rows: List[Tuple[str, str, bytes]]):
+        """Enregistre (use_case_id, hash du texte, vecteur) pour ce modèle d'embedding"""
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO use_case_embeddings (use_case_id, model, text_hash, vector, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (model, use_case_id) DO UPDATE SET
+                    text_hash = excluded.text_hash, vector = excluded.vector, updated_at = excluded.updated_at
+                """,
+                [(use_case_id, model, text_hash, vector, now) for use_case_id, text_hash, vector in rows],
+            )
+
+    def iter_embeddings(self, model: str, batch_size: int = 5000, updated_after: Optional[str] = None):
+        """
+        Parcourt (use_case_id, text_hash, vecteur, updated_at) des use cases existants pour ce modèle
+        (seulement les vecteurs écrits après updated_after s'il est fourni : autres workers)
+        """
+        cursor = self._connect().execute(
+            """
+            SELECT e.use_case_id, e.text_hash, e.vector, e.updated_at FROM use_case_embeddings e
+            JOIN use_cases u ON u.id = e.use_case_id
+            WHERE e.model = ? AND e.updated_at > ?
+            """,
+            (model, updated_after or ""),
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row["use_case_id"], row["text_hash"], row["vector"], row["updated_at"]
+
+    def iter_missing_embeddings(self, model: str, batch_size: int = 500):
+        """Parcourt (id, payload) des use cases sans embedding pour ce modèle (une seule passe)"""
+        last_rowid = 0
+        while True:
+            rows = self._connect().execute(
+                """
+                SELECT u.rowid, u.id, u.payload FROM use_cases u
+                LEFT JOIN use_case_embeddings e ON e.use_case_id = u.id AND e.model = ?
+                WHERE e.use_case_id IS NULL AND u.rowid > ?
+                ORDER BY u.rowid LIMIT ?
+                """,
+                (model, last_rowid, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1]["rowid"]
+            for row in rows:
+                yield row["id"], json.loads(row["payload"])
+
+    # ---------- Jobs batch fournisseur ----------
+
+    def create_batch_job(self, job: dict, items: List[Tuple[str, Optional[str], FormData]]):
+        """Enregistre un job et ses formulaires (custom_id, use case ré-analysé ou None, FormData)"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO batch_jobs (id, provider, provider_batch_id, status, model, prompt_version,
+                                        created_at, updated_at, item_count)
+                VALUES (:id, :provider, :provider_batch_id, :status, :model, :prompt_version,
+                        :created_at, :updated_at, :item_count)
+                """,
+                job,
+            )
+            conn.executemany(
+                "INSERT INTO batch_job_items (job_id, custom_id, use_case_id, form_data) VALUES (?, ?, ?, ?)",
+                [(job["id"], custom_id, use_case_id, form_data.model_dump_json()) for custom_id, use_case_id, form_data in items],
+            )
+
+    def update_batch_job(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        assignments = ", ".join(f"{column} = :{column}" for column in fields)
+        conn = self._connect()
+        with conn:
+            conn.execute(f"UPDATE batch_jobs SET {assignments} WHERE id = :id", {**fields, "id": job_id})
+
+    def claim_batch_ingestion(self, job_id: str, stale_before: str) -> bool:
+        """
+        Réserve l'ingestion d'un job terminé pour ce worker : False si elle est déjà faite, ou en cours
+        ailleurs avec un bail plus récent que stale_before (worker arrêté en cours d'ingestion : bail repris)
+        """
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                """
+                UPDATE batch_jobs SET ingesting_since = ?, updated_at = ?
+                WHERE id = ? AND ingested_at IS NULL AND (ingesting_since IS NULL OR ingesting_since < ?)
+                """,
+                (now, now, job_id, stale_before),
+            )
+        return cursor.rowcount == 1
+
+    def renew_batch_ingestion(self, job_id: str):
+        """Prolonge le bail d'ingestion (gros jobs)"""
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE batch_jobs SET ingesting_since = ? WHERE id = ? AND ingested_at IS NULL",
+                         (datetime.now().isoformat(), job_id))
+
+    def batch_item_counts(self, job_id: str) -> Dict[str, int]:
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) AS n FROM batch_job_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def get_batch_job(self, job_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_batch_jobs(self, statuses: Optional[List[str]] = None, limit: int = 100) -> List[dict]:
+        sql, params = "SELECT * FROM batch_jobs", []
+        if statuses:
+            sql += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+
+    def batch_job_items(self, job_id: str, status: Optional[str] = None) -> List[dict]:
+        sql, params = "SELECT * FROM batch_job_items WHERE job_id = ?", [job_id]
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        return [dict(row) for row in self._connect().execute(sql + " ORDER BY custom_id", params).fetchall()]
+
+    def update_batch_item(self, job_id: str, custom_id: str, status: str,
+                          result_use_case_id: Optional[str] = None, error: Optional[str] = None):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE batch_job_items SET status = ?, result_use_case_id = ?, error = ? WHERE job_id = ? AND custom_id = ?",
+                (status, result_use_case_id, error, job_id, custom_id),
+            )
+
+    # ---------- Analyses en tâche de fond ----------
+
+    def create_analysis_job(self, job: dict) -> str:
+        """
+        Enregistre un job en attente ; même submit_key (Idempotency-Key) qu'un job existant :
+        rien n'est créé, l'identifiant existant est retourné
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO analysis_jobs (id, status, priority, request, idempotency_key, submit_key,
+                                           request_hash, owner, created_at, updated_at)
+                VALUES (:id, :status, :priority, :request, :idempotency_key, :submit_key,
+                        :request_hash, :owner, :created_at, :updated_at)
+                ON CONFLICT (submit_key) DO NOTHING
+                """,
+                job,
+            )
+        return job["id"] if job["submit_key"] is None else self.find_analysis_job(job["submit_key"])
+
+    def find_analysis_job(self, submit_key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT id FROM analysis_jobs WHERE submit_key = ?", (submit_key,)).fetchone()
+        return row["id"] if row else None
+
+    def update_analysis_job(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        assignments = ", ".join(f"{column} = :{column}" for column in fields)
+        conn = self._connect()
+        with conn:
+            conn.execute(f"UPDATE analysis_jobs SET {assignments} WHERE id = :id", {**fields, "id": job_id})
+
+    def get_analysis_job(self, job_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_analysis_jobs(self, statuses: Optional[List[str]] = None, limit: int = 100) -> List[dict]:
+        """Jobs les plus récents, sans requête ni résultat"""
+        sql = ("SELECT id, status, priority, created_at, updated_at, started_at, finished_at, attempts, "
+               "use_case_id, error, error_status FROM analysis_jobs")
+        params: list = []
+        if statuses:
+            sql += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+
+    def claim_analysis_job(self, job_id: str, owner: str) -> bool:
+        """Passe un job en attente à running pour ce process ; False s'il a été pris, annulé ou repris ailleurs"""
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                """
+                UPDATE analysis_jobs SET status = 'running', started_at = ?, updated_at = ?, attempts = attempts + 1
+                WHERE id = ? AND status = 'queued' AND owner = ?
+                """,
+                (now, now, job_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def cancel_analysis_job(self, job_id: str) -> bool:
+        """Annule un job encore en attente"""
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE analysis_jobs SET status = 'cancelled', finished_at = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+                (now, now, job_id),
+            )
+        return cursor.rowcount == 1
+
+    def adopt_analysis_jobs(self, owner: str, stale_before: str, limit: int) -> List[dict]:
+        """
+        Reprend les jobs orphelins : en attente sans propriétaire (arrêt propre d'un worker),
+        ou en attente / en cours sans signe de vie depuis stale_before (worker arrêté brutalement).
+        Retourne les jobs repris (id, priority, created_at), plus anciens d'abord.
+        """
+        conn = self._connect()
+        candidates = conn.execute(
+            """
+            SELECT id, priority, created_at, updated_at FROM analysis_jobs
+            WHERE (status = 'queued' AND (owner IS NULL OR updated_at < ?)) OR (status = 'running' AND updated_at < ?)
+            ORDER BY created_at LIMIT ?
+            """,
+            (stale_before, stale_before, limit),
+        ).fetchall()
+        adopted = []
+        now = datetime.now().isoformat()
+        with conn:
+            for row in candidates:
+                # Condition sur updated_at : un autre process qui l'a repris entre-temps l'a modifié
+                cursor = conn.execute(
+                    "UPDATE analysis_jobs SET status = 'queued', owner = ?, updated_at = ? WHERE id = ? AND updated_at = ?",
+                    (owner, now, row["id"], row["updated_at"]),
+                )
+                if cursor.rowcount == 1:
+                    adopted.append({"id": row["id"], "priority": row["priority"], "created_at": row["created_at"]})
+        return adopted
+
+    def release_analysis_jobs(self, owner: str) -> int:
+        """Arrêt du process : ses jobs en attente ou interrompus repassent sans propriétaire (repris ailleurs ou au redémarrage)"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                """
+                UPDATE analysis_jobs SET status = 'queued', owner = NULL, updated_at = ?
+                WHERE owner = ? AND status IN ('queued', 'running')
+                """,
+                (datetime.now().isoformat(), owner),
+            )
+        return cursor.rowcount
+
+    def purge_analysis_jobs(self, finished_before: str) -> int:
+        """Supprime les jobs terminés avant cette date (résultats conservés dans use_cases si persist)"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM analysis_jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+                (finished_before,),
+            )
+        return cursor.rowcount
+
+    # ---------- Lecture : listing paginé ----------
+
+    def list(
+        self,
+        filters: Optional[dict] = None,
+        sort: str = "saved_at",
+        descending: bool = True,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Liste paginée par curseur (keyset sur tri + id) : coût constant quelle que soit la page.
+        filters : department, priority, role, rules_version (égalité) ; <col>_min / <col>_max pour
+        faisabilite, urgence, etp ; saved_from / saved_to (ISO).
+        Retourne (use cases résumés, curseur de la page suivante ou None).
+        """
+        if sort not in SORT_EXPRESSIONS:
+            raise ValueError(f"Tri inconnu: {sort} (autorisés: {', '.join(SORT_EXPRESSIONS)})")
+        sort_expr = SORT_EXPRESSIONS[sort]
+        where, params = [], []
+        for column in ("department", "priority", "role", "rules_version"):
+            value = (filters or {}).get(column)
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        for column in ("faisabilite", "urgence", "etp"):
+            low = (filters or {}).get(f"{column}_min")
+            high = (filters or {}).get(f"{column}_max")
+            if low is not None:
+                where.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                where.append(f"{column} <= ?")
+                params.append(high)
+        if (filters or {}).get("saved_from"):
+            where.append("saved_at >= ?")
+            params.append(filters["saved_from"])
+        if (filters or {}).get("saved_to"):
+            where.append("saved_at <= ?")
+            params.append(filters["saved_to"])
+        if cursor:
+            last_value, last_id = decode_cursor(cursor)
+            op = "<" if descending else ">"
+            where.append(f"({sort_expr}, id) {op} (?, ?)")
+            params.extend([last_value, last_id])
+
+        direction = "DESC" if descending else "ASC"
+        sql = f"SELECT {SUMMARY_COLUMNS}, {sort_expr} AS sort_value FROM use_cases"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort_expr} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._connect().execute(sql, params).fetchall()
+        items = [{k: row[k] for k in row.keys() if k != "sort_value"} for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last["sort_value"], last["id"])
+        return items, next_cursor
+
+    # ---------- Lecture : agrégats ----------
+
+    def stats(self) -> dict:
+        """
+        Agrégats du portefeuille par département et par priorité, lus dans use_case_stats
+        (quelques dizaines de lignes, quel que soit le nombre de use cases).
+        """
+        rows = [dict(r) for r in self._connect().execute("SELECT * FROM use_case_stats WHERE count > 0").fetchall()]
+
+        def summarize(group: List[dict]) -> dict:
+            count = sum(r["count"] for r in group)
+            faisabilite_count = sum(r["faisabilite_count"] for r in group)
+            urgence_count = sum(r["urgence_count"] for r in group)
+            return {
+                "count": count,
+                "etp_total": round(sum(r["etp_sum"] for r in group), 1),
+                "faisabilite_moyenne": round(sum(r["faisabilite_sum"] for r in group) / faisabilite_count, 1) if faisabilite_count else None,
+                "urgence_moyenne": round(sum(r["urgence_sum"] for r in group) / urgence_count, 1) if urgence_count else None,
+            }
+
+        def group_by(key: str) -> dict:
+            groups = {}
+            for r in rows:
+                groups.setdefault(r[key] or "Non renseigné", []).append(r)
+            return {name: summarize(group) for name, group in sorted(groups.items())}
+
+        by_department_priority = {}
+        for r in rows:
+            by_department_priority.setdefault(r["department"] or "Non renseigné", {})[r["priority"] or "Non renseigné"] = summarize([r])
+
+        return {
+            "total": summarize(rows),
+            "by_department": group_by("department"),
+            "by_priority": group_by("priority"),
+            "by_department_priority": by_department_priority,
+        }
+
+    def import_json_dir(self, directory: Path) -> Tuple[int, int]:
+        """
+        Import unique des fichiers use_cases/*.json (un use case par fichier).
+        Idempotent : un fichier déjà importé (même nom) est ignoré.
+        """
+        imported = skipped = 0
+        for file in sorted(Path(directory).glob("*.json")):
+            try:
+                with open(file, "r", encoding="utf-8") as f:
+                    payload = json.load(f)
+                self.insert(payload, source_file=file.name)
+                imported += 1
+            except sqlite3.IntegrityError:
+                skipped += 1
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Fichier ignoré ({file.name}): {e}")
+                skipped += 1
+        return imported, skipped
+
+
+def store_from_env() -> UseCaseStore:
+    path = os.environ.get("USE_CASES_DB") or str(Path(__file__).parent / "use_cases.db")
+    return UseCaseStore(Path(path))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: python store.py import [dossier_use_cases]")
+        sys.exit(1)
+    directory = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(__file__).parent / "use_cases"
+    store = store_from_env()
+    imported, skipped = store.import_json_dir(directory)
+    logger.info(f"📥 Import terminé: {imported} use cases importés, {skipped} ignorés ({store.path})")
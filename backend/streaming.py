@@ -0,0 +1,77 @@
+"""
+Streaming de l'analyse : parsing incrémental du JSON Structured Outputs
+Chaque section de premier niveau est extraite dès que sa valeur JSON est complète
+"""
+import json
+from typing import Any, List, Tuple
+
+
+class SectionStreamParser:
+    """
+    Parser incrémental d'un objet JSON de premier niveau.
+    feed() reçoit les fragments au fil de l'eau et retourne les sections (clé, valeur)
+    dont la valeur vient d'être fermée. Ne gère que la forme produite par Structured Outputs
+    (un objet racine, clés de premier niveau chaînes).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def _emit(self, end: int) -> Tuple[str, Any]:
+        section = (self._key, json.loads(self.text[self._value_start:end]))
+        self._key = None
+        self._value_start = None
+        return section
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.text += chunk
+        sections = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    # Fin d'une clé de premier niveau
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = i
+            elif c == ":" and self._depth == 1 and self._value_start is None:
+                self._value_start = i + 1
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._value_start is not None:
+                    if self._depth == 1:
+                        # Objet / liste de section refermé
+                        sections.append(self._emit(i + 1))
+                    elif self._depth == 0:
+                        # Valeur scalaire en dernière position
+                        sections.append(self._emit(i))
+            elif c == "," and self._depth == 1 and self._value_start is not None:
+                # Valeur scalaire suivie d'une autre clé
+                sections.append(self._emit(i))
+        self._pos = len(text)
+        return sections
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Formate un événement Server-Sent Events (data JSON sur une ligne)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
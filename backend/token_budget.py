@@ -0,0 +1,283 @@
+"""
+Budget de tokens du prompt d'analyse
+- Mesure locale des tokens (tiktoken si installé, sinon approximation par découpage des mots)
+- Budget d'entrée par requête : les réponses libres (q5, q6, q12, q13, q16, q18) trop longues sont
+  compactées (espaces, doublons, résumé extractif, puis coupe) pour tenir dans la part qui leur revient
+- max_tokens dimensionné sur les réponses observées (p99 × marge), plafonné à MAX_TOKENS
+"""
+import os
+import re
+import math
+import logging
+import importlib.util
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# tiktoken (optionnel, import lourd) n'est chargé qu'au premier comptage ; absent : approximation locale
+TIKTOKEN_INSTALLED = importlib.util.find_spec("tiktoken") is not None
+
+logger = logging.getLogger(__name__)
+
+# Réponses libres du formulaire (collées telles quelles par l'utilisateur)
+FREE_TEXT_FIELDS = ("q5", "q6", "q12", "q13", "q16", "q18")
+
+# Encodage des modèles gpt-4o
+DEFAULT_ENCODING = "o200k_base"
+
+# Approximation sans tokenizer : mots découpés par 4 caractères, ponctuation = 1 token
+_APPROX_RE = re.compile(r"\w{1,4}|[^\w\s]")
+_SPACES_RE = re.compile(r"[ \t ]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|$)")
+_WORD_RE = re.compile(r"\w{4,}")
+_NORMALIZE_RE = re.compile(r"\W+")
+
+ELLIPSIS = " […]"
+
+# Mots trop fréquents pour caractériser une phrase (résumé extractif)
+STOPWORDS = frozenset(
+    "alors aussi avec avoir cette chaque comme dans depuis donc elle elles être fait faire leur leurs "
+    "mais même nous pour plus sans sont tous tout toute toutes très vous être avons avez doit"
+    .split()
+)
+
+
+# ==================== COMPTAGE ====================
+
+_tokenizer_failed = False
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: Optional[str]):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: Optional[str], model: Optional[str] = None) -> int:
+    """Nombre de tokens du texte (tiktoken, ou approximation si indisponible)"""
+    global _tokenizer_failed
+    if not text:
+        return 0
+    if TIKTOKEN_INSTALLED and not _tokenizer_failed:
+        try:
+            return len(_encoding(model).encode(text, disallowed_special=()))
+        except Exception as e:
+            # Fichier d'encodage non téléchargeable (hors ligne) : approximation pour le reste du process
+            _tokenizer_failed = True
+            logger.warning(f"⚠️ Tokenizer indisponible, approximation locale: {e}")
+    return len(_APPROX_RE.findall(text))
+
+
+def tokenizer_name() -> str:
+    return "tiktoken" if TIKTOKEN_INSTALLED and not _tokenizer_failed else "approx"
+
+
+# ==================== COMPACTION D'UN TEXTE ====================
+
+def normalize(text: str) -> str:
+    """Espaces multiples, fins de ligne et lignes vides en trop"""
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.replace("\r\n", "\n").split("\n")]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _sentences(text: str) -> List[Tuple[str, bool]]:
+    """(phrase, fin de ligne après) dans l'ordre du texte"""
+    units = []
+    for line in text.split("\n"):
+        parts = [m.group(0).strip() for m in _SENTENCE_RE.finditer(line) if m.group(0).strip()]
+        for i, part in enumerate(parts):
+            units.append((part, i == len(parts) - 1))
+    return units
+
+
+def _join(units: List[Tuple[str, bool]]) -> str:
+    out = []
+    for i, (sentence, line_end) in enumerate(units):
+        out.append(sentence)
+        if i < len(units) - 1:
+            out.append("\n" if line_end else " ")
+    return "".join(out)
+
+
+def deduplicate(text: str) -> str:
+    """Supprime les phrases répétées (copier-coller en double), casse et ponctuation ignorées"""
+    seen, kept = set(), []
+    for sentence, line_end in _sentences(text):
+        key = _NORMALIZE_RE.sub(" ", sentence.lower()).strip()
+        if key and key in seen:
+            continue
+        seen.add(key)
+        kept.append((sentence, line_end))
+    return _join(kept)
+
+
+def summarize(text: str, budget: int, model: Optional[str] = None) -> str:
+    """
+    Résumé extractif : garde la première phrase puis les plus informatives (mots fréquents
+    du texte, fin favorisée) dans la limite du budget, dans leur ordre d'origine.
+    """
+    units = _sentences(text)
+    if len(units) <= 1:
+        return text
+    frequencies: Dict[str, int] = {}
+    words_per_unit = []
+    for sentence, _ in units:
+        words = [w for w in (w.lower() for w in _WORD_RE.findall(sentence)) if w not in STOPWORDS]
+        words_per_unit.append(words)
+        for w in set(words):
+            frequencies[w] = frequencies.get(w, 0) + 1
+    scores = []
+    for i, words in enumerate(words_per_unit):
+        score = sum(frequencies[w] for w in set(words)) / math.sqrt(len(words) + 1)
+        if i == len(units) - 1:
+            score *= 1.3  # la dernière exprime souvent le résultat attendu
+        scores.append(score)
+
+    budget -= count_tokens(ELLIPSIS, model)
+    chosen, used = set(), 0
+    # La première phrase pose en général le besoin : toujours candidate en premier
+    order = [0] + sorted(range(1, len(units)), key=lambda k: -scores[k])
+    for i in order:
+        cost = count_tokens(units[i][0], model) + 1
+        if used + cost <= budget:
+            chosen.add(i)
+            used += cost
+    if not chosen:
+        return text
+    kept = [units[i] for i in sorted(chosen)]
+    summary = _join(kept)
+    return summary + ELLIPSIS if len(chosen) < len(units) else summary
+
+
+def truncate(text: str, budget: int, model: Optional[str] = None) -> str:
+    """Coupe au budget (recherche dichotomique sur la longueur), en fin de mot"""
+    if count_tokens(text, model) <= budget:
+        return text
+    budget -= count_tokens(ELLIPSIS, model)
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid], model) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    space = cut.rfind(" ")
+    if space > low * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + ELLIPSIS
+
+
+def compact(text: str, budget: int, model: Optional[str] = None) -> str:
+    """Étapes de plus en plus destructrices, arrêtées dès que le texte tient dans le budget"""
+    for step in (normalize, deduplicate):
+        text = step(text)
+        if count_tokens(text, model) <= budget:
+            return text
+    text = summarize(text, budget, model)
+    return truncate(text, budget, model)
+
+
+# ==================== BUDGET D'ENTRÉE ====================
+
+class InputBudget:
+    """Budget d'entrée (tokens du prompt complet) et plafond par réponse libre"""
+
+    def __init__(self, total: int = 4000, per_field: int = 1200, min_field: int = 48):
+        self.total = total
+        self.per_field = per_field
+        self.min_field = min_field
+
+    @classmethod
+    def from_env(cls) -> "InputBudget":
+        return cls(
+            total=int(os.environ.get("PROMPT_INPUT_BUDGET", "4000")),
+            per_field=int(os.environ.get("PROMPT_FIELD_MAX_TOKENS", "1200")),
+        )
+
+    def allocate(self, sizes: Dict[str, int], available: int) -> Dict[str, int]:
+        """
+        Part de chaque réponse libre : les réponses courtes gardent tout, le reste du budget
+        est partagé également entre les plus longues (remplissage par niveau).
+        """
+        caps = {field: min(size, self.per_field) for field, size in sizes.items()}
+        remaining = max(available, self.min_field * len(caps))
+        pending = sorted(caps, key=lambda f: caps[f])
+        allocation = {}
+        while pending:
+            share = remaining // len(pending)
+            field = pending[0]
+            if caps[field] <= share:
+                allocation[field] = caps[field]
+                remaining -= caps[field]
+                pending.pop(0)
+            else:
+                for field in pending:
+                    allocation[field] = max(self.min_field, share)
+                break
+        return allocation
+
+
+def fit_fields(values: Dict[str, str], fixed_tokens: int, budget: InputBudget,
+               model: Optional[str] = None) -> Tuple[Dict[str, str], Dict[str, Tuple[int, int]], int]:
+    """
+    Compacte les réponses libres pour que fixed_tokens + réponses tiennent dans budget.total.
+    Retourne (valeurs finales, {champ compacté: (tokens avant, après)}, tokens des réponses libres).
+    """
+    sizes = {field: count_tokens(values.get(field), model) for field in FREE_TEXT_FIELDS if values.get(field)}
+    total = sum(sizes.values())
+    over_field = any(size > budget.per_field for size in sizes.values())
+    if fixed_tokens + total <= budget.total and not over_field:
+        return values, {}, total
+    allocation = budget.allocate(sizes, budget.total - fixed_tokens)
+    fitted, compacted = dict(values), {}
+    for field, size in sizes.items():
+        if size > allocation[field]:
+            fitted[field] = compact(values[field], allocation[field], model)
+            compacted[field] = (size, count_tokens(fitted[field], model))
+    final_total = total - sum(before - after for before, after in compacted.values())
+    return fitted, compacted, final_total
+
+
+# ==================== BUDGET DE SORTIE ====================
+
+class OutputBudget:
+    """
+    max_tokens ajusté aux réponses observées : p99 des derniers completion_tokens × marge,
+    borné par [floor, cap]. Tant qu'il y a trop peu de mesures : cap.
+    """
+
+    def __init__(self, cap: int = 2000, floor: int = 1000, margin: float = 1.3,
+                 window: int = 200, min_samples: int = 20):
+        self.cap = cap
+        self.floor = min(floor, cap)
+        self.margin = margin
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, cap: int) -> "OutputBudget":
+        return cls(
+            cap=int(os.environ.get("OUTPUT_MAX_TOKENS", str(cap))),
+            floor=int(os.environ.get("OUTPUT_MIN_TOKENS", "1000")),
+            margin=float(os.environ.get("OUTPUT_TOKENS_MARGIN", "1.3")),
+        )
+
+    def observe(self, completion_tokens: Optional[int]):
+        if completion_tokens:
+            with self._lock:
+                self._samples.append(completion_tokens)
+
+    def max_tokens(self) -> int:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return self.cap
+        p99 = samples[min(len(samples) - 1, int(round(0.99 * (len(samples) - 1))))]
+        return max(self.floor, min(self.cap, int(math.ceil(p99 * self.margin))))
@@ -404,25 +404,63 @@ document.addEventListener('DOMContentLoaded', function() {
       try {
         const formData = serializeForm();
         
-        const response = await fetch('http://localhost:5050/analyze', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ form_data: formData })
-        });
-        
-        if (!response.ok) {
-          throw new Error('HTTP ' + response.status);
+        // Analyse en streaming : chaque section s'affiche dès qu'elle est prête
+        // persist : le backend sauvegarde lui-même le use case (pas de renvoi de l'analyse à /save)
+        const body = { form_data: formData, persist: true };
+        // Ré-analyse après modification : seules les sections touchées sont redemandées à l'IA
+        if (currentAnalysisResult) {
+          if (currentAnalysisResult.use_case_id) {
+            body.base_use_case_id = currentAnalysisResult.use_case_id;
+          } else {
+            body.previous = { form_data: currentAnalysisResult.form_data, analysis: currentAnalysisResult.ai_analysis };
+          }
+        }
+        const partial = {};
+        let result = null;
+        let savedId = null;
+        let serverError = null;
+        try {
+          const response = await fetch('http://localhost:5050/analyze/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+          });
+          
+          if (!response.ok) {
+            serverError = new Error('HTTP ' + response.status);
+            throw serverError;
+          }
+          
+          await readSSE(response, function(event, data) {
+            if (event === 'section') {
+              partial[data.name] = data.data;
+              displaySumUpIA(partial);
+            } else if (event === 'done') {
+              result = data;
+            } else if (event === 'saved') {
+              savedId = data.id;
+            } else if (event === 'error') {
+              serverError = new Error(data.detail || ('HTTP ' + data.status));
+              throw serverError;
+            }
+          });
+        } catch (e) {
+          if (serverError) throw serverError;
         }
         
-        const result = await response.json();
-        currentAnalysisResult = { form_data: formData, ai_analysis: result };
+        if (!result) {
+          // Flux coupé (proxy, réseau) : l'analyse est reprise en tâche de fond et suivie par polling
+          analyzeBtn.textContent = '⏳ Analyse en tâche de fond...';
+          ({ result, savedId } = await analyzeInBackground(body));
+        }
+        currentAnalysisResult = { form_data: formData, ai_analysis: result, use_case_id: savedId };
         
         // Afficher dans SumUp (page 5) et Analyse IA (page 6)
         displaySumUpIA(result);
         displayAnalysisResult(result);
         
-        // Sauvegarder automatiquement
-        await autoSaveUseCase(formData, result);
+        // Sauvegarder automatiquement (confirmation par identifiant si déjà persisté)
+        await autoSaveUseCase(formData, result, savedId);
         
       } catch (e) {
         aiAnalysisOutput.innerHTML = '<p style="color: #dc3545; padding: 10px; background: #f8d7da; border-radius: 8px;">❌ Erreur: ' + e.message + '<br>Vérifiez que le backend est lancé (uvicorn main:app --port 5050)</p>';
@@ -433,13 +471,71 @@ document.addEventListener('DOMContentLoaded', function() {
     });
   }
   
+  // Analyse en tâche de fond : job créé par /analyze ("background": true) puis suivi par GET /jobs/{id}
+  // (aucune requête longue : rien à couper pour un proxy)
+  async function analyzeInBackground(body) {
+    const response = await fetch('http://localhost:5050/analyze', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(Object.assign({}, body, { background: true }))
+    });
+    if (!response.ok) {
+      throw new Error('HTTP ' + response.status);
+    }
+    let job = await response.json();
+    while (job.status === 'queued' || job.status === 'running') {
+      await new Promise(function(resolve) { setTimeout(resolve, 2000); });
+      let poll;
+      try {
+        poll = await fetch('http://localhost:5050/jobs/' + job.id);
+      } catch (e) {
+        continue;  // Coupure réseau passagère : le job continue côté serveur
+      }
+      if (poll.status === 404) {
+        throw new Error('Job ' + job.id + ' introuvable');
+      }
+      if (poll.ok) job = await poll.json();
+    }
+    if (job.status !== 'succeeded') {
+      throw new Error(job.error || ('Analyse ' + job.status));
+    }
+    return { result: job.result, savedId: job.use_case_id };
+  }
+  
+  // Lecture d'un flux Server-Sent Events (fetch + ReadableStream)
+  async function readSSE(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, idx);
+        buffer = buffer.slice(idx + 2);
+        let event = 'message';
+        let data = '';
+        raw.split('\n').forEach(function(line) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        });
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+  
   // Sauvegarde automatique du use case
-  async function autoSaveUseCase(formData, aiResult) {
+  async function autoSaveUseCase(formData, aiResult, savedId) {
     try {
+      const body = savedId
+        ? { use_case_id: savedId }
+        : { form_data: formData, ai_analysis: aiResult };
       const response = await fetch('http://localhost:5050/save', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ form_data: formData, ai_analysis: aiResult })
+        body: JSON.stringify(body)
       });
       
       if (!response.ok) {
@@ -448,7 +544,7 @@ document.addEventListener('DOMContentLoaded', function() {
       
         const result = await response.json();
         // Sauvegarde silencieuse (pas de message affiché)
-        console.log('💾 Use case sauvegardé:', result.filename);
+        console.log('💾 Use case sauvegardé:', result.id);
         
     } catch (e) {
         // Sauvegarde silencieuse - erreur non affichée
@@ -456,12 +552,137 @@ document.addEventListener('DOMContentLoaded', function() {
       }
   }
   
+  // ==================== USE CASES SIMILAIRES ====================
+  // Avant l'analyse : use cases déjà sauvegardés proches du brief (q5), de l'exécution actuelle (q6) et des sources (q14)
+  let similarTimer = null;
+  let similarQuery = '';
+  function scheduleSimilarCheck(e) {
+    if (e && e.target && ['q5', 'q6', 'q14'].indexOf(e.target.name) === -1) return;
+    if (similarTimer) clearTimeout(similarTimer);
+    similarTimer = setTimeout(checkSimilarUseCases, 800);
+  }
+  
+  async function checkSimilarUseCases() {
+    const section = document.getElementById('similar-section');
+    const output = document.getElementById('similar-output');
+    if (!section || !output) return;
+    
+    const d = serializeForm();
+    const query = [d.q5, d.q6, d.q14].map(function(v) { return (v || '').trim(); }).join('\n');
+    if (query === similarQuery) return;
+    similarQuery = query;
+    if (!query.trim()) {
+      section.style.display = 'none';
+      return;
+    }
+    
+    try {
+      const response = await fetch('http://localhost:5050/use-cases/similar', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ form_data: { q5: d.q5, q6: d.q6, q14: d.q14 }, limit: 3 })
+      });
+      if (!response.ok) {
+        throw new Error('HTTP ' + response.status);
+      }
+      const result = await response.json();
+      if (!result.matches.length) {
+        section.style.display = 'none';
+        return;
+      }
+      output.innerHTML = '<p style="margin: 0 0 10px; color: #6c757d;">Ces use cases décrivent peut-être le même process :</p>' +
+        result.matches.map(function(m) {
+          return `
+            <div class="recap-item">
+              <div class="recap-label">${Math.round(m.score * 100)} % · ${escapeHtml(m.department || '—')}</div>
+              <div class="recap-value"><strong>${escapeHtml(m.project_name || 'Sans titre')}</strong> — ${escapeHtml(m.persona || '—')} (${escapeHtml((m.saved_at || '').slice(0, 10))})</div>
+            </div>`;
+        }).join('');
+      section.style.display = 'block';
+    } catch (e) {
+      // Backend indisponible : rien d'affiché, l'analyse reste possible
+      console.error('⚠️ Use cases similaires:', e);
+      similarQuery = '';
+    }
+  }
+  
+  // ==================== SCORING EN DIRECT (PAGE 5) ====================
+  // Faisabilité, urgence, ETP et économie annuelle recalculés par le backend (POST /score, sans IA)
+  // à chaque frappe sur une question qui les alimente ; q14 est classé localement par le backend
+  const LIVE_SCORE_INPUTS = ['q7', 'q8', 'q9_days', 'q9_hours', 'q9_minutes', 'q10', 'q11', 'q14', 'q15', 'q17', 'q19'];
+  const LIVE_SCORE_FIELDS = ['q7', 'q8', 'q9', 'q9_total_hours', 'q10', 'q11', 'q14', 'q15', 'q17', 'q19'];
+  let liveScoreTimer = null;
+  let liveScoreQuery = '';
+  let liveScoreController = null;
+  function scheduleLiveScore(e) {
+    if (e && e.target && e.target.id !== 'live-cout-horaire' && LIVE_SCORE_INPUTS.indexOf(e.target.name) === -1) return;
+    if (liveScoreTimer) clearTimeout(liveScoreTimer);
+    liveScoreTimer = setTimeout(updateLiveScore, 80);
+  }
+  
+  async function updateLiveScore() {
+    const output = document.getElementById('live-score-output');
+    if (!output) return;
+    
+    const d = serializeForm();
+    const formData = {};
+    LIVE_SCORE_FIELDS.forEach(function(key) {
+      if (d[key] !== undefined && d[key] !== '') formData[key] = d[key];
+    });
+    const costInput = document.getElementById('live-cout-horaire');
+    const hourlyCost = costInput ? parseFloat(costInput.value) : NaN;
+    const body = JSON.stringify({ form_data: formData, hourly_cost: hourlyCost > 0 ? hourlyCost : null });
+    if (body === liveScoreQuery) return;
+    liveScoreQuery = body;
+    
+    // Une frappe plus récente rend la requête en cours inutile
+    if (liveScoreController) liveScoreController.abort();
+    liveScoreController = new AbortController();
+    try {
+      const response = await fetch('http://localhost:5050/score', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: body,
+        signal: liveScoreController.signal
+      });
+      if (!response.ok) {
+        throw new Error('HTTP ' + response.status);
+      }
+      const s = await response.json();
+      const sources = s.sources.total_sources
+        ? `${s.sources.total_sources} source(s), ${s.sources.count} type(s), catégorie ${escapeHtml(s.sources.complexity_level)}${s.sources.confident ? '' : ' (à confirmer par l\'analyse IA)'}`
+        : 'Aucune source renseignée (Q14)';
+      output.innerHTML = `
+        <div class="scoring-row" style="padding: 12px; background: #e7f1ff; border-radius: 6px; margin-bottom: 8px;">
+          <span style="font-weight: 600; font-size: 15px;">Gain Business</span>
+          <span style="font-size: 20px; font-weight: 700; color: #0d6efd;">${s.etp.toFixed(1)} ETP/mois</span>
+        </div>
+        <div class="scoring-row">
+          <span>Faisabilité Technique</span>
+          <span class="score-number">${s.faisabilite}/100</span>
+        </div>
+        <div class="scoring-row">
+          <span>Urgence</span>
+          <span class="score-number">${s.urgence}/100</span>
+        </div>
+        <p class="hint" style="margin: 8px 0 0;">⏱️ ${Math.round(s.gain_temps_mensuel_heures)}h/mois · ${sources}</p>
+        ${s.annual_cost !== null ? `<p style="margin: 8px 0 0; color: #856404;"><strong>📊 Économie annuelle estimée :</strong> <span style="font-weight: 700; color: #28a745;">${s.annual_cost.toLocaleString('fr-FR')} €/an</span></p>` : ''}
+      `;
+    } catch (e) {
+      if (e.name === 'AbortError') return;
+      // Backend indisponible : le récapitulatif reste affiché sans scoring
+      console.error('⚠️ Scoring en direct:', e);
+      liveScoreQuery = '';
+    }
+  }
+  
   // Affichage dans SumUp (page 5) - Intégré dans le récapitulatif
+  // Accepte une analyse partielle (streaming) : chaque bloc s'affiche dès que sa section est reçue
   function displaySumUpIA(result) {
     // Afficher le titre du projet en haut
     const sumupSection = document.getElementById('ai-sumup-section');
     const sumupOutput = document.getElementById('ai-sumup-output');
-    if (sumupOutput && sumupSection) {
+    if (sumupOutput && sumupSection && result.user_story) {
       sumupOutput.innerHTML = `
         <div class="project-name-section">
           <h3 class="project-name">🎯 ${escapeHtml(result.user_story.project_name)}</h3>
@@ -472,7 +693,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 1. User Story après Q5
     const userStoryPlaceholder = document.getElementById('ia-user-story-placeholder');
-    if (userStoryPlaceholder) {
+    if (userStoryPlaceholder && result.user_story) {
       userStoryPlaceholder.innerHTML = `
         <div class="recap-item" style="background: #e7f5ff; border-left: 4px solid #0d6efd; margin-top: 10px;">
           <div class="recap-label" style="color: #0d6efd; font-weight: 600;">🤖 User Story (générée par IA)</div>
@@ -485,7 +706,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 2. Schéma d'exécution après Q6
     const schemaPlaceholder = document.getElementById('ia-execution-schema-placeholder');
-    if (schemaPlaceholder) {
+    if (schemaPlaceholder && result.execution_schema) {
       schemaPlaceholder.innerHTML = `
         <div class="recap-item" style="background: #e7f5ff; border-left: 4px solid #0d6efd; margin-top: 10px;">
           <div class="recap-label" style="color: #0d6efd; font-weight: 600;">🤖 Schéma d'exécution (généré par IA)</div>
@@ -498,7 +719,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 3. Éléments sources analysés après Q14
     const elementsPlaceholder = document.getElementById('ia-elements-sources-placeholder');
-    if (elementsPlaceholder) {
+    if (elementsPlaceholder && result.elements_sources) {
       elementsPlaceholder.innerHTML = `
         <div class="recap-item" style="background: #e7f5ff; border-left: 4px solid #0d6efd; margin-top: 10px;">
           <div class="recap-label" style="color: #0d6efd; font-weight: 600;">🤖 Éléments sources analysés (par IA)</div>
@@ -848,6 +1069,9 @@ document.addEventListener('DOMContentLoaded', function() {
   form.addEventListener("change", scheduleSave);
   form.addEventListener("input", renderRecap);
   form.addEventListener("change", renderRecap);
+  form.addEventListener("input", scheduleSimilarCheck);
+  form.addEventListener("input", scheduleLiveScore);
+  form.addEventListener("change", scheduleLiveScore);
   
   // Load saved data
   load();
@@ -857,6 +1081,8 @@ document.addEventListener('DOMContentLoaded', function() {
   
   // Initial recap
   renderRecap();
+  checkSimilarUseCases();
+  updateLiveScore();
   
   console.log('=== TOUT EST PRÊT ===');
 });